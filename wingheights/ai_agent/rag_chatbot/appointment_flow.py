@@ -0,0 +1,81 @@
+from intent_router import intent_router, TEMPLATES, AFFIRM, BOOKING, DENY
+
+# Conversation-driven booking used by test.py and the RAG mode of asgi_server.py
+APPOINTMENT_FIELDS = ["Name", "Contact Number", "Email", "Appointment Date", "Insurance Type"]
+BOOKING_PROMPT = "\n\nWould you like to book an appointment? Please respond with 'Yes' or 'No'."
+BOOKING_START_RESPONSE = "Great! Let's book an appointment. Please provide your Name:"
+BOOKING_CANCELLED_RESPONSE = "No problem, I've cancelled the booking. How else can I assist you with our insurance services?"
+
+
+def new_session():
+    return {
+        'appointment_details': {},
+        'booking_confirmed': False,
+        'awaiting_confirmation': False
+    }
+
+
+def in_booking_flow(session):
+    return session['booking_confirmed'] or session['awaiting_confirmation']
+
+
+def booking_turn(session, user_input, intent=None):
+    # Returns (response, completed_row). response is None when the turn is an
+    # open question for the RAG chain; completed_row is set once every field
+    # of an appointment has been collected.
+    if session['booking_confirmed']:
+        # "cancel", "no", "I don't want to book an appointment" leave the form
+        if intent_router.classify(user_input).name == DENY:
+            session['appointment_details'] = {}
+            session['booking_confirmed'] = False
+            return BOOKING_CANCELLED_RESPONSE, None
+        current_field = APPOINTMENT_FIELDS[len(session['appointment_details'])]
+        session['appointment_details'][current_field] = user_input
+
+        if len(session['appointment_details']) < len(APPOINTMENT_FIELDS):
+            next_field = APPOINTMENT_FIELDS[len(session['appointment_details'])]
+            return f"Thank you. Now, please provide your {next_field}:", None
+
+        summary = "Appointment Details:\n"
+        for field in APPOINTMENT_FIELDS:
+            summary += f"{field}: {session['appointment_details'].get(field, 'Not provided')}\n"
+        response = f"Thank you for providing all the details. Here's a summary of your appointment:\n\n{summary}\nWe look forward to assisting you!"
+        completed = [session['appointment_details'].get(field, 'Not provided') for field in APPOINTMENT_FIELDS]
+        session['appointment_details'] = {}
+        session['booking_confirmed'] = False
+        return response, completed
+
+    if session['awaiting_confirmation']:
+        answer = intent_router.classify(user_input).name
+        if answer == AFFIRM:
+            session['booking_confirmed'] = True
+            session['appointment_details'] = {}
+            response = BOOKING_START_RESPONSE
+        elif answer == DENY:
+            response = "No problem. How else can I assist you with our insurance services?"
+            session['appointment_details'] = {}
+            session['booking_confirmed'] = False
+        else:
+            response = "I'm sorry, I didn't understand your response. Please answer with 'Yes' or 'No'. Would you like to book an appointment?"
+        session['awaiting_confirmation'] = answer not in (AFFIRM, DENY)
+        return response, None
+
+    if intent is not None and intent.name == BOOKING:
+        session['booking_confirmed'] = True
+        session['appointment_details'] = {}
+        return BOOKING_START_RESPONSE, None
+    if intent is not None and intent.name in TEMPLATES:
+        return TEMPLATES[intent.name], None
+    return None, None
+
+
+def offer_booking(session, response):
+    # The prompt to append when the answer suggests booking, or ''
+    if "book an appointment" in response.lower():
+        session['awaiting_confirmation'] = True
+        return BOOKING_PROMPT
+    return ''
+
+
+def requires_input(session):
+    return session['awaiting_confirmation'] or session['booking_confirmed']
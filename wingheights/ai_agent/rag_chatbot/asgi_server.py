@@ -0,0 +1,674 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import socketio
+from dotenv import load_dotenv
+
+load_dotenv()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Configure logging
+logging.basicConfig(
+    level=LOG_LEVEL,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('asgi_server.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+from token_accounting import token_accountant, TokenUsage
+from history_writer import history_writer
+from semantic_cache import semantic_cache
+from components import ComponentRegistry
+from batcher import MicroBatcher
+from llm_dispatch import (
+    AsyncLLMDispatcher, LLM_TIMEOUT, PRIORITY_APPOINTMENT, PRIORITY_BACKGROUND, PRIORITY_CHAT, QueueFullError,
+    DeadlineExceededError
+)
+from session_store import register_type, SESSION_BACKEND, SOCKETIO_MESSAGE_QUEUE
+from session_manager import session_manager
+from conversation_memory import ConversationMemory
+from intent_router import intent_router, CentroidClassifier, TEMPLATES, AFFIRM, BOOKING, DENY
+from appointment_flow import booking_turn, in_booking_flow, new_session, offer_booking, requires_input
+from context_builder import context_builder
+from prompts import (
+    CHAT_SYSTEM_PROMPT, FAREWELL_SYSTEM_PROMPT, SUMMARY_SYSTEM_PROMPT, APPOINTMENT_FORM_RESPONSE,
+    DECLINE_RESPONSE, OVER_BUDGET_RESPONSE, LLM_BUSY_RESPONSE, LLM_FALLBACK_RESPONSE, RAG_ERROR_RESPONSE,
+    farewell_prompt, citation_for, offers_appointment, rag_messages
+)
+from rag_pipeline import DB_FAISS_PATH, create_vector_db, load_embeddings, load_vector_db, retrieval_batch_handler, vector_store_version
+from metrics import Gauge, messages_total, recent_traces, render as render_metrics, stage, tokens_total, traced
+
+# Asyncio-native alternative to the eventlet servers: python-socketio's
+# AsyncServer under uvicorn, async Groq/Ollama clients, and the CPU-bound work
+# (token counting, embedding, FAISS search) on a thread pool. CHATBOT_APP
+# picks which protocol to speak: 'groq' is model_1.py's, 'rag' is test.py's.
+CHATBOT_APP = os.getenv('CHATBOT_APP', 'groq')
+EXECUTOR_WORKERS = int(os.getenv('EXECUTOR_WORKERS', 8))
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
+WARM_UP_ON_START = os.getenv('WARM_UP_ON_START', 'true').lower() == 'true'
+LLAMA_MODEL = os.getenv('LLAMA_MODEL', 'llama3.2:1b')
+
+# model_1.py settings
+CHATBOT_DATA_PATH = "chatbot_data.csv"
+APPOINTMENTS_CSV_PATH = "appointments.csv"
+USER_DATA_PATH = "user_data.csv"
+CHAT_HISTORY_PATH = "chat_history.csv"
+MAX_TOKENS = 1000
+PROMPT_HISTORY_TOKENS = int(os.getenv('PROMPT_HISTORY_TOKENS', MAX_TOKENS // 2))
+SUMMARIZE_WITH_LLM = os.getenv('SUMMARIZE_WITH_LLM', 'true').lower() == 'true'
+
+# test.py settings
+APPOINTMENT_DETAILS_PATH = 'appointment_details.csv'
+
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins='*',
+    ping_timeout=300,
+    ping_interval=60,
+    # With a message queue, several workers can emit to clients connected to any of them
+    client_manager=socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE) if SOCKETIO_MESSAGE_QUEUE else None
+)
+
+register_type('usage', TokenUsage, TokenUsage.to_list, TokenUsage.from_list)
+register_type('memory', ConversationMemory, ConversationMemory.to_list, ConversationMemory.from_list)
+# Socket.IO sid -> session id handed out in session_created (groq protocol)
+client_sessions = {}
+# Sessions with a summary being written in the background, and the tasks writing them
+folding_sessions = set()
+background_tasks = set()
+
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='asgi-cpu')
+llm_dispatcher = AsyncLLMDispatcher()
+connected_clients = Gauge('connected_clients', "Open Socket.IO connections")
+
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args))
+
+
+async def load_session(session_id):
+    # The in-memory store is a dict lookup; SQLite and Redis go through the pool
+    if SESSION_BACKEND == 'memory':
+        return session_manager.get(session_id)
+    return await run_blocking(session_manager.get, session_id)
+
+
+async def delete_session(session_id):
+    if SESSION_BACKEND == 'memory':
+        return session_manager.delete(session_id)
+    return await run_blocking(session_manager.delete, session_id)
+
+
+async def save_session(session_id, session):
+    if SESSION_BACKEND == 'memory':
+        return session_manager.put(session_id, session)
+    return await run_blocking(session_manager.put, session_id, session)
+
+
+async def write_history(target, row):
+    # history_writer.write blocks while its queue is full; keep that wait off the loop
+    if history_writer.queue.full():
+        await run_blocking(history_writer.write, target, row)
+    else:
+        history_writer.write(target, row)
+
+
+def chunk_emitter(sid):
+    return lambda chunk: sio.emit('response_chunk', {'chunk': chunk}, to=sid)
+
+
+# Groq: model_1.py's protocol
+
+groq_client = None
+
+
+async def generate_response(messages, max_tokens, on_chunk=None, priority=PRIORITY_CHAT):
+    async def complete(timeout):
+        if on_chunk is None:
+            chat_completion = await groq_client.chat.completions.create(
+                messages=messages,
+                model=os.getenv('LLAMA_MODEL'),
+                temperature=0.7,
+                max_tokens=max_tokens,
+                timeout=timeout
+            )
+            return chat_completion.choices[0].message.content
+
+        stream = await groq_client.chat.completions.create(
+            messages=messages,
+            model=os.getenv('LLAMA_MODEL'),
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=timeout
+        )
+        parts = []
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                await on_chunk(delta)
+        return ''.join(parts)
+
+    with stage('llm'):
+        return await llm_dispatcher.call(complete, priority=priority)
+
+
+async def summarize(summary, turns):
+    transcript = "\n".join(f"{role}: {content}" for role, content, _ in turns)
+    return await generate_response(
+        [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{summary or 'None'}\n\nNew turns:\n{transcript}"}
+        ],
+        max_tokens=150,
+        priority=PRIORITY_BACKGROUND
+    )
+
+
+async def compact_memory(session_id, session):
+    # Called once the reply is out. The summary is written in a background
+    # task from a snapshot, then merged into a freshly loaded session so turns
+    # and form state saved in the meantime are kept.
+    memory = session['context']['memory']
+    folding = memory.foldable()
+    if not folding or session_id in folding_sessions:
+        return
+    folding_sessions.add(session_id)
+    snapshot = ConversationMemory(None, memory.summary, memory.summary_tokens, memory.folded)
+    task = asyncio.create_task(fold_memory(session_id, snapshot, folding))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def fold_memory(session_id, snapshot, folding):
+    # Token counting runs on the pool; the summarizer call hops back onto the loop
+    loop = asyncio.get_running_loop()
+
+    def summarizer(summary, turns):
+        return asyncio.run_coroutine_threadsafe(summarize(summary, turns), loop).result()
+
+    try:
+        with stage('summarize'):
+            summary, summary_tokens = await run_blocking(
+                snapshot.fold_summary, folding, summarizer if SUMMARIZE_WITH_LLM else None
+            )
+        session = await load_session(session_id)
+        if session and session['context']['memory'].apply_fold(folding, summary, summary_tokens, snapshot.folded):
+            await save_session(session_id, session)
+            logger.info(f"Folded older turns into the summary for session {session_id}")
+    except Exception as e:
+        logger.error(f"Error folding memory for session {session_id}: {str(e)}")
+    finally:
+        folding_sessions.discard(session_id)
+
+
+async def emit_response(sid, response, show_form, usage, stream=False):
+    if stream:
+        await sio.emit('response_done', {
+            'response': response,
+            'showForm': show_form,
+            'token_count': usage.total_tokens,
+            'max_tokens': MAX_TOKENS
+        }, to=sid)
+        return
+    await sio.emit('response', {
+        'response': response,
+        'showForm': show_form
+    }, to=sid)
+
+
+async def groq_connect(sid, environ):
+    session_id = str(uuid.uuid4())
+    await save_session(session_id, {
+        'state': 'initial',
+        'context': {
+            'memory': ConversationMemory(),
+            'appointment_details': None,
+            'usage': TokenUsage()
+        }
+    })
+    client_sessions[sid] = session_id
+    connected_clients.inc()
+    logger.info(f"New client connected. Session ID: {session_id}")
+    await sio.emit('session_created', {'session_id': session_id}, to=sid)
+
+
+async def groq_disconnect(sid):
+    # Every connection gets a new session, so it ends with the socket
+    session_id = client_sessions.pop(sid, None)
+    connected_clients.dec()
+    logger.info(f"Client disconnected. Session ID: {session_id}")
+    if session_id:
+        await delete_session(session_id)
+
+
+@traced('handle_message')
+async def groq_message(sid, data):
+    try:
+        session_id = data.get('session_id')
+        message = data.get('message', '').lower()
+
+        if not session_id:
+            logger.error("Message received without session ID")
+            await sio.emit('error', {'message': 'Missing session_id'}, to=sid)
+            return
+
+        session = await load_session(session_id)
+        if not session:
+            logger.error(f"Invalid session ID: {session_id}")
+            await sio.emit('error', {'message': 'Invalid session'}, to=sid)
+            return
+
+        usage = session['context']['usage']
+        memory = session['context']['memory']
+        message_tokens = await run_blocking(token_accountant.charge_message, usage, message)
+        tokens_total.inc(message_tokens, kind='message')
+
+        if token_accountant.over_budget(usage, MAX_TOKENS):
+            await save_session(session_id, session)
+            messages_total.inc(event='message', outcome='over_budget')
+            await emit_response(sid, OVER_BUDGET_RESPONSE, False, usage, data.get('stream', STREAM_RESPONSES))
+            return
+
+        logger.info(f"Message received from session {session_id}: {message}")
+        memory.add('user', message, message_tokens)
+        await write_history(CHAT_HISTORY_PATH, [
+            session_id,
+            'user',
+            message,
+            format(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        ])
+
+        with stage('intent'):
+            intent = intent_router.classify(message)
+        # A yes only books when the last reply offered an appointment
+        offer_pending = session.get('state') == 'offer_pending'
+        show_form = intent.name == BOOKING or (intent.name == AFFIRM and offer_pending)
+        stream = data.get('stream', STREAM_RESPONSES)
+
+        if show_form:
+            response = APPOINTMENT_FORM_RESPONSE
+            logger.info(f"Showing appointment form to session {session_id}")
+        elif intent.name == DENY and offer_pending:
+            response = DECLINE_RESPONSE
+        elif intent.name in TEMPLATES:
+            response = TEMPLATES[intent.name]
+        else:
+            with stage('prompt'):
+                messages = memory.build_messages(CHAT_SYSTEM_PROMPT, PROMPT_HISTORY_TOKENS)
+            response = await generate_response(
+                messages,
+                max_tokens=300,
+                on_chunk=chunk_emitter(sid) if stream else None
+            )
+        session['state'] = 'offer_pending' if offers_appointment(response) else 'initial'
+        response_tokens = await run_blocking(token_accountant.charge_response, usage, response)
+        tokens_total.inc(response_tokens, kind='response')
+        messages_total.inc(event='message', outcome=intent.name)
+
+        memory.add('assistant', response, response_tokens)
+        await save_session(session_id, session)
+        await write_history(CHAT_HISTORY_PATH, [
+            session_id,
+            'bot',
+            response,
+            format(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        ])
+
+        await emit_response(sid, response, show_form, usage, stream)
+        await compact_memory(session_id, session)
+
+    except QueueFullError:
+        logger.warning(f"LLM queue full, turning away message from session {data.get('session_id')}")
+        messages_total.inc(event='message', outcome='busy')
+        await sio.emit('error', {'message': "We're receiving a lot of messages right now. Please try again in a moment."}, to=sid)
+    except DeadlineExceededError:
+        logger.warning(f"LLM call timed out for session {data.get('session_id')}")
+        messages_total.inc(event='message', outcome='timeout')
+        await sio.emit('error', {'message': 'Sorry, that took too long. Please try again.'}, to=sid)
+    except Exception as e:
+        logger.error(f"Error handling message: {str(e)}", exc_info=True)
+        messages_total.inc(event='message', outcome='error')
+        await sio.emit('error', {'message': 'Sorry, I encountered an error. Please try again.'}, to=sid)
+
+
+@traced('handle_appointment')
+async def groq_appointment(sid, data):
+    try:
+        session_id = data.get('session_id')
+        details = data.get('appointment_details')
+
+        if not all([session_id, details]):
+            logger.error("Missing required appointment data")
+            await sio.emit('error', {'message': 'Please fill in all required fields'}, to=sid)
+            return
+
+        session = await load_session(session_id)
+        if not session:
+            logger.error(f"Invalid session ID during appointment submission: {session_id}")
+            await sio.emit('error', {'message': 'Invalid session'}, to=sid)
+            return
+
+        logger.info(f"Processing appointment submission for session {session_id}")
+
+        required_fields = ['name', 'contact_number', 'email', 'date', 'time', 'insuranceType']
+        if not all(field in details for field in required_fields):
+            logger.error("Missing required appointment fields")
+            await sio.emit('error', {'message': 'Please fill in all required fields'}, to=sid)
+            return
+
+        session['context']['appointment_details'] = details
+        await save_session(session_id, session)
+
+        await write_history(APPOINTMENTS_CSV_PATH, [
+            details['name'],
+            details['contact_number'],
+            details['email'],
+            details['date'],
+            details['time'],
+            details['insuranceType']
+        ])
+        await write_history(USER_DATA_PATH, [
+            details['name'],
+            details['contact_number'],
+            details['email']
+        ])
+        await write_history(CHATBOT_DATA_PATH, [
+            session_id,
+            details['name'],
+            'appointment_scheduled'
+        ])
+        logger.info(f"Appointment data saved for session {session_id}")
+
+        memory = session['context']['memory']
+        prompt = farewell_prompt(memory.transcript(PROMPT_HISTORY_TOKENS), details)
+
+        stream = data.get('stream', STREAM_RESPONSES)
+        response = await generate_response(
+            [
+                {"role": "system", "content": FAREWELL_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=200,
+            on_chunk=chunk_emitter(sid) if stream else None,
+            priority=PRIORITY_APPOINTMENT
+        )
+        response_tokens = await run_blocking(token_accountant.charge_response, session['context']['usage'], response)
+        tokens_total.inc(response_tokens, kind='response')
+        messages_total.inc(event='submit_appointment', outcome='confirmed')
+
+        memory.add('assistant', response, response_tokens)
+        await save_session(session_id, session)
+        await write_history(CHAT_HISTORY_PATH, [
+            session_id,
+            'bot',
+            response,
+            format(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        ])
+
+        await emit_response(sid, response, False, session['context']['usage'], stream)
+        logger.info(f"Appointment confirmation sent to session {session_id}")
+        await compact_memory(session_id, session)
+
+    except (QueueFullError, DeadlineExceededError) as e:
+        logger.warning(f"LLM unavailable for appointment confirmation: {str(e)}")
+        messages_total.inc(event='submit_appointment', outcome='saved_without_confirmation')
+        await sio.emit('error', {'message': 'Your appointment was saved, but we could not generate a confirmation right now. Our team will contact you shortly.'}, to=sid)
+    except Exception as e:
+        logger.error(f"Error handling appointment submission: {str(e)}", exc_info=True)
+        messages_total.inc(event='submit_appointment', outcome='error')
+        await sio.emit('error', {'message': 'Sorry, there was an error processing your appointment. Please try again.'}, to=sid)
+
+
+# RAG: test.py's protocol
+
+ollama_client = None
+
+# Built on the pool, on first use or by the warm-up at startup
+registry = ComponentRegistry()
+registry.register('embeddings', load_embeddings)
+registry.register('vector_store', lambda: load_vector_db(registry.get('embeddings')))
+registry.register('retrieval_batcher', lambda: MicroBatcher(
+    retrieval_batch_handler(registry.get('vector_store')), name='retrieval-batcher'
+))
+registry.register('intent_classifier', lambda: CentroidClassifier(registry.get('embeddings')))
+
+
+async def get_component(name):
+    return registry.peek(name) or await run_blocking(registry.get, name)
+
+
+async def ollama_chat(query, context="", on_chunk=None):
+    messages = rag_messages(query, context)
+
+    async def complete(timeout):
+        if on_chunk is not None:
+            parts = []
+            async for chunk in await ollama_client.chat(model=LLAMA_MODEL, messages=messages, stream=True):
+                content = chunk.get('message', {}).get('content')
+                if content:
+                    parts.append(content)
+                    await on_chunk(content)
+            if parts:
+                return ''.join(parts)
+        else:
+            response = await ollama_client.chat(model=LLAMA_MODEL, messages=messages)
+            if response and 'message' in response and 'content' in response['message']:
+                return response['message']['content']
+        return LLM_FALLBACK_RESPONSE
+
+    try:
+        return await llm_dispatcher.call(complete, priority=PRIORITY_CHAT)
+    except QueueFullError:
+        logger.warning("LLM queue full, turning away request")
+        return LLM_BUSY_RESPONSE
+    except Exception as e:
+        logger.error(f"Error in ollama_chat: {str(e)}")
+    return LLM_FALLBACK_RESPONSE
+
+
+async def qa_chain(query, on_chunk=None, k=None, query_vector=None):
+    try:
+        batcher = await get_component('retrieval_batcher')
+        # Embedding, answer cache and FAISS search run batched on the batcher's thread
+        with stage('retrieve'):
+            query_vector, cached, docs = await run_blocking(batcher.submit, (query, k, query_vector))
+        if cached is not None:
+            answer, sources = cached
+            response = answer + citation_for(answer, sources)
+            if on_chunk is not None:
+                await on_chunk(response)
+            return response
+
+        with stage('prompt'):
+            context, sources = context_builder.build_with_sources(docs)
+        with stage('llm'):
+            response = await ollama_chat(query, context, on_chunk=on_chunk)
+        if response not in (LLM_FALLBACK_RESPONSE, LLM_BUSY_RESPONSE):
+            # Cached with its sources; the citation is added per reply
+            semantic_cache.store(query_vector, response, sources)
+            citation = citation_for(response, sources)
+            if citation:
+                if on_chunk is not None:
+                    await on_chunk(citation)
+                response += citation
+        return response
+    except Exception as e:
+        logger.error(f"Error in qa_chain: {str(e)}")
+        return RAG_ERROR_RESPONSE
+
+
+async def rag_connect(sid, environ):
+    logger.info(f"Client connected: {sid}")
+    connected_clients.inc()
+    await save_session(sid, new_session())
+    await sio.emit('message', {'response': "Hello! I'm an AI assistant for Wing Heights Ghana Insurance. How can I help you today?"}, to=sid)
+
+
+async def rag_disconnect(sid):
+    logger.info(f"Client disconnected: {sid}")
+    connected_clients.dec()
+    await delete_session(sid)
+
+
+async def rag_health(sid, data=None):
+    await sio.emit('health', {'ready': registry.ready(), 'components': registry.status()}, to=sid)
+
+
+@traced('handle_message')
+async def rag_message(sid, data):
+    logger.info(f"Received message from {sid}: {data}")
+    user_input = data.get('message')
+
+    if not user_input:
+        logger.warning(f"Empty message received from {sid}")
+        await sio.emit('message', {'error': "No message provided"}, to=sid)
+        return
+
+    stream = data.get('stream', STREAM_RESPONSES)
+
+    try:
+        session = await load_session(sid) or new_session()
+
+        intent = None
+        if not in_booking_flow(session):
+            classifier = registry.peek('intent_classifier')
+            with stage('intent'):
+                if classifier is None:
+                    intent = intent_router.classify(user_input)
+                else:
+                    # The classifier embeds the message, so it runs on the pool
+                    intent = await run_blocking(intent_router.classify, user_input, classifier)
+
+        response, completed = booking_turn(session, user_input, intent)
+        if completed is not None:
+            await write_history(APPOINTMENT_DETAILS_PATH, completed)
+        if response is None:
+            response = await qa_chain(user_input, on_chunk=chunk_emitter(sid) if stream else None,
+                                      query_vector=intent.vector if intent else None)
+
+            booking_prompt = offer_booking(session, response)
+            if booking_prompt:
+                response += booking_prompt
+                if stream:
+                    await sio.emit('response_chunk', {'chunk': booking_prompt}, to=sid)
+
+        await save_session(sid, session)
+        token_count = len(response.split())
+        tokens_total.inc(token_count, kind='response')
+        messages_total.inc(event='message', outcome=intent.name if intent else 'booking_flow')
+
+        logger.info(f"Sending response to {sid}: {response[:100]}...")
+        await sio.emit('response_done' if stream else 'message', {
+            "response": response,
+            "requires_input": requires_input(session),
+            "token_count": token_count,
+            "max_tokens": 2000
+        }, to=sid)
+    except Exception as e:
+        logger.error(f"Error processing message: {str(e)}", exc_info=True)
+        messages_total.inc(event='message', outcome='error')
+        await sio.emit('message', {"error": str(e)}, to=sid)
+
+
+# HTTP routes next to Socket.IO; anything under /socket.io/ goes to sio
+
+def health():
+    if CHATBOT_APP != 'rag':
+        return 200, {'ready': True}
+    ready = registry.ready()
+    return 200 if ready else 503, {'ready': ready, 'components': registry.status()}
+
+
+def retrieval_stats():
+    batcher = registry.peek('retrieval_batcher')
+    return 200, batcher.stats() if batcher else {}
+
+
+ROUTES = {
+    '/health': health,
+    '/llm/stats': lambda: (200, llm_dispatcher.stats()),
+    '/history/stats': lambda: (200, history_writer.stats()),
+    '/intents/stats': lambda: (200, intent_router.stats()),
+    '/sessions/stats': lambda: (200, session_manager.stats()),
+    '/cache/stats': lambda: (200, semantic_cache.stats()),
+    '/retrieval/stats': retrieval_stats,
+    '/traces': lambda: (200, list(recent_traces)),
+}
+
+
+async def http_app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    if scope['path'] == '/metrics':
+        status, body, content_type = 200, render_metrics().encode('utf-8'), b'text/plain; version=0.0.4'
+    elif scope['path'] in ROUTES:
+        status, payload = ROUTES[scope['path']]()
+        body, content_type = json.dumps(payload, default=str).encode('utf-8'), b'application/json'
+    else:
+        status, body, content_type = 404, b'{"error": "Not found"}', b'application/json'
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode('ascii'))]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def on_startup():
+    global groq_client, ollama_client
+    if CHATBOT_APP == 'rag':
+        import ollama
+
+        ollama_client = ollama.AsyncClient(timeout=LLM_TIMEOUT)
+        if WARM_UP_ON_START:
+            asyncio.get_running_loop().run_in_executor(executor, registry.warm_up)
+    else:
+        from groq import AsyncGroq
+
+        groq_client = AsyncGroq(api_key=os.getenv('GROQ_API_KEY'))
+    logger.info(f"ASGI server ready ({CHATBOT_APP})")
+
+
+def on_shutdown():
+    history_writer.close()
+    executor.shutdown(wait=False)
+
+
+if CHATBOT_APP == 'rag':
+    semantic_cache.bind(vector_store_version())
+    handlers = {'connect': rag_connect, 'disconnect': rag_disconnect, 'message': rag_message, 'health': rag_health}
+elif CHATBOT_APP == 'groq':
+    handlers = {'connect': groq_connect, 'disconnect': groq_disconnect, 'message': groq_message,
+                'submit_appointment': groq_appointment}
+else:
+    raise ValueError(f"Unknown CHATBOT_APP {CHATBOT_APP!r}, expected groq or rag")
+for event, handler in handlers.items():
+    sio.on(event, handler)
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app, on_startup=on_startup, on_shutdown=on_shutdown)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    if CHATBOT_APP == 'rag' and not os.path.exists(DB_FAISS_PATH):
+        logger.info("Vector store not found. Creating new vector store...")
+        if create_vector_db(registry.get('embeddings')) is None:
+            logger.error("Failed to create vector store.")
+            exit(1)
+
+    port = int(os.getenv('PORT', 5005 if CHATBOT_APP == 'groq' else 5002))
+    logger.info(f"Starting {CHATBOT_APP} server on port {port}")
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level=LOG_LEVEL.lower())
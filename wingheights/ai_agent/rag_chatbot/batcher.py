@@ -0,0 +1,113 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_BATCH_SIZE = int(os.getenv('RETRIEVAL_BATCH_SIZE', 16))
+RETRIEVAL_BATCH_WAIT_MS = float(os.getenv('RETRIEVAL_BATCH_WAIT_MS', 5))
+
+
+# name -> batcher; the metrics below carry one series per batcher
+_batchers = {}
+
+batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128], name='batch_size', help="Items per batch",
+                        labelnames=('batcher',))
+wait_ms = Histogram([1, 2, 5, 10, 25, 50, 100, 250], name='batch_wait_ms',
+                    help="Time an item waited for its batch to start", labelnames=('batcher',))
+latency_ms = Histogram([5, 10, 25, 50, 100, 250, 500, 1000, 2500], name='batch_latency_ms',
+                       help="Submit to result", labelnames=('batcher',))
+Gauge('batch_queue_depth', "Items waiting for a batch", labelnames=('batcher',),
+      fn=lambda: {(name,): batcher.queue.qsize() for name, batcher in list(_batchers.items())})
+
+
+class _Pending:
+    __slots__ = ('item', 'enqueued', 'done', 'result', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    # Collects items submitted within max_wait_ms of each other and hands them
+    # to handler(list_of_items) -> list_of_results in a single call. Callers
+    # block in submit() until their own result is ready.
+    def __init__(self, handler, max_batch_size=RETRIEVAL_BATCH_SIZE, max_wait_ms=RETRIEVAL_BATCH_WAIT_MS,
+                 executor=None, name='batcher'):
+        self.handler = handler
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        # e.g. eventlet.tpool.execute, so the batch runs off the hub
+        self.execute = executor or (lambda fn, *args: fn(*args))
+        self.name = name
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        if name in _batchers:
+            raise ValueError(f"A batcher named {name!r} already exists")
+        _batchers[name] = self
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item, timeout=None):
+        self._start()
+        pending = _Pending(item)
+        self.queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError(f"{self.name} did not answer within {timeout}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            batch_sizes.observe(len(batch), batcher=self.name)
+            for pending in batch:
+                wait_ms.observe((started - pending.enqueued) * 1000, batcher=self.name)
+            try:
+                results = self.execute(self.handler, [pending.item for pending in batch])
+                for pending, result in zip(batch, results):
+                    pending.result = result
+            except Exception as e:
+                logger.error(f"Error in {self.name} batch of {len(batch)}: {str(e)}", exc_info=True)
+                for pending in batch:
+                    pending.error = e
+            finished = time.perf_counter()
+            for pending in batch:
+                latency_ms.observe((finished - pending.enqueued) * 1000, batcher=self.name)
+                pending.done.set()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batch_size': batch_sizes.snapshot(batcher=self.name),
+            'wait_ms': wait_ms.snapshot(batcher=self.name),
+            'latency_ms': latency_ms.snapshot(batcher=self.name),
+        }
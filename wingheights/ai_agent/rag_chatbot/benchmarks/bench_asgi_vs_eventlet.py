@@ -0,0 +1,69 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Eventlet server and its asyncio counterpart, per protocol
+PAIRS = {
+    'groq': ('model_1', 'asgi-groq'),
+    'rag': ('test', 'asgi-rag'),
+}
+
+ROWS = [
+    ('messages/sec', lambda r: r['messages_per_sec']),
+    ('p50 ms', lambda r: r['latency_ms'].get('p50')),
+    ('p95 ms', lambda r: r['latency_ms'].get('p95')),
+    ('p99 ms', lambda r: r['latency_ms'].get('p99')),
+    ('ttft p50 ms', lambda r: r['ttft_ms'].get('p50')),
+    ('loop lag p99 ms', lambda r: r['loop_lag_ms'].get('p99')),
+    ('KB/session', lambda r: r['memory'].get('per_session_kb')),
+    ('peak MB', lambda r: r['memory'].get('peak_mb')),
+    ('errors', lambda r: r['errors'] + r['timeouts'] + r['connect_failures']),
+]
+
+
+def run(server, args, passthrough, output):
+    command = [sys.executable, os.path.join(HERE, 'bench_socketio.py'), '--server', server,
+               '--clients', str(args.clients), '--iterations', str(args.iterations), '--output', output]
+    subprocess.run(command + passthrough, check=True)
+    with open(output, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the same load against an eventlet server and its asyncio counterpart",
+        epilog="Other options are passed through to bench_socketio.py")
+    parser.add_argument('--app', choices=sorted(PAIRS), default='groq')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--output', help="write both results as JSON to this file")
+    args, passthrough = parser.parse_known_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench-asgi-') as workdir:
+        for server in PAIRS[args.app]:
+            print(f"== {server}")
+            results[server] = run(server, args, passthrough, os.path.join(workdir, f'{server}.json'))
+
+    eventlet_name, asgi_name = PAIRS[args.app]
+    eventlet_result, asgi_result = results[eventlet_name], results[asgi_name]
+    print(f"\n{'':<16} {eventlet_name:>12} {asgi_name:>12}  change")
+    for label, read in ROWS:
+        before, after = read(eventlet_result), read(asgi_result)
+        if before is None or after is None:
+            continue
+        change = f"{(after - before) / before * 100:+6.1f}%" if before else ''
+        print(f"{label:<16} {before:12.2f} {after:12.2f}  {change}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
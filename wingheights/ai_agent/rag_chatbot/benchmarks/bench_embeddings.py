@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUERIES = [
+    "what does health insurance cover?",
+    "explain the law of large numbers",
+    "what is subrogation in insurance",
+    "how does indemnity work for property claims",
+    "is travel insurance worth it for a short trip",
+    "what is the difference between life and term insurance",
+]
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+
+
+def corpus(store_path, limit):
+    from chunk_store import ChunkStore
+
+    store = ChunkStore(store_path)
+    return [store.chunks.get(i) for i in range(min(limit, len(store)))]
+
+
+def measure(backend, store_path, queries, batch_size, limit):
+    # Runs in a fresh interpreter per backend so import time and RSS are its own
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    from embedding_backends import create_embeddings
+
+    embeddings = create_embeddings(backend)
+    embeddings.embed_query("warm up")
+    load_seconds = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    latencies = []
+    for _ in range(queries):
+        for query in QUERIES:
+            start = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    texts = corpus(store_path, limit)
+    start = time.perf_counter()
+    for offset in range(0, len(texts), batch_size):
+        embeddings.embed_documents(texts[offset:offset + batch_size])
+    encode_seconds = time.perf_counter() - start
+
+    latencies = np.asarray(latencies)
+    return {
+        'backend': backend,
+        'load_seconds': load_seconds,
+        'rss_mb': loaded_rss,
+        'model_rss_mb': loaded_rss - base_rss,
+        'peak_rss_mb': rss_mb(),
+        'query_p50_ms': float(np.percentile(latencies, 50)),
+        'query_p95_ms': float(np.percentile(latencies, 95)),
+        'chunks': len(texts),
+        'chunks_per_sec': len(texts) / encode_seconds if encode_seconds else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode latency, throughput and memory of each embedding backend")
+    parser.add_argument('--backends', default='torch,onnx,onnx-int8')
+    parser.add_argument('--store', default=os.path.join(ROOT, os.getenv('DB_CHUNKS_PATH', 'vectorstores/db_chunks')))
+    parser.add_argument('--queries', type=int, default=20, help="passes over the sample queries")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=2000, help="chunks encoded for the throughput figure")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.worker, args.store, args.queries, args.batch_size, args.limit)))
+        return
+
+    results = []
+    for backend in args.backends.split(','):
+        command = [sys.executable, os.path.abspath(__file__), '--worker', backend, '--store', args.store,
+                   '--queries', str(args.queries), '--batch-size', str(args.batch_size), '--limit', str(args.limit)]
+        completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+        if completed.returncode:
+            print(f"{backend}: failed\n{completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else ''}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print(f"{'backend':<10} {'load s':>7} {'RSS MB':>8} {'model MB':>9} {'q p50 ms':>9} {'q p95 ms':>9} {'chunks/s':>9}")
+    for result in results:
+        print(f"{result['backend']:<10} {result['load_seconds']:7.2f} {result['rss_mb']:8.0f} {result['model_rss_mb']:9.0f} "
+              f"{result['query_p50_ms']:9.2f} {result['query_p95_ms']:9.2f} {result['chunks_per_sec']:9.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
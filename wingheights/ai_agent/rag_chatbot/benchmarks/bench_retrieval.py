@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from retrievers import apply_search_params, build_index
+
+# (index type, build kwargs, list of runtime search settings)
+CONFIGS = [
+    ('flat', {}, [{}]),
+    ('ivf', {}, [{'nprobe': 1}, {'nprobe': 4}, {'nprobe': 16}, {'nprobe': 64}]),
+    ('hnsw', {}, [{'ef_search': 16}, {'ef_search': 64}, {'ef_search': 256}]),
+    ('ivfpq', {}, [{'nprobe': 4}, {'nprobe': 16}, {'nprobe': 64}]),
+]
+
+
+def corpus_vectors(path):
+    index = faiss.read_index(os.path.join(path, 'index.faiss'))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def synthetic_vectors(count, dim, clusters=200, seed=0):
+    # Clustered unit vectors, closer to sentence embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = centers[rng.integers(0, clusters, count)] + 0.35 * rng.standard_normal((count, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(vectors, count, seed=1):
+    # Perturbed corpus vectors stand in for paraphrased questions
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.integers(0, len(vectors), count)] + 0.05 * rng.standard_normal((count, vectors.shape[1]), dtype=np.float32)
+    return np.ascontiguousarray(queries / np.linalg.norm(queries, axis=1, keepdims=True), dtype=np.float32)
+
+
+def evaluate(name, vectors, queries, k):
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for index_type, build_kwargs, settings in CONFIGS:
+        start = time.perf_counter()
+        index = build_index(vectors, index_type, **build_kwargs)
+        build_seconds = time.perf_counter() - start
+        for params in settings:
+            apply_search_params(index, **params)
+            latencies = []
+            found = np.empty_like(truth)
+            for i, query in enumerate(queries):
+                start = time.perf_counter()
+                _, rows = index.search(query.reshape(1, -1), k)
+                latencies.append(time.perf_counter() - start)
+                found[i] = rows[0]
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            latencies = np.array(latencies) * 1e3
+            result = {
+                'corpus': name,
+                'vectors': len(vectors),
+                'index_type': index_type,
+                'params': params,
+                'build_seconds': build_seconds,
+                f'recall@{k}': float(recall),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'qps': float(len(queries) / (latencies.sum() / 1e3)),
+            }
+            results.append(result)
+            print(f"{name:<16} {index_type:<6} {json.dumps(params):<20} recall@{k}={recall:5.3f} "
+                  f"p50={result['p50_ms']:7.3f}ms p95={result['p95_ms']:7.3f}ms build={build_seconds:6.2f}s")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency for the FAISS index types the retriever supports")
+    parser.add_argument('--store', default=os.path.join(ROOT, os.getenv('DB_FAISS_PATH', 'vectorstores/db_faiss')))
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[100000],
+                        help="sizes of synthetic corpora to benchmark")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('-k', type=int, default=2)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    vectors = corpus_vectors(args.store)
+    results = evaluate('corpus', vectors, make_queries(vectors, args.queries), args.k)
+    for count in args.synthetic:
+        synthetic = synthetic_vectors(count, vectors.shape[1])
+        results += evaluate(f'synthetic-{count}', synthetic, make_queries(synthetic, args.queries), args.k)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_llm import start_stub
+
+APPOINTMENT = {
+    'name': 'Ama Mensah',
+    'contact_number': '0241234567',
+    'email': 'ama@example.com',
+    'date': '2026-11-02',
+    'time': '10:30',
+    'insuranceType': 'Health Insurance',
+}
+
+# (event, payload) steps; ('disconnect', None) drops the socket without waiting
+SCRIPTS = {
+    'model_1': {
+        'chat': [('message', 'hi'), ('message', 'what types of insurance do you offer?'),
+                 ('message', 'tell me about health insurance'), ('message', 'how is it different from life insurance?'),
+                 ('message', 'thanks')],
+        'appointment': [('message', 'hello'), ('message', 'tell me about life insurance'), ('message', 'yes'),
+                        ('submit_appointment', APPOINTMENT)],
+        'disconnect': [('message', 'what does auto insurance cover?'), ('disconnect', None)],
+    },
+    'test': {
+        'chat': [('message', 'hi'), ('message', 'what types of insurance do you offer?'),
+                 ('message', 'what does health insurance cover?'), ('message', 'no'),
+                 ('message', 'does travel insurance cover lost luggage?')],
+        'appointment': [('message', 'I want to book an appointment'), ('message', APPOINTMENT['name']),
+                        ('message', APPOINTMENT['contact_number']), ('message', APPOINTMENT['email']),
+                        ('message', APPOINTMENT['date']), ('message', APPOINTMENT['insuranceType'])],
+        'disconnect': [('message', 'what does auto insurance cover?'), ('disconnect', None)],
+    },
+}
+
+# Events that end a turn, per server
+REPLY_EVENTS = {
+    'model_1': ('response', 'response_done', 'error'),
+    'test': ('message', 'response_done'),
+}
+
+# Servers the harness can launch: (protocol, script, extra environment).
+# The asgi servers speak the same protocol as the eventlet ones they mirror.
+SERVERS = {
+    'model_1': ('model_1', 'model_1.py', {}),
+    'test': ('test', 'test.py', {}),
+    'asgi-groq': ('model_1', 'asgi_server.py', {'CHATBOT_APP': 'groq'}),
+    'asgi-rag': ('test', 'asgi_server.py', {'CHATBOT_APP': 'rag'}),
+}
+
+DEFAULT_PORTS = {'model_1': 5005, 'test': 5002, 'asgi-groq': 5005, 'asgi-rag': 5002}
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {
+        'count': int(len(values)),
+        'mean': float(values.mean()),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+    except (OSError, StopIteration):
+        return None
+
+
+def serving_pid(pid):
+    # The eventlet servers run with debug=True, so the process we started is
+    # the reloader and the one serving requests is its child
+    while True:
+        try:
+            with open(f'/proc/{pid}/task/{pid}/children') as f:
+                children = f.read().split()
+        except OSError:
+            return pid
+        if not children:
+            return pid
+        pid = int(children[-1])
+
+
+def http_get(url, timeout=5):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+class LagProbe:
+    # Times a trivial HTTP route on the server; when the eventlet hub is
+    # blocked, this is what stretches
+    def __init__(self, url, interval):
+        self.url = url
+        self.interval = interval
+        self.samples = []
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lag-probe', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            start = time.perf_counter()
+            try:
+                http_get(self.url)
+                self.samples.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                self.errors += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class Client:
+    def __init__(self, server, url, stream, timeout):
+        self.server = server
+        self.url = url
+        self.stream = stream
+        self.timeout = timeout
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.replies = asyncio.Queue()
+        self.first_chunk = None
+        self.session_id = None
+        self.ready = asyncio.Event()
+
+        for event in REPLY_EVENTS[server]:
+            self.sio.on(event, self._reply_handler(event))
+        self.sio.on('response_chunk', self._on_chunk)
+        self.sio.on('session_created', self._on_session)
+
+    def _reply_handler(self, event):
+        async def handler(data):
+            if event == 'message' and not self.ready.is_set():
+                # test.py greets on connect
+                self.ready.set()
+                return
+            await self.replies.put((event, data))
+        return handler
+
+    async def _on_chunk(self, data):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+
+    async def _on_session(self, data):
+        self.session_id = data.get('session_id')
+        self.ready.set()
+
+    async def connect(self):
+        await self.sio.connect(self.url, transports=['websocket'])
+        await asyncio.wait_for(self.ready.wait(), self.timeout)
+
+    async def send(self, event, payload):
+        if event == 'message':
+            data = {'message': payload, 'stream': self.stream}
+        else:
+            data = {'appointment_details': payload, 'stream': self.stream}
+        if self.session_id:
+            data['session_id'] = self.session_id
+        self.first_chunk = None
+        start = time.perf_counter()
+        await self.sio.emit(event, data)
+        reply_event, reply = await asyncio.wait_for(self.replies.get(), self.timeout)
+        finished = time.perf_counter()
+        ttft = (self.first_chunk - start) * 1000 if self.first_chunk else None
+        failed = reply_event == 'error' or (isinstance(reply, dict) and 'error' in reply)
+        return (finished - start) * 1000, ttft, failed
+
+    async def close(self):
+        if self.sio.connected:
+            await self.sio.disconnect()
+
+
+class LoadTest:
+    def __init__(self, server, url, clients, iterations, mix, stream, think_ms, timeout, pid=None):
+        self.server = server
+        self.url = url
+        self.clients = clients
+        self.iterations = iterations
+        self.mix = mix
+        self.stream = stream
+        self.think = think_ms / 1000.0
+        self.timeout = timeout
+        self.pid = pid
+        self.latency = {name: [] for name in mix}
+        self.ttft = []
+        self.messages = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.connect_failures = 0
+        self.peak_rss = None
+
+    def assign_scripts(self):
+        # Deterministic weighted assignment so runs are comparable
+        rng = random.Random(0)
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        return [rng.choices(names, weights)[0] for _ in range(self.clients)]
+
+    async def run_script(self, client, name):
+        for event, payload in SCRIPTS[self.server][name]:
+            if event == 'disconnect':
+                await client.close()
+                return
+            try:
+                latency, ttft, failed = await client.send(event, payload)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return
+            self.messages += 1
+            self.latency[name].append(latency)
+            if ttft is not None:
+                self.ttft.append(ttft)
+            if failed:
+                self.errors += 1
+            if self.think:
+                await asyncio.sleep(self.think * (0.5 + random.random()))
+
+    async def run_client(self, client, name):
+        for iteration in range(self.iterations):
+            if iteration:
+                # Every iteration after the first is a fresh session
+                client = Client(self.server, self.url, self.stream, self.timeout)
+                try:
+                    await client.connect()
+                except Exception:
+                    self.connect_failures += 1
+                    continue
+            try:
+                await self.run_script(client, name)
+            finally:
+                await client.close()
+
+    async def connect_all(self):
+        clients = []
+        for _ in range(self.clients):
+            client = Client(self.server, self.url, self.stream, self.timeout)
+            try:
+                await client.connect()
+                clients.append(client)
+            except Exception:
+                self.connect_failures += 1
+        return clients
+
+    async def sample_rss(self, done):
+        while not done.is_set():
+            rss = rss_mb(self.pid)
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss or 0, rss)
+            await asyncio.sleep(0.2)
+
+    async def run(self):
+        scripts = self.assign_scripts()
+        base_rss = rss_mb(self.pid) if self.pid else None
+
+        # Hold every session open at once to measure memory per session
+        clients = await self.connect_all()
+        connected_rss = rss_mb(self.pid) if self.pid else None
+
+        done = asyncio.Event()
+        sampler = asyncio.ensure_future(self.sample_rss(done)) if self.pid else None
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_client(client, name) for client, name in zip(clients, scripts)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        if sampler:
+            await sampler
+
+        memory = {}
+        if base_rss is not None and connected_rss is not None:
+            memory = {
+                'base_mb': base_rss,
+                'connected_mb': connected_rss,
+                'peak_mb': self.peak_rss,
+                'per_session_kb': (connected_rss - base_rss) * 1024 / max(1, len(clients)),
+            }
+        all_latency = [value for values in self.latency.values() for value in values]
+        return {
+            'server': self.server,
+            'clients': self.clients,
+            'iterations': self.iterations,
+            'mix': self.mix,
+            'stream': self.stream,
+            'seconds': elapsed,
+            'messages': self.messages,
+            'messages_per_sec': self.messages / elapsed if elapsed else 0.0,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'connect_failures': self.connect_failures,
+            'latency_ms': percentiles(all_latency),
+            'latency_ms_by_script': {name: percentiles(values) for name, values in self.latency.items()},
+            'ttft_ms': percentiles(self.ttft),
+            'memory': memory,
+        }
+
+
+def log_tail(path, lines=20):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return ''.join(f.readlines()[-lines:])
+
+
+def launch_server(server, port, stub_url, workdir, ready_timeout):
+    protocol, script, extra_env = SERVERS[server]
+    env = dict(os.environ)
+    env.update(extra_env)
+    env.update({
+        'PORT': str(port),
+        'GROQ_BASE_URL': stub_url,
+        'GROQ_API_KEY': env.get('GROQ_API_KEY', 'stub'),
+        'OLLAMA_HOST': stub_url,
+        'LLAMA_MODEL': env.get('LLAMA_MODEL', 'stub'),
+        'STORAGE_DB_PATH': os.path.join(workdir, 'chatbot.db'),
+        'DB_FAISS_PATH': os.path.join(ROOT, env.get('DB_FAISS_PATH', 'vectorstores/db_faiss')),
+        'DB_CHUNKS_PATH': os.path.join(ROOT, env.get('DB_CHUNKS_PATH', 'vectorstores/db_chunks')),
+        'DATA_PATH': os.path.join(ROOT, env.get('DATA_PATH', 'data/')),
+    })
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    # Logs, CSVs and databases land in the scratch directory
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, script)], cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    ready_path = '/health' if protocol == 'test' else '/llm/stats'
+    deadline = time.time() + ready_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{server} exited with {process.returncode}:\n{log_tail(log.name)}")
+        try:
+            if http_get(url + ready_path)[0] == 200:
+                return process, url
+        except Exception:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"{server} not ready after {ready_timeout}s:\n{log_tail(log.name)}")
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def compare(result, baseline):
+    rows = [
+        ('messages/sec', result['messages_per_sec'], baseline['messages_per_sec'], True),
+        ('p50 ms', result['latency_ms'].get('p50'), baseline['latency_ms'].get('p50'), False),
+        ('p95 ms', result['latency_ms'].get('p95'), baseline['latency_ms'].get('p95'), False),
+        ('p99 ms', result['latency_ms'].get('p99'), baseline['latency_ms'].get('p99'), False),
+        ('loop lag p99 ms', result['loop_lag_ms'].get('p99'), baseline.get('loop_lag_ms', {}).get('p99'), False),
+        ('KB/session', result['memory'].get('per_session_kb'), baseline.get('memory', {}).get('per_session_kb'), False),
+    ]
+    for label, current, previous, higher_is_better in rows:
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous * 100
+        worse = change < 0 if higher_is_better else change > 0
+        print(f"{label:<16} {previous:10.2f} -> {current:10.2f}  {change:+6.1f}%{'  REGRESSION' if worse and abs(change) > 10 else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive concurrent Socket.IO clients through a chatbot server")
+    parser.add_argument('--server', choices=sorted(SERVERS), default='model_1')
+    parser.add_argument('--url', help="target an already running server instead of launching one")
+    parser.add_argument('--pid', type=int, help="pid of the server given with --url, for memory figures")
+    parser.add_argument('--port', type=int, help="port for the launched server")
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--iterations', type=int, default=3, help="script runs per client, each on a new session")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chat=6,appointment=3,disconnect=1'))
+    parser.add_argument('--stream', action='store_true', help="ask for streamed responses")
+    parser.add_argument('--think-ms', type=float, default=200, help="average pause between a reply and the next message")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--llm-latency-ms', type=float, default=300)
+    parser.add_argument('--llm-chunk-delay-ms', type=float, default=20)
+    parser.add_argument('--probe-ms', type=float, default=100, help="event-loop lag probe interval")
+    parser.add_argument('--ready-timeout', type=float, default=300)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-socketio-')
+    stub = None
+    process = None
+    try:
+        stub_config = {'latency_ms': args.llm_latency_ms, 'chunk_delay_ms': args.llm_chunk_delay_ms}
+        if args.url:
+            url, pid = args.url.rstrip('/'), args.pid and serving_pid(args.pid)
+        else:
+            stub = start_stub(**stub_config)
+            stub_url = f'http://127.0.0.1:{stub.server_port}'
+            process, url = launch_server(args.server, args.port or DEFAULT_PORTS[args.server], stub_url,
+                                         workdir, args.ready_timeout)
+            pid = serving_pid(process.pid)
+
+        probe = LagProbe(url + '/llm/stats', args.probe_ms / 1000.0)
+        probe.start()
+        test = LoadTest(SERVERS[args.server][0], url, args.clients, args.iterations, args.mix, args.stream,
+                        args.think_ms, args.timeout, pid)
+        result = asyncio.run(test.run())
+        result['server'] = args.server
+        probe.stop()
+
+        result['loop_lag_ms'] = percentiles(probe.samples)
+        result['loop_lag_probe_errors'] = probe.errors
+        result['stub'] = stub_config if stub else None
+        if stub:
+            result['llm_requests'] = stub.RequestHandlerClass.config.requests
+
+        latency = result['latency_ms']
+        print(f"{args.server}: {result['messages']} messages from {args.clients} clients in {result['seconds']:.1f}s "
+              f"({result['messages_per_sec']:.1f} msg/s), errors={result['errors']} timeouts={result['timeouts']}")
+        if latency:
+            print(f"latency p50={latency['p50']:.0f}ms p95={latency['p95']:.0f}ms p99={latency['p99']:.0f}ms")
+        if result['loop_lag_ms']:
+            print(f"loop lag p50={result['loop_lag_ms']['p50']:.1f}ms p99={result['loop_lag_ms']['p99']:.1f}ms")
+        if result['memory']:
+            print(f"memory {result['memory']['per_session_kb']:.1f}KB/session, peak {result['memory']['peak_mb']:.0f}MB")
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=1)
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                compare(result, json.load(f))
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if stub is not None:
+            stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import csv
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from token_accounting import TokenAccountant, TokenUsage
+
+SAMPLE_MESSAGES = [
+    "hello hi",
+    "what is insurance",
+    "can you tell me about law of large numbers",
+    "i am interested in buying life insurance",
+    "yes please book an appointment for me",
+]
+
+
+def load_messages(path):
+    if not os.path.exists(path):
+        return SAMPLE_MESSAGES, SAMPLE_MESSAGES
+    questions, answers = [], []
+    with open(path, newline='', encoding='utf-8', errors='replace') as f:
+        for row in csv.reader(f):
+            if len(row) >= 3:
+                questions.append(row[0])
+                answers.append(row[2])
+    return questions or SAMPLE_MESSAGES, answers or SAMPLE_MESSAGES
+
+
+def legacy_count_tokens(text):
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text))
+
+
+def run_legacy(messages, responses):
+    total = 0
+    latencies = []
+    for message, response in zip(messages, responses):
+        start = time.perf_counter()
+        total += legacy_count_tokens(message)
+        total += legacy_count_tokens(response)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_accountant(accountant, messages, responses):
+    usage = TokenUsage()
+    latencies = []
+    for message, response in zip(messages, responses):
+        start = time.perf_counter()
+        accountant.charge_message(usage, message)
+        accountant.charge_response(usage, response)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1e6
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1e6
+    mean = statistics.fmean(latencies) * 1e6
+    print(f"{name:<12} mean={mean:8.1f}us p50={p50:8.1f}us p99={p99:8.1f}us "
+          f"wall={elapsed:6.2f}s msgs/s={len(latencies) / elapsed:9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message token accounting latency, before and after")
+    parser.add_argument('--sessions', type=int, default=300)
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--data', default='chatbot_data.csv')
+    args = parser.parse_args()
+
+    questions, answers = load_messages(args.data)
+    scripts = []
+    for i in range(args.sessions):
+        messages = [questions[(i + t) % len(questions)] for t in range(args.turns)]
+        responses = [answers[(i + t) % len(answers)] for t in range(args.turns)]
+        scripts.append((messages, responses))
+
+    accountant = TokenAccountant()
+    runs = [
+        ('legacy', lambda script: run_legacy(*script)),
+        ('accountant', lambda script: run_accountant(accountant, *script)),
+    ]
+    print(f"{args.sessions} concurrent sessions x {args.turns} turns")
+    for name, fn in runs:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+            results = list(pool.map(fn, scripts))
+        elapsed = time.perf_counter() - start
+        summarize(name, [lat for session in results for lat in session], elapsed)
+
+
+if __name__ == '__main__':
+    main()
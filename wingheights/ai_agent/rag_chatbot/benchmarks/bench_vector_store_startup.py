@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Each measurement runs in a fresh interpreter so imports and page cache
+# effects match a worker restart
+LOADERS = {
+    'pickle': """
+from langchain_community.vectorstores import FAISS
+db = FAISS.load_local(PATH, None, allow_dangerous_deserialization=True)
+query = db.index.reconstruct(0)
+docs = db.similarity_search_by_vector(query, k=2)
+""",
+    'compact': """
+from chunk_store import ChunkStore
+db = ChunkStore(PATH)
+query = db.index.reconstruct(0)
+docs = db.similarity_search_by_vector(query, k=2)
+""",
+}
+
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+PATH = {path!r}
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+with open('/proc/self/status') as f:
+    status = {{line.split(':')[0]: int(line.split()[1]) for line in f if line.startswith(('VmRSS', 'RssAnon', 'RssFile'))}}
+# RssFile counts mapped index pages the search touched; they are page cache,
+# shared between workers and dropped under memory pressure. RssAnon is what
+# each worker really holds.
+print(json.dumps({{'seconds': elapsed, 'rss_mb': status['VmRSS'] / 1024, 'anon_mb': status['RssAnon'] / 1024,
+                  'file_mb': status['RssFile'] / 1024}}))
+"""
+
+
+def measure(kind, path, repeats):
+    script = PROBE.format(root=ROOT, path=path, body=LOADERS[kind])
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', script], check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def build_synthetic(path, count, dim=384):
+    import faiss
+    import numpy as np
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatL2(dim)
+    index.add(rng.standard_normal((count, dim), dtype=np.float32))
+    filler = "The insured pays a premium to the insurer in exchange for indemnity against specified perils. "
+    docs = {str(i): Document(page_content=filler * 5, metadata={'source': 'synthetic.pdf', 'page': i // 4})
+            for i in range(count)}
+    db = FAISS(None, index, InMemoryDocstore(docs), {i: str(i) for i in range(count)})
+    db.save_local(path)
+
+
+def main():
+    from chunk_store import DB_FAISS_PATH, convert
+
+    parser = argparse.ArgumentParser(description="Cold start time and RSS: pickled FAISS docstore vs compact chunk store")
+    parser.add_argument('--source', default=os.path.join(ROOT, DB_FAISS_PATH))
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[],
+                        help="also benchmark synthetic stores with this many chunks")
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-store-')
+    try:
+        sources = [('corpus', args.source)] if os.path.exists(args.source) else []
+        for count in args.synthetic:
+            path = os.path.join(workdir, f'synthetic-{count}')
+            build_synthetic(path, count)
+            sources.append((f'synthetic-{count}', path))
+
+        results = []
+        for name, source in sources:
+            compact_path = os.path.join(workdir, f'{name}-compact')
+            convert(source, compact_path)
+            for kind, path in (('pickle', source), ('compact', compact_path)):
+                result = measure(kind, path, args.repeats)
+                result.update({'store': name, 'format': kind})
+                results.append(result)
+                print(f"{name:<18} {kind:<8} start={result['seconds']:7.3f}s rss={result['rss_mb']:8.1f}MB "
+                      f"anon={result['anon_mb']:8.1f}MB file={result['file_mb']:8.1f}MB")
+        print(json.dumps(results, indent=1))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from retrievers import Retriever, load_reranker
+from sparse_index import index_version, load_or_build, tokenize
+
+KS = (1, 2, 5, 10)
+
+
+def load_pairs(path, min_question_terms=2, min_answer_terms=20):
+    # chatbot_data.csv has no header: question, q_tokens, answer, a_tokens. Logged
+    # greetings and chainlit object reprs are not retrieval questions, skip them.
+    pairs = []
+    with open(path, encoding='utf-8', errors='replace', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or row[0].startswith('<'):
+                continue
+            question, answer = row[0].strip(), row[2].strip()
+            if len(tokenize(question)) >= min_question_terms and len(tokenize(answer)) >= min_answer_terms:
+                pairs.append((question, answer))
+    return pairs
+
+
+def gold_rows(pairs, sparse, dense, embeddings, depth, gold):
+    # No chunk labels exist, so the chunks that best match the reference
+    # answer stand in for relevant ones. 'union' takes them from both BM25 and
+    # embeddings so neither retriever is graded against its own ranking.
+    answers = [answer for _, answer in pairs]
+    lexical = [[row for row, _ in sparse.search(answer, depth)] for answer in answers] if gold != 'dense' else None
+    semantic = None
+    if gold != 'lexical':
+        vectors = np.asarray(embeddings.embed_documents(answers), dtype=np.float32)
+        semantic = [[row for row, _ in hits] for hits in dense.search_rows(vectors, depth)]
+    if gold == 'lexical':
+        return [set(rows) for rows in lexical]
+    if gold == 'dense':
+        return [set(rows) for rows in semantic]
+    return [set(a) | set(b) for a, b in zip(lexical, semantic)]
+
+
+def score(ranked, gold):
+    recall = {k: float(bool(gold & set(ranked[:k]))) for k in KS}
+    reciprocal_rank = next((1.0 / (i + 1) for i, row in enumerate(ranked[:max(KS)]) if row in gold), 0.0)
+    return recall, reciprocal_rank
+
+
+def evaluate(name, search, queries, vectors, golds):
+    recalls = {k: [] for k in KS}
+    reciprocal_ranks = []
+    latencies = []
+    for i, (query, gold) in enumerate(zip(queries, golds)):
+        start = time.perf_counter()
+        ranked = search(query, vectors[i:i + 1] if vectors is not None else None)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recall, reciprocal_rank = score(ranked, gold)
+        for k in KS:
+            recalls[k].append(recall[k])
+        reciprocal_ranks.append(reciprocal_rank)
+    return {
+        'mode': name,
+        **{f'recall@{k}': float(np.mean(recalls[k])) for k in KS},
+        'mrr@10': float(np.mean(reciprocal_ranks)),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of dense, BM25 and hybrid retrieval on chatbot_data.csv")
+    parser.add_argument('--data', default=os.path.join(ROOT, 'chatbot_data.csv'))
+    parser.add_argument('--store', default=os.path.join(ROOT, os.getenv('DB_CHUNKS_PATH', 'vectorstores/db_chunks')))
+    parser.add_argument('--sparse', default=os.path.join(ROOT, os.getenv('SPARSE_INDEX_PATH', 'vectorstores/db_sparse')))
+    parser.add_argument('--gold', choices=('union', 'lexical', 'dense'), default='union')
+    parser.add_argument('--gold-depth', type=int, default=3, help="chunks per answer counted as relevant")
+    parser.add_argument('--candidates', type=int, default=20, help="per-retriever candidates before fusion")
+    parser.add_argument('--reranker', default=os.getenv('RERANKER_MODEL', ''), help="cross-encoder model for a reranked run")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    from chunk_store import ChunkStore
+    from rag_pipeline import load_embeddings
+
+    pairs = load_pairs(args.data)
+    if not pairs:
+        sys.exit(f"No usable question/answer pairs in {args.data}")
+    embeddings = load_embeddings()
+    store = ChunkStore(args.store, embeddings)
+    count = len(store)
+    sparse = load_or_build(lambda: (store.chunks.get(row) for row in range(count)), count,
+                           index_version(args.store), args.sparse)
+    depth = max(KS)
+    # Plain similarity for every run, whatever RETRIEVER_SEARCH_TYPE says
+    dense = Retriever(store, k=depth, search_type='similarity')
+    hybrid = Retriever(store, k=depth, search_type='similarity', sparse=sparse, candidates=args.candidates)
+
+    golds = gold_rows(pairs, sparse, dense, embeddings, args.gold_depth, args.gold)
+    queries = [question for question, _ in pairs]
+    start = time.perf_counter()
+    vectors = np.asarray(embeddings.embed_documents(queries), dtype=np.float32)
+    embed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    # Dense and hybrid latencies exclude the query embedding, reported once below
+    runs = [
+        ('dense', lambda query, vector: [row for row, _ in dense.search_rows(vector, depth)[0]]),
+        ('bm25', lambda query, vector: [row for row, _ in sparse.search(query, depth)]),
+        ('hybrid', lambda query, vector: [row for row, _ in hybrid.search_rows(vector, depth, [query])[0]]),
+    ]
+    if args.reranker:
+        reranked = Retriever(store, k=depth, search_type='similarity', sparse=sparse,
+                             reranker=load_reranker(args.reranker), candidates=args.candidates)
+        runs.append(('hybrid+rerank', lambda query, vector: [row for row, _ in reranked.search_rows(vector, depth, [query])[0]]))
+
+    results = [evaluate(name, search, queries, vectors, golds) for name, search in runs]
+    print(f"{len(pairs)} questions, {count} chunks, gold={args.gold} depth={args.gold_depth}, "
+          f"query embedding {embed_ms:.1f}ms/query")
+    header = ' '.join(f"{'R@' + str(k):>6}" for k in KS)
+    print(f"{'mode':<14} {header} {'MRR':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for result in results:
+        recalls = ' '.join(f"{result[f'recall@{k}']:6.2f}" for k in KS)
+        print(f"{result['mode']:<14} {recalls} {result['mrr@10']:6.2f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'questions': len(pairs), 'chunks': count, 'gold': args.gold,
+                       'embed_ms': embed_ms, 'results': results}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
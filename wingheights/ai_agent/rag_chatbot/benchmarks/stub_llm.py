@@ -0,0 +1,164 @@
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Canned answer; mentions booking so test.py exercises its confirmation step
+ANSWER = ("Health insurance covers medical costs for you and your family, including hospital stays, "
+          "consultations and prescriptions. If you would like, I can help you book an appointment "
+          "with one of our specialists to go through the options.")
+
+
+class StubConfig:
+    def __init__(self, latency_ms=300, chunk_delay_ms=20, chunks=12, answer=ANSWER):
+        self.latency = latency_ms / 1000.0
+        self.chunk_delay = chunk_delay_ms / 1000.0
+        self.answer = answer
+        words = answer.split(' ')
+        size = max(1, len(words) // max(1, chunks))
+        self.chunks = [' '.join(words[i:i + size]) + ' ' for i in range(0, len(words), size)]
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Speaks just enough of the Groq (OpenAI-style, SSE streaming) and Ollama
+    # (NDJSON streaming) chat APIs for the servers under test
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/stats':
+            return self._send_json({'requests': self.config.requests})
+        self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        request = self._read_json()
+        self.config.count()
+        time.sleep(self.config.latency)
+        if self.path.endswith('/chat/completions'):
+            return self._groq(request)
+        if self.path == '/api/chat':
+            return self._ollama(request)
+        self._send_json({'error': 'not found'}, 404)
+
+    def _groq(self, request):
+        completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+        created = int(time.time())
+        model = request.get('model') or 'stub'
+        if not request.get('stream'):
+            return self._send_json({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': self.config.answer},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            })
+        self._start_stream('text/event-stream')
+        for i, text in enumerate(self.config.chunks + [None]):
+            if i:
+                time.sleep(self.config.chunk_delay)
+            delta = {'content': text} if text is not None else {}
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if text is not None else 'stop'}],
+            }
+            self._write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._end_stream()
+
+    def _ollama(self, request):
+        model = request.get('model') or 'stub'
+        created_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        if request.get('stream') is False:
+            return self._send_json({
+                'model': model,
+                'created_at': created_at,
+                'message': {'role': 'assistant', 'content': self.config.answer},
+                'done': True,
+                'done_reason': 'stop',
+            })
+        self._start_stream('application/x-ndjson')
+        for i, text in enumerate(self.config.chunks):
+            if i:
+                time.sleep(self.config.chunk_delay)
+            line = {'model': model, 'created_at': created_at,
+                    'message': {'role': 'assistant', 'content': text}, 'done': False}
+            self._write_chunk((json.dumps(line) + '\n').encode('utf-8'))
+        line = {'model': model, 'created_at': created_at, 'message': {'role': 'assistant', 'content': ''},
+                'done': True, 'done_reason': 'stop'}
+        self._write_chunk((json.dumps(line) + '\n').encode('utf-8'))
+        self._end_stream()
+
+
+def start_stub(host='127.0.0.1', port=0, **config):
+    # Returns the running server; its URL is http://host:server.server_port
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'config': StubConfig(**config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-llm', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Groq/Ollama chat server with configurable latency")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--latency-ms', type=float, default=300, help="delay before the first token")
+    parser.add_argument('--chunk-delay-ms', type=float, default=20, help="delay between streamed chunks")
+    parser.add_argument('--chunks', type=int, default=12)
+    args = parser.parse_args()
+
+    server = start_stub(args.host, args.port, latency_ms=args.latency_ms,
+                        chunk_delay_ms=args.chunk_delay_ms, chunks=args.chunks)
+    url = f'http://{args.host}:{server.server_port}'
+    print(f"Stub LLM on {url}  (GROQ_BASE_URL={url} OLLAMA_HOST={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
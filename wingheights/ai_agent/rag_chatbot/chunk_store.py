@@ -0,0 +1,193 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import shutil
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from retrievers import FAISS_INDEX_TYPE, build_index, index_type_of
+from sparse_index import index_version
+
+logger = logging.getLogger(__name__)
+
+DB_FAISS_PATH = os.getenv('DB_FAISS_PATH', 'vectorstores/db_faiss')
+DB_CHUNKS_PATH = os.getenv('DB_CHUNKS_PATH', 'vectorstores/db_chunks')
+CHUNK_STORE_FORMAT = 1
+# IO_FLAG_MMAP only maps IVF inverted lists and reads a flat index's vectors
+# into memory; IO_FLAG_MMAP_IFC (faiss >= 1.8) maps flat codes and IVF lists
+# alike. The two can't be combined.
+MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# On-disk layout, row i of the FAISS index is chunk i:
+#   index.faiss   - FAISS index, opened with MMAP_FLAGS
+#   chunks.bin    - utf-8 chunk texts back to back
+#   chunks.idx    - uint64 offsets into chunks.bin, count + 1 entries
+#   records.bin   - utf-8 JSON {"id": ..., "metadata": {...}} per chunk
+#   records.idx   - uint64 offsets into records.bin, count + 1 entries
+#   store.json    - format version, count, dimension, index type and the
+#                   version of the FAISS index it was exported from
+
+
+class OffsetFile:
+    # Variable-length records read lazily by position through mmap
+    def __init__(self, data_path, index_path):
+        self.offsets = np.memmap(index_path, dtype=np.uint64, mode='r') if os.path.getsize(index_path) else np.zeros(1, dtype=np.uint64)
+        self._file = open(data_path, 'rb')
+        size = os.path.getsize(data_path)
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, i):
+        return self._data[int(self.offsets[i]):int(self.offsets[i + 1])].decode('utf-8')
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+
+class OffsetWriter:
+    def __init__(self, data_path, index_path):
+        self._data = open(data_path, 'wb')
+        self._index = open(index_path, 'wb')
+        self._offset = 0
+        self._index.write(np.uint64(0).tobytes())
+
+    def append(self, text):
+        encoded = text.encode('utf-8')
+        self._data.write(encoded)
+        self._offset += len(encoded)
+        self._index.write(np.uint64(self._offset).tobytes())
+
+    def close(self):
+        self._data.close()
+        self._index.close()
+
+
+def write_store(path, index, documents, version=None):
+    # documents: iterable of (id, text, metadata) in index row order;
+    # version identifies the source index (sparse_index.index_version)
+    tmp_path = path.rstrip('/') + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    chunks = OffsetWriter(os.path.join(tmp_path, 'chunks.bin'), os.path.join(tmp_path, 'chunks.idx'))
+    records = OffsetWriter(os.path.join(tmp_path, 'records.bin'), os.path.join(tmp_path, 'records.idx'))
+    count = 0
+    for doc_id, text, metadata in documents:
+        chunks.append(text)
+        records.append(json.dumps({'id': doc_id, 'metadata': metadata}, separators=(',', ':'), default=str))
+        count += 1
+    chunks.close()
+    records.close()
+    if count != index.ntotal:
+        raise ValueError(f"Index has {index.ntotal} vectors but {count} chunks were written")
+    faiss.write_index(index, os.path.join(tmp_path, 'index.faiss'))
+    with open(os.path.join(tmp_path, 'store.json'), 'w', encoding='utf-8') as f:
+        json.dump({'format': CHUNK_STORE_FORMAT, 'count': count, 'dim': index.d,
+                   'index_type': index_type_of(index), 'vector_store': version}, f)
+
+    old_path = path.rstrip('/') + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    logger.info(f"Wrote {count} chunks to {path}")
+
+
+def store_matches(path, count, version, index_type=FAISS_INDEX_TYPE):
+    info_path = os.path.join(path, 'store.json')
+    if not os.path.exists(info_path):
+        return False
+    with open(info_path, encoding='utf-8') as f:
+        info = json.load(f)
+    return (info.get('format') == CHUNK_STORE_FORMAT and info.get('index_type', 'flat') == index_type
+            and info.get('count') == count and info.get('vector_store') == version)
+
+
+def source_matches(faiss_path, path, index_type=FAISS_INDEX_TYPE):
+    # Whether the chunk store at path was exported from the current index in
+    # faiss_path; the row count comes from the index header, read through mmap
+    version = index_version(faiss_path)
+    if version is None:
+        return False
+    index = faiss.read_index(os.path.join(faiss_path, 'index.faiss'), MMAP_FLAGS)
+    return store_matches(path, index.ntotal, version, index_type)
+
+
+def export_langchain_faiss(db, path, index_type=FAISS_INDEX_TYPE, version=None):
+    docstore_ids = [db.index_to_docstore_id[i] for i in range(db.index.ntotal)]
+    index = db.index
+    if index_type != 'flat' and index.ntotal:
+        # Rows keep their order, so row i still maps to docstore_ids[i]
+        index = build_index(index.reconstruct_n(0, index.ntotal), index_type)
+
+    def documents():
+        for doc_id in docstore_ids:
+            doc = db.docstore.search(doc_id)
+            yield doc_id, doc.page_content, doc.metadata
+
+    write_store(path, index, documents(), version)
+
+
+def convert(faiss_path=DB_FAISS_PATH, path=DB_CHUNKS_PATH, index_type=FAISS_INDEX_TYPE):
+    # One-off read of the pickled docstore; the result never needs unpickling
+    from langchain_community.vectorstores import FAISS
+    db = FAISS.load_local(faiss_path, None, allow_dangerous_deserialization=True)
+    export_langchain_faiss(db, path, index_type, index_version(faiss_path))
+
+
+class ChunkStore:
+    def __init__(self, path=DB_CHUNKS_PATH, embeddings=None):
+        self.path = path
+        self.embeddings = embeddings
+        with open(os.path.join(path, 'store.json'), encoding='utf-8') as f:
+            info = self.info = json.load(f)
+        if info['format'] != CHUNK_STORE_FORMAT:
+            raise ValueError(f"Unsupported chunk store format {info['format']} in {path}")
+        self.index = faiss.read_index(os.path.join(path, 'index.faiss'), MMAP_FLAGS)
+        self.chunks = OffsetFile(os.path.join(path, 'chunks.bin'), os.path.join(path, 'chunks.idx'))
+        self.records = OffsetFile(os.path.join(path, 'records.bin'), os.path.join(path, 'records.idx'))
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def get_document(self, i):
+        record = json.loads(self.records.get(i))
+        return Document(page_content=self.chunks.get(i), metadata=record['metadata'], id=record['id'])
+
+    def search(self, vectors, k):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        return self.index.search(vectors, k)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4):
+        scores, rows = self.search(embedding, k)
+        return [(self.get_document(int(row)), float(score)) for row, score in zip(rows[0], scores[0]) if row != -1]
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query, k=4):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+    def close(self):
+        self.chunks.close()
+        self.records.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert a LangChain FAISS directory into the compact chunk store")
+    parser.add_argument('--source', default=DB_FAISS_PATH)
+    parser.add_argument('--dest', default=DB_CHUNKS_PATH)
+    parser.add_argument('--index-type', default=FAISS_INDEX_TYPE, help="flat, ivf, hnsw or ivfpq")
+    args = parser.parse_args()
+    convert(args.source, args.dest, args.index_type)
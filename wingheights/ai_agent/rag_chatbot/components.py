@@ -0,0 +1,105 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Component:
+    __slots__ = ('name', 'factory', 'value', 'state', 'seconds', 'error', '_claim', '_done')
+
+    def __init__(self, name, factory, event):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.state = 'idle'
+        self.seconds = None
+        self.error = None
+        # Popping from a one-item list is atomic, so exactly one caller wins
+        # the build without a lock shared between greenlets and OS threads
+        self._claim = [True]
+        # Set once the current build attempt has finished, loaded or failed
+        self._done = event()
+
+
+class ComponentRegistry:
+    # Builds heavy components (models, indexes, chains) on first use or in a
+    # background warm-up, and records how long each one took.
+    #
+    # Building and waiting for a build both go through executor, e.g.
+    # eventlet.tpool.execute, so neither blocks an event loop. The event type
+    # must then be one native threads can wait on: under eventlet's monkey
+    # patching that is eventlet.patcher.original('threading').Event.
+    def __init__(self, executor=None, event=threading.Event):
+        self.components = {}
+        self.execute = executor or (lambda fn, *args: fn(*args))
+        self.event = event
+
+    def register(self, name, factory):
+        self.components[name] = Component(name, factory, self.event)
+
+    def get(self, name):
+        component = self.components[name]
+        if component.state == 'loaded':
+            return component.value
+        return self.execute(self._load, component)
+
+    def _load(self, component):
+        while component.state != 'loaded':
+            done = component._done
+            try:
+                component._claim.pop()
+            except IndexError:
+                # Another caller (often the warm-up) is building it
+                done.wait()
+                if component.state == 'failed':
+                    raise RuntimeError(f"Component {component.name} failed to load: {component.error}")
+                continue
+            self._build(component)
+        return component.value
+
+    def _build(self, component):
+        component.state = 'loading'
+        component.error = None
+        start = time.perf_counter()
+        done = component._done
+        try:
+            component.value = component.factory()
+        except Exception as e:
+            component.error = str(e)
+            component.state = 'failed'
+            # Waiters on this attempt see the failure; the next get() retries
+            component._done = self.event()
+            component._claim = [True]
+            done.set()
+            logger.error(f"Error loading component {component.name}: {str(e)}", exc_info=True)
+            raise
+        component.seconds = time.perf_counter() - start
+        component.state = 'loaded'
+        done.set()
+        logger.info(f"Loaded component {component.name} in {component.seconds:.2f}s")
+
+    def peek(self, name):
+        # The component if it is already built, without triggering a load
+        component = self.components[name]
+        return component.value if component.state == 'loaded' else None
+
+    def warm_up(self, names=None):
+        for name in names or list(self.components):
+            try:
+                self.get(name)
+            except Exception:
+                pass
+
+    def ready(self, names=None):
+        return all(self.components[name].state == 'loaded' for name in names or self.components)
+
+    def status(self):
+        return {
+            name: {
+                'state': component.state,
+                'seconds': component.seconds,
+                'error': component.error
+            }
+            for name, component in self.components.items()
+        }
@@ -0,0 +1,176 @@
+import logging
+import os
+import re
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 800))
+# Longest text shared by neighbouring chunks; the splitter's overlap is 50 chars
+CONTEXT_MAX_OVERLAP = int(os.getenv('CONTEXT_MAX_OVERLAP', 100))
+CONTEXT_MIN_OVERLAP = 12
+# A block cut to fit the budget must keep at least this many tokens
+CONTEXT_MIN_TAIL_TOKENS = 32
+# Shorter sentences (headings, page numbers) are never treated as duplicates
+MIN_DEDUPE_CHARS = 20
+# Append the files and pages behind the packed context to RAG answers
+CITE_SOURCES = os.getenv('CITE_SOURCES', 'true').lower() == 'true'
+
+SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n+')
+
+context_tokens = Counter('context_tokens_total', "Tokens of retrieved context before and after packing",
+                         labelnames=('stage',))
+
+
+def overlap(left, right, min_overlap=CONTEXT_MIN_OVERLAP, max_overlap=CONTEXT_MAX_OVERLAP):
+    # Length of the longest suffix of left that is a prefix of right
+    for size in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class _Block:
+    __slots__ = ('key', 'text', 'start', 'rank', 'label')
+
+    def __init__(self, key, text, start, rank, label=None):
+        self.key = key
+        self.text = text
+        self.start = start
+        self.rank = rank
+        self.label = label
+
+    @property
+    def end(self):
+        return self.start + len(self.text)
+
+
+class ContextBuilder:
+    # Turns retrieved documents (best first) into the context string: chunks
+    # that overlap in the source are stitched back together, sentences already
+    # given are dropped, and blocks are packed in rank order into the budget.
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET, count_tokens=None):
+        self.budget = budget
+        self._count_tokens = count_tokens
+
+    def count_tokens(self, text):
+        if self._count_tokens is None:
+            from token_accounting import count_tokens
+
+            self._count_tokens = count_tokens
+        return self._count_tokens(text)
+
+    def merge(self, docs):
+        blocks = []
+        for rank, doc in enumerate(docs):
+            text = doc.page_content.strip()
+            if not text:
+                continue
+            metadata = doc.metadata or {}
+            key = (metadata.get('source'), metadata.get('page'))
+            start = metadata.get('start_index')
+            block = _Block(key, text, start, rank, metadata.get('page_label'))
+            for other in [other for other in blocks if other.key == key]:
+                if self._absorb(other, block):
+                    blocks.remove(other)
+                    block.rank = min(block.rank, other.rank)
+            blocks.append(block)
+        blocks.sort(key=lambda block: block.rank)
+        return blocks
+
+    def _absorb(self, other, block):
+        # Folds other into block when they are the same stretch of the source
+        if other.text in block.text:
+            return True
+        if block.text in other.text:
+            block.text, block.start = other.text, other.start
+            return True
+        if other.start is not None and block.start is not None:
+            first, second = (other, block) if other.start <= block.start else (block, other)
+            if second.start > first.end:
+                return False
+            text = first.text + second.text[first.end - second.start:]
+            block.text, block.start = text, first.start
+            return True
+        size = overlap(other.text, block.text)
+        if size:
+            block.text = other.text + block.text[size:]
+            return True
+        size = overlap(block.text, other.text)
+        if size:
+            block.text = block.text + other.text[size:]
+            return True
+        return False
+
+    def dedupe(self, blocks):
+        seen = set()
+        for block in blocks:
+            parts = []
+            for sentence in SENTENCE_BREAK.split(block.text):
+                normalized = ' '.join(sentence.lower().split())
+                if len(normalized) >= MIN_DEDUPE_CHARS:
+                    if normalized in seen:
+                        continue
+                    seen.add(normalized)
+                if sentence.strip():
+                    parts.append(sentence.strip())
+            block.text = ' '.join(parts)
+        return [block for block in blocks if block.text]
+
+    def pack(self, texts, budget):
+        # Returns the texts that fit and the tokens they use
+        packed = []
+        remaining = budget
+        for text in texts:
+            tokens = self.count_tokens(text)
+            if tokens <= remaining:
+                packed.append(text)
+                remaining -= tokens
+                continue
+            if remaining >= CONTEXT_MIN_TAIL_TOKENS:
+                # Cut the first block that doesn't fit at a sentence boundary
+                kept = []
+                for sentence in SENTENCE_BREAK.split(text):
+                    tokens = self.count_tokens(sentence) + 1
+                    if tokens > remaining:
+                        break
+                    kept.append(sentence)
+                    remaining -= tokens
+                if kept:
+                    packed.append(' '.join(kept))
+            break
+        return packed, budget - remaining
+
+    def select(self, docs, budget=None):
+        # (text, block) for each block that made it into the budget, best first
+        docs = list(docs)
+        if not docs:
+            return []
+        blocks = self.dedupe(self.merge(docs))
+        packed, used = self.pack([block.text for block in blocks], self.budget if budget is None else budget)
+        context_tokens.inc(sum(self.count_tokens(doc.page_content) for doc in docs), stage='retrieved')
+        context_tokens.inc(used, stage='packed')
+        return list(zip(packed, blocks))
+
+    def build(self, docs, budget=None):
+        return '\n\n'.join(text for text, _ in self.select(docs, budget))
+
+    def build_with_sources(self, docs, budget=None):
+        # Also returns (file, page label) for the blocks used, for citations
+        selected = self.select(docs, budget)
+        context = '\n\n'.join(text for text, _ in selected)
+        if not CITE_SOURCES:
+            return context, []
+        sources = []
+        for _, block in selected:
+            source, page = block.key
+            if source is None:
+                continue
+            # page is 0-based in PyPDFLoader metadata; page_label is what the PDF prints
+            label = block.label if block.label is not None else (None if page is None else str(int(page) + 1))
+            sources.append((os.path.basename(source), label))
+        return context, sources
+
+
+context_builder = ContextBuilder()
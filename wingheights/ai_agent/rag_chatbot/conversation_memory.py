@@ -0,0 +1,124 @@
+import logging
+import os
+import re
+
+from token_accounting import token_accountant
+
+logger = logging.getLogger(__name__)
+
+MEMORY_MAX_TURNS = int(os.getenv('MEMORY_MAX_TURNS', 12))
+MEMORY_KEEP_TURNS = int(os.getenv('MEMORY_KEEP_TURNS', 6))
+MEMORY_SUMMARY_TOKENS = int(os.getenv('MEMORY_SUMMARY_TOKENS', 200))
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def first_sentence(text, max_words=30):
+    words = SENTENCE_END.split(text.strip(), 1)[0].split()
+    return ' '.join(words[:max_words])
+
+
+def extractive_summary(summary, turns):
+    # One short line per folded turn, used when no summarizer is given or it fails
+    lines = [f"{role}: {first_sentence(content)}" for role, content, _ in turns]
+    return '\n'.join(filter(None, [summary] + lines))
+
+
+class ConversationMemory:
+    # Recent turns verbatim as [role, content, tokens], older turns folded into
+    # a running summary, so a session never holds more than max_turns turns
+    # plus a summary of at most summary_tokens tokens.
+    __slots__ = ('turns', 'summary', 'summary_tokens', 'folded')
+
+    def __init__(self, turns=None, summary='', summary_tokens=0, folded=0):
+        self.turns = turns or []
+        self.summary = summary
+        self.summary_tokens = summary_tokens
+        self.folded = folded
+
+    def to_list(self):
+        return [self.turns, self.summary, self.summary_tokens, self.folded]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+    def add(self, role, content, tokens=None):
+        if tokens is None:
+            tokens = token_accountant.count(content)
+        self.turns.append([role, content, tokens])
+
+    def compact(self, summarizer=None, max_turns=MEMORY_MAX_TURNS, keep_turns=MEMORY_KEEP_TURNS,
+                max_summary_tokens=MEMORY_SUMMARY_TOKENS):
+        # Folds in batches (down to keep_turns) so the summarizer runs once
+        # every few turns rather than on every message
+        folding = self.foldable(max_turns, keep_turns)
+        if not folding:
+            return False
+        summary, summary_tokens = self.fold_summary(folding, summarizer, max_summary_tokens)
+        return self.apply_fold(folding, summary, summary_tokens, self.folded)
+
+    def foldable(self, max_turns=MEMORY_MAX_TURNS, keep_turns=MEMORY_KEEP_TURNS):
+        # Turns compact() would fold now, oldest first; [] while under max_turns
+        if len(self.turns) <= max_turns:
+            return []
+        return [list(turn) for turn in (self.turns[:-keep_turns] if keep_turns else self.turns)]
+
+    def fold_summary(self, folding, summarizer=None, max_summary_tokens=MEMORY_SUMMARY_TOKENS):
+        # The running summary with folding added, and its token count; reads
+        # but doesn't change the memory, so it can run on a snapshot
+        summary = None
+        if summarizer is not None:
+            try:
+                summary = summarizer(self.summary, folding)
+            except Exception as e:
+                logger.warning(f"Summarizer failed, falling back to extractive summary: {str(e)}")
+        if not summary:
+            summary = extractive_summary(self.summary, folding)
+        return self._trim(summary, max_summary_tokens)
+
+    def apply_fold(self, folding, summary, summary_tokens, folded):
+        # Merges a summary computed from an earlier snapshot (taken when
+        # self.folded was folded); skipped if another fold got there first
+        if self.folded != folded or self.turns[:len(folding)] != folding:
+            return False
+        self.summary, self.summary_tokens = summary, summary_tokens
+        self.turns = self.turns[len(folding):]
+        self.folded += len(folding)
+        return True
+
+    def _trim(self, summary, max_tokens):
+        # Drop the oldest lines until the summary fits
+        tokens = token_accountant.count(summary)
+        lines = summary.split('\n')
+        while tokens > max_tokens and len(lines) > 1:
+            lines.pop(0)
+            summary = '\n'.join(lines)
+            tokens = token_accountant.count(summary)
+        return summary, tokens
+
+    def recent(self, budget):
+        # Newest turns that fit the budget, oldest first; the latest turn is
+        # always included
+        selected = []
+        used = self.summary_tokens
+        for role, content, tokens in reversed(self.turns):
+            if selected and used + tokens > budget:
+                break
+            selected.append((role, content))
+            used += tokens
+        selected.reverse()
+        return selected
+
+    def build_messages(self, system_prompt, budget):
+        if self.summary:
+            system_prompt = f"{system_prompt}\n\nSummary of the earlier conversation:\n{self.summary}"
+        messages = [{"role": "system", "content": system_prompt}]
+        messages += [{"role": role, "content": content} for role, content in self.recent(budget)]
+        return messages
+
+    def transcript(self, budget):
+        lines = [f"{role}: {content}" for role, content in self.recent(budget)]
+        if self.summary:
+            lines.insert(0, f"Earlier in the conversation:\n{self.summary}")
+        return '\n'.join(lines)
@@ -0,0 +1,201 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+# torch: HuggingFaceEmbeddings as before; onnx / onnx-int8: ONNX Runtime on an
+# export of the same model, without importing torch at all
+EMBEDDINGS_BACKEND = os.getenv('EMBEDDINGS_BACKEND', 'torch')
+EMBEDDINGS_ONNX_PATH = os.getenv('EMBEDDINGS_ONNX_PATH', 'vectorstores/onnx_models')
+EMBEDDINGS_THREADS = int(os.getenv('EMBEDDINGS_THREADS', 0))
+EMBEDDINGS_BATCH_SIZE = int(os.getenv('EMBEDDINGS_BATCH_SIZE', 32))
+# sentence-transformers truncates all-MiniLM-L6-v2 inputs at 256 word pieces
+EMBEDDINGS_MAX_LENGTH = int(os.getenv('EMBEDDINGS_MAX_LENGTH', 256))
+PARITY_MIN_COSINE = {'onnx': 0.999, 'onnx-int8': 0.98}
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+MODEL_FILES = {'onnx': 'model.onnx', 'onnx-int8': 'model-int8.onnx'}
+
+# Export layout, one directory per model under EMBEDDINGS_ONNX_PATH:
+#   model.onnx        - fp32 graph, dynamic batch and sequence axes
+#   model-int8.onnx   - dynamically quantized (int8 weights) copy
+#   tokenizer.json    - the model's own fast tokenizer; tokenizer_files/ holds
+#                       the Llama tokenizer and can't encode for MiniLM
+#   export.json       - model name, max length and the last parity results
+
+
+def export_dir(model_name=EMBEDDINGS_MODEL, root=EMBEDDINGS_ONNX_PATH):
+    return os.path.join(root, model_name.replace('/', '__'))
+
+
+def read_export_info(path):
+    info_path = os.path.join(path, 'export.json')
+    if not os.path.exists(info_path):
+        return {}
+    with open(info_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_export_info(path, info):
+    tmp_path = os.path.join(path, 'export.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=1)
+    os.replace(tmp_path, os.path.join(path, 'export.json'))
+
+
+class OnnxEmbeddings(Embeddings):
+    # Mean-pooled, L2-normalised transformer output, matching the Pooling and
+    # Normalize modules sentence-transformers runs for all-MiniLM-L6-v2
+    def __init__(self, model_name=EMBEDDINGS_MODEL, backend='onnx', root=EMBEDDINGS_ONNX_PATH,
+                 threads=EMBEDDINGS_THREADS, batch_size=EMBEDDINGS_BATCH_SIZE, max_length=EMBEDDINGS_MAX_LENGTH):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        path = export_dir(model_name, root)
+        model_path = os.path.join(path, MODEL_FILES[backend])
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"No {backend} export of {model_name} at {model_path}; "
+                                    f"run python embedding_backends.py export --backend {backend}")
+        # Distinct name so the embedding cache and ingest manifest never mix
+        # these vectors with the torch model's
+        self.model_name = f"{model_name}@{backend}"
+        self.backend = backend
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        parity = read_export_info(path).get('parity', {}).get(backend)
+        if parity is None:
+            logger.warning(f"{backend} export of {model_name} has no parity check on record")
+        elif not parity.get('passed'):
+            logger.warning(f"{backend} export of {model_name} failed its last parity check: {parity}")
+
+    def _encode(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.asarray([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.asarray([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_array(self, texts):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # Length-sorted batches waste less compute on padding
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+
+def create_embeddings(backend=EMBEDDINGS_BACKEND, model_name=EMBEDDINGS_MODEL):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBEDDINGS_BACKEND {backend!r}, expected one of {BACKENDS}")
+    if backend == 'torch':
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"device": "cpu"})
+    return OnnxEmbeddings(model_name, backend)
+
+
+def export(model_name=EMBEDDINGS_MODEL, root=EMBEDDINGS_ONNX_PATH, max_length=EMBEDDINGS_MAX_LENGTH, opset=14):
+    # One-off, needs torch and transformers; serving only needs onnxruntime and tokenizers
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    path = export_dir(model_name, root)
+    os.makedirs(path, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    sample = tokenizer(["an example sentence"], return_tensors='pt')
+    names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    axes = {name: {0: 'batch', 1: 'sequence'} for name in names}
+    axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[name] for name in names), os.path.join(path, MODEL_FILES['onnx']),
+                          input_names=names, output_names=['last_hidden_state'], dynamic_axes=axes,
+                          opset_version=opset)
+    quantize_dynamic(os.path.join(path, MODEL_FILES['onnx']), os.path.join(path, MODEL_FILES['onnx-int8']),
+                     weight_type=QuantType.QInt8)
+    tokenizer.backend_tokenizer.save(os.path.join(path, 'tokenizer.json'))
+    info = read_export_info(path)
+    info.update({'model_name': model_name, 'max_length': max_length, 'opset': opset, 'exported_at': time.time()})
+    write_export_info(path, info)
+    logger.info(f"Exported {model_name} to {path}")
+    return path
+
+
+def check_parity(backend, store_path, model_name=EMBEDDINGS_MODEL, sample=None):
+    # Re-embeds the stored chunks with the backend and compares with the vectors
+    # already in the FAISS index, which the torch backend produced
+    from chunk_store import ChunkStore
+
+    store = ChunkStore(store_path)
+    rows = np.arange(len(store))
+    if sample and sample < len(rows):
+        rows = np.random.default_rng(0).choice(rows, sample, replace=False)
+    stored = np.stack([store.index.reconstruct(int(row)) for row in rows])
+    embeddings = create_embeddings(backend, model_name)
+    candidate = np.asarray(embeddings.embed_documents([store.chunks.get(int(row)) for row in rows]), dtype=np.float32)
+
+    stored /= np.maximum(np.linalg.norm(stored, axis=1, keepdims=True), 1e-12)
+    cosine = (stored * candidate).sum(axis=1)
+    # Each chunk's own row should still be its nearest neighbour
+    _, nearest = store.search(candidate, 1)
+    result = {
+        'chunks': int(len(rows)),
+        'min_cosine': float(cosine.min()),
+        'mean_cosine': float(cosine.mean()),
+        'max_abs_diff': float(np.abs(stored - candidate).max()),
+        'top1_agreement': float((nearest[:, 0] == rows).mean()),
+    }
+    result['passed'] = result['min_cosine'] >= PARITY_MIN_COSINE.get(backend, 0.999) and result['top1_agreement'] >= 0.99
+    if backend != 'torch':
+        path = export_dir(model_name)
+        info = read_export_info(path)
+        info.setdefault('parity', {})[backend] = result
+        write_export_info(path, info)
+    return result
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX and check it against the index")
+    parser.add_argument('command', choices=('export', 'parity'))
+    parser.add_argument('--model', default=EMBEDDINGS_MODEL)
+    parser.add_argument('--backend', choices=BACKENDS[1:], default='onnx-int8', help="backend to check (parity)")
+    parser.add_argument('--store', default=os.getenv('DB_CHUNKS_PATH', 'vectorstores/db_chunks'))
+    parser.add_argument('--sample', type=int, help="check a random sample of chunks instead of all")
+    args = parser.parse_args()
+    if args.command == 'export':
+        export(args.model)
+    else:
+        result = check_parity(args.backend, args.store, args.model, args.sample)
+        print(json.dumps(result, indent=1))
+        raise SystemExit(0 if result['passed'] else 1)
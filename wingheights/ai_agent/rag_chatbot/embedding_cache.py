@@ -0,0 +1,341 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metrics import Counter
+from native_threading import native_lock
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'vectorstores/embedding_cache')
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+# Query caching is opt-in: user queries rarely repeat word for word, and the
+# query store is capped at EMBEDDING_CACHE_MAX_QUERIES (oldest dropped first).
+# Retrieval doesn't need it to avoid a second embedding of the same message:
+# the intent classifier's vector is passed to the retrieval batcher directly.
+EMBEDDING_CACHE_QUERIES = os.getenv('EMBEDDING_CACHE_QUERIES', 'false').lower() == 'true'
+EMBEDDING_CACHE_MAX_QUERIES = int(os.getenv('EMBEDDING_CACHE_MAX_QUERIES', 20000))
+EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+
+KEY_SIZE = hashlib.sha1().digest_size
+KINDS = ('documents', 'queries')
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def model_dir(root, model_name):
+    return os.path.join(root, hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:16])
+
+
+@contextmanager
+def file_lock(path):
+    # Exclusive lock across processes: flock on Unix, a one-byte msvcrt lock on Windows
+    with open(path, 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+            return
+        while True:
+            try:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class EmbeddingStore:
+    # Append-only, content-addressed vectors for one (model, kind) pair:
+    #   keys.bin    - sha1 digests of the embedded text, one per row
+    #   vectors.f32 - float32 rows in the same order, read through a memmap
+    def __init__(self, path, max_entries=None):
+        self.path = path
+        self.keys_path = os.path.join(path, 'keys.bin')
+        self.vectors_path = os.path.join(path, 'vectors.f32')
+        self.meta_path = os.path.join(path, 'meta.json')
+        self.max_entries = max_entries
+        self.dim = None
+        self.rows = {}
+        self._vectors = None
+        # keys.bin bytes already read, and which file they came from
+        self._offset = 0
+        self._identity = None
+        # Taken on the hub and in tpool threads (retrieval batches)
+        self._lock = native_lock()
+        self._load()
+
+    def _load(self):
+        # Reads only the rows other processes appended since the last call; a
+        # compaction replaces keys.bin, which forces one full re-read
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        if self.dim is None or not os.path.exists(self.keys_path):
+            return
+        stat = os.stat(self.keys_path)
+        identity = (stat.st_dev, stat.st_ino)
+        if identity != self._identity or stat.st_size < self._offset:
+            self.rows = {}
+            self._offset = 0
+            self._identity = identity
+            self._vectors = None
+        # A crash between the two appends can leave a trailing partial row
+        count = min(stat.st_size // KEY_SIZE, os.path.getsize(self.vectors_path) // (4 * self.dim))
+        start = self._offset // KEY_SIZE
+        if count <= start:
+            return
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self._offset)
+            keys = f.read((count - start) * KEY_SIZE)
+        for i in range(count - start):
+            self.rows[keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]] = start + i
+        self._offset = count * KEY_SIZE
+
+    def _mapped(self):
+        if self._vectors is None or self._vectors.shape[0] < len(self.rows):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(len(self.rows), self.dim))
+        return self._vectors
+
+    def __len__(self):
+        return len(self.rows)
+
+    def nbytes(self):
+        return len(self.rows) * (KEY_SIZE + 4 * (self.dim or 0))
+
+    def get_many(self, keys):
+        with self._lock:
+            if not self.rows:
+                return [None] * len(keys)
+            vectors = self._mapped()
+            return [None if key not in self.rows else np.array(vectors[self.rows[key]]) for key in keys]
+
+    @contextmanager
+    def _locked(self):
+        # Several workers may share one cache directory
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with file_lock(os.path.join(self.path, '.lock')):
+                self._load()
+                yield
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or not len(keys):
+            return
+        with self._locked():
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim}, f)
+            new = {}
+            for key, vector in zip(keys, vectors):
+                if key not in self.rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return
+            # Drop a partial row left by a crash so new keys and vectors stay aligned
+            for path, size in ((self.vectors_path, 4 * self.dim), (self.keys_path, KEY_SIZE)):
+                if os.path.exists(path) and os.path.getsize(path) != len(self.rows) * size:
+                    os.truncate(path, len(self.rows) * size)
+            with open(self.vectors_path, 'ab') as f:
+                f.write(np.stack(list(new.values())).tobytes())
+            with open(self.keys_path, 'ab') as f:
+                f.write(b''.join(new))
+            for key in new:
+                self.rows[key] = len(self.rows)
+            self._offset = len(self.rows) * KEY_SIZE
+            self._identity = self._file_identity()
+            self._vectors = None
+            if self.max_entries and len(self.rows) > self.max_entries:
+                # Keep the newest three quarters so compaction stays rare
+                keep = self.max_entries * 3 // 4
+                self._compact(range(len(self.rows) - keep, len(self.rows)))
+
+    def _file_identity(self):
+        stat = os.stat(self.keys_path)
+        return stat.st_dev, stat.st_ino
+
+    def compact(self, keep_rows):
+        with self._locked():
+            self._compact(keep_rows)
+
+    def _compact(self, keep_rows):
+        # Rewrite the store with only the given rows, oldest first; caller holds the lock
+        if not self.rows:
+            return
+        keys_by_row = {row: key for key, row in self.rows.items()}
+        vectors = self._mapped()
+        tmp_keys, tmp_vectors = self.keys_path + '.tmp', self.vectors_path + '.tmp'
+        with open(tmp_keys, 'wb') as kf, open(tmp_vectors, 'wb') as vf:
+            for row in sorted(keep_rows):
+                kf.write(keys_by_row[row])
+                vf.write(np.asarray(vectors[row], dtype=np.float32).tobytes())
+        self._vectors = None
+        del vectors
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_keys, self.keys_path)
+        logger.info(f"Compacted {self.path} to {len(keep_rows)} entries")
+        self.rows = {}
+        self._offset = 0
+        self._identity = None
+        self._load()
+
+
+# Every EmbeddingCache in this process; the counters below sum them per model
+_caches = []
+
+
+def _per_model(attr):
+    def read():
+        values = {}
+        for cache in list(_caches):
+            key = (cache.model_name,)
+            values[key] = values.get(key, 0) + getattr(cache, attr)
+        return values
+    return read
+
+
+Counter('embedding_cache_hits_total', "Embeddings served from the cache", labelnames=('model',),
+        fn=_per_model('hits'))
+Counter('embedding_cache_misses_total', "Embeddings computed by the model", labelnames=('model',),
+        fn=_per_model('misses'))
+
+
+class EmbeddingCache:
+    def __init__(self, root=EMBEDDING_CACHE_PATH, model_name=EMBEDDINGS_MODEL):
+        self.root = root
+        self.model_name = model_name
+        self.path = model_dir(root, model_name)
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'model.json'), 'w', encoding='utf-8') as f:
+            json.dump({'model_name': model_name}, f)
+        limits = {'queries': EMBEDDING_CACHE_MAX_QUERIES}
+        self.stores = {kind: EmbeddingStore(os.path.join(self.path, kind), limits.get(kind)) for kind in KINDS}
+        self.hits = 0
+        self.misses = 0
+        _caches.append(self)
+
+    def embed(self, kind, texts, compute):
+        store = self.stores[kind]
+        keys = [text_key(text) for text in texts]
+        results = store.get_many(keys)
+        missing = {}
+        for i, vector in enumerate(results):
+            if vector is None:
+                missing.setdefault(keys[i], []).append(i)
+        self.hits += len(texts) - sum(len(rows) for rows in missing.values())
+        self.misses += len(missing)
+        if missing:
+            computed = compute([texts[rows[0]] for rows in missing.values()])
+            store.put_many(list(missing), computed)
+            for rows, vector in zip(missing.values(), computed):
+                for i in rows:
+                    results[i] = vector
+        return [list(map(float, vector)) for vector in results]
+
+
+class CachedEmbeddings(Embeddings):
+    # Looks in the on-disk cache before running the wrapped model
+    def __init__(self, embeddings, cache, cache_queries=EMBEDDING_CACHE_QUERIES):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.cache_queries = cache_queries
+        self.model_name = cache.model_name
+
+    def embed_documents(self, texts):
+        return self.cache.embed('documents', list(texts), self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        if not self.cache_queries:
+            return self.embeddings.embed_query(text)
+        return self.cache.embed('queries', [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts):
+        # Batched query encoding; sentence-transformers encode queries and
+        # documents the same way, so one forward pass covers the whole batch
+        if not self.cache_queries:
+            return self.embeddings.embed_documents(list(texts))
+        return self.cache.embed('queries', list(texts), self.embeddings.embed_documents)
+
+
+def cached_embeddings(embeddings, model_name=None, root=EMBEDDING_CACHE_PATH):
+    if not EMBEDDING_CACHE_ENABLED:
+        return embeddings
+    model_name = model_name or getattr(embeddings, 'model_name', EMBEDDINGS_MODEL)
+    return CachedEmbeddings(embeddings, EmbeddingCache(root, model_name))
+
+
+def iter_models(root):
+    if not os.path.isdir(root):
+        return
+    for name in sorted(os.listdir(root)):
+        meta_path = os.path.join(root, name, 'model.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding='utf-8') as f:
+                yield os.path.join(root, name), json.load(f)['model_name']
+
+
+def report(root):
+    total = 0
+    for path, model_name in iter_models(root):
+        for kind in KINDS:
+            store = EmbeddingStore(os.path.join(path, kind))
+            total += store.nbytes()
+            print(f"{model_name:<50} {kind:<10} {len(store):>9} entries {store.nbytes() / 1e6:>9.2f} MB")
+    print(f"{'total':<50} {'':<10} {'':>9}         {total / 1e6:>9.2f} MB")
+
+
+def prune(root, keep_model=None, drop_queries=False, max_entries=None):
+    for path, model_name in iter_models(root):
+        if keep_model and model_name != keep_model:
+            logger.info(f"Removing cache for {model_name}")
+            shutil.rmtree(path)
+            continue
+        for kind in KINDS:
+            store = EmbeddingStore(os.path.join(path, kind))
+            if drop_queries and kind == 'queries':
+                store.compact([])
+            elif max_entries is not None and len(store) > max_entries:
+                store.compact(range(len(store) - max_entries, len(store)))
+            logger.info(f"{model_name} {kind}: {len(store)} entries")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Inspect and prune the on-disk embedding cache")
+    parser.add_argument('--path', default=EMBEDDING_CACHE_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help="report entries and size per model")
+    prune_parser = commands.add_parser('prune', help="drop cached embeddings")
+    prune_parser.add_argument('--keep-model', help="remove every other model's cache")
+    prune_parser.add_argument('--drop-queries', action='store_true', help="remove cached query embeddings")
+    prune_parser.add_argument('--max-entries', type=int, help="keep only the newest N entries per store")
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        report(args.path)
+    else:
+        prune(args.path, args.keep_model, args.drop_queries, args.max_entries)
+        report(args.path)
@@ -0,0 +1,169 @@
+import atexit
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+HISTORY_QUEUE_SIZE = int(os.getenv('HISTORY_QUEUE_SIZE', 10000))
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', 200))
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', 1.0))
+# sqlite writes to the indexed storage database, csv keeps the old append-only files
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'sqlite')
+
+_STOP = object()
+
+
+class CSVSink:
+    # Keeps one append handle open per file so rows go out as a single
+    # sequential stream instead of an open/append/close per row.
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.writer = None
+
+    def write_rows(self, rows):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, 'a', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file)
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+            self.writer = None
+
+
+class SQLiteSink:
+    # Routes rows meant for one of the old CSV files to its table; each flush
+    # is a single transaction
+    def __init__(self, path, storage=storage):
+        self.path = path
+        self.storage = storage
+
+    def write_rows(self, rows):
+        self.storage.write_rows(self.path, rows)
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BufferedWriter:
+    def __init__(self, sink_factory=CSVSink, max_queue=HISTORY_QUEUE_SIZE,
+                 batch_size=HISTORY_BATCH_SIZE, flush_interval=HISTORY_FLUSH_INTERVAL):
+        self.sink_factory = sink_factory
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sinks = {}
+        self.rows_written = 0
+        self.flushes = 0
+        self.errors = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def write(self, target, row):
+        if self._closed:
+            logger.warning(f"History writer closed, writing row for {target} synchronously")
+            self._flush({target: [row]})
+            return
+        self.start()
+        # Blocks when the queue is full so producers feel backpressure
+        self.queue.put((target, row))
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth(),
+            'queue_capacity': self.queue.maxsize,
+            'rows_written': self.rows_written,
+            'flushes': self.flushes,
+            'errors': self.errors,
+        }
+
+    def _run(self):
+        pending = {}
+        pending_count = 0
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(pending)
+                return
+            if item is not None:
+                target, row = item
+                pending.setdefault(target, []).append(row)
+                pending_count += 1
+
+            if pending_count >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval:
+                if pending:
+                    self._flush(pending)
+                pending = {}
+                pending_count = 0
+                last_flush = time.monotonic()
+
+    def _flush(self, pending):
+        for target, rows in pending.items():
+            try:
+                sink = self.sinks.get(target)
+                if sink is None:
+                    sink = self.sinks[target] = self.sink_factory(target)
+                sink.write_rows(rows)
+                self.rows_written += len(rows)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error writing {len(rows)} rows to {target}: {str(e)}")
+        self.flushes += 1
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self.queue.put(_STOP)
+            thread.join()
+        for sink in self.sinks.values():
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"Error closing history sink: {str(e)}")
+        logger.info(f"History writer closed after {self.rows_written} rows")
+
+
+history_writer = BufferedWriter(sink_factory=SQLiteSink if HISTORY_BACKEND == 'sqlite' else CSVSink)
+atexit.register(history_writer.close)
@@ -1,24 +1,318 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.document_loaders import PyPDFLoader, DirectoryLoader
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.vectorstores import FAISS
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+
+from embedding_backends import create_embeddings
+from embedding_cache import cached_embeddings
+from chunk_store import DB_CHUNKS_PATH, export_langchain_faiss, store_matches
+from sparse_index import SPARSE_INDEX_PATH, SparseIndex, index_version, sparse_index_matches
+
+logger = logging.getLogger(__name__)
+
+DATA_PATH = os.getenv('DATA_PATH', 'data/')
+DB_FAISS_PATH = os.getenv('DB_FAISS_PATH', 'vectorstores/db_faiss')
+EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', os.cpu_count() or 1))
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 64))
+# Files parsed ahead of the embedder; bounds how many split files sit in memory
+INGEST_PREFETCH = int(os.getenv('INGEST_PREFETCH', 2))
+INGEST_PROGRESS_INTERVAL = float(os.getenv('INGEST_PROGRESS_INTERVAL', 10))
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# Bump when chunk metadata changes; chunk hashes cover it, so old stores rebuild
+METADATA_VERSION = 2
+MANIFEST_NAME = 'manifest.json'
+EXPORT_CHUNK_STORE = os.getenv('EXPORT_CHUNK_STORE', 'true').lower() == 'true'
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_hash(text, metadata):
+    payload = json.dumps(metadata, sort_keys=True, default=str) + '\0' + text
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def split_pdf(path):
+    # Runs in a worker process: pages are parsed and split one at a time, so
+    # only the current page and the chunks so far are held. Each chunk records
+    # its file, page and character offset within the page for citations.
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                                                   add_start_index=True)
+    source = os.path.basename(path)
+    chunks = []
+    pages = 0
+    for page in PyPDFLoader(path).lazy_load():
+        pages += 1
+        for doc in text_splitter.split_documents([page]):
+            metadata = {'source': source, 'page': doc.metadata.get('page', pages - 1),
+                        'start_index': doc.metadata['start_index']}
+            if 'page_label' in doc.metadata:
+                metadata['page_label'] = doc.metadata['page_label']
+            chunks.append((doc.page_content, metadata))
+    return chunks, pages
+
+
+def load_manifest(db_path):
+    path = os.path.join(db_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(db_path, manifest):
+    path = os.path.join(db_path, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def new_manifest(embeddings_model):
+    return {
+        'embeddings_model': embeddings_model,
+        'chunk_size': CHUNK_SIZE,
+        'chunk_overlap': CHUNK_OVERLAP,
+        'metadata_version': METADATA_VERSION,
+        'files': {}
+    }
+
+
+def manifest_matches(manifest, embeddings_model):
+    # Chunking or model changes invalidate every stored vector
+    if manifest is None:
+        return False
+    expected = new_manifest(embeddings_model)
+    return all(manifest.get(key) == value for key, value in expected.items() if key != 'files')
+
+
+def iter_split_pdfs(paths, workers, prefetch=INGEST_PREFETCH):
+    # Yields (path, chunks, pages) in order. At most workers * prefetch files
+    # are submitted ahead, so split results never pile up for the whole corpus
+    # while the embedder catches up.
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield (path, *split_pdf(path))
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        queued = deque(paths)
+        pending = deque()
+        while queued or pending:
+            while queued and len(pending) < workers * prefetch:
+                path = queued.popleft()
+                pending.append((path, pool.submit(split_pdf, path)))
+            path, future = pending.popleft()
+            yield (path, *future.result())
+
+
+def add_chunks(db, embeddings, chunks):
+    # chunks: list of (id, text, metadata), embedded in one call and appended
+    ids = [chunk_id for chunk_id, _, _ in chunks]
+    texts = [text for _, text, _ in chunks]
+    metadatas = [metadata for _, _, metadata in chunks]
+    vectors = embeddings.embed_documents(texts)
+    if db is None:
+        return FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=ids)
+    db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+    return db
+
+
+def peak_rss_mb():
+    # This process only, not the workers; None where the resource module is missing (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+class IngestProgress:
+    # Periodic progress and throughput log lines, plus the final summary
+    def __init__(self, files, interval=INGEST_PROGRESS_INTERVAL):
+        self.files_total = files
+        self.interval = interval
+        self.files = 0
+        self.pages = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.started = time.perf_counter()
+        self.reported = self.started
+
+    def file_done(self, path, pages, chunks):
+        self.files += 1
+        self.pages += pages
+        self.bytes += os.path.getsize(path)
+        self.chunks += chunks
+        self.report()
+
+    def batch_done(self, count):
+        self.embedded += count
+        self.report()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'files': self.files,
+            'files_total': self.files_total,
+            'pages': self.pages,
+            'chunks': self.chunks,
+            'embedded': self.embedded,
+            'seconds': elapsed,
+            'pages_per_sec': self.pages / elapsed if elapsed else 0.0,
+            'chunks_per_sec': self.chunks / elapsed if elapsed else 0.0,
+            'mb_per_sec': self.bytes / 1e6 / elapsed if elapsed else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def report(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.reported < self.interval:
+            return
+        self.reported = now
+        stats = self.stats()
+        logger.info(f"Ingest: {stats['files']}/{stats['files_total']} files, {stats['pages']} pages, "
+                    f"{stats['chunks']} chunks ({stats['embedded']} embedded), "
+                    f"{stats['pages_per_sec']:.1f} pages/s, {stats['chunks_per_sec']:.1f} chunks/s, "
+                    f"{stats['mb_per_sec']:.2f} MB/s"
+                    + (f", peak RSS {stats['peak_rss_mb']:.0f} MB" if stats['peak_rss_mb'] is not None else ''))
+
+
+class BatchAppender:
+    # Buffers new chunks and embeds/appends them batch_size at a time, so the
+    # index grows while later files are still being parsed
+    def __init__(self, db, embeddings, batch_size, progress):
+        self.db = db
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.progress = progress
+        self.pending = []
+        self.added = 0
+
+    def add(self, chunk_id, text, metadata):
+        self.pending.append((chunk_id, text, metadata))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.db = add_chunks(self.db, self.embeddings, batch)
+        self.added += len(batch)
+        self.progress.batch_done(len(batch))
+
+
+def export_sparse_index(db, version_path, path=SPARSE_INDEX_PATH):
+    # Rows follow the FAISS index, which the chunk store export keeps in order
+    version = index_version(version_path)
+    if sparse_index_matches(path, db.index.ntotal, version):
+        return
+    texts = (db.docstore.search(db.index_to_docstore_id[row]).page_content for row in range(db.index.ntotal))
+    SparseIndex.build(texts).save(path, version)
+
+
+def create_vector_db(data_path=DATA_PATH, db_path=DB_FAISS_PATH, embeddings=None,
+                     full=False, workers=INGEST_WORKERS, batch_size=EMBED_BATCH_SIZE,
+                     chunks_path=DB_CHUNKS_PATH):
+    if embeddings is None:
+        embeddings = cached_embeddings(create_embeddings(model_name=EMBEDDINGS_MODEL))
+    embeddings_model = getattr(embeddings, 'model_name', EMBEDDINGS_MODEL)
+
+    manifest = load_manifest(db_path)
+    index_exists = os.path.exists(os.path.join(db_path, 'index.faiss'))
+    if full or not index_exists or not manifest_matches(manifest, embeddings_model):
+        logger.info("Building vector store from scratch")
+        manifest = new_manifest(embeddings_model)
+        db = None
+    else:
+        db = FAISS.load_local(db_path, embeddings, allow_dangerous_deserialization=True)
+
+    paths = sorted(glob.glob(os.path.join(data_path, '*.pdf')))
+    hashes = {os.path.basename(path): file_hash(path) for path in paths}
+    changed = [path for path in paths
+               if manifest['files'].get(os.path.basename(path), {}).get('sha256') != hashes[os.path.basename(path)]]
+    removed = [name for name in manifest['files'] if name not in hashes]
+
+    if not changed and not removed and db is not None:
+        logger.info("Vector store is up to date")
+        if EXPORT_CHUNK_STORE and not store_matches(chunks_path, db.index.ntotal, index_version(db_path)):
+            export_langchain_faiss(db, chunks_path, version=index_version(db_path))
+        export_sparse_index(db, chunks_path if EXPORT_CHUNK_STORE else db_path)
+        return db
+
+    stale_ids = []
+    for name in removed:
+        stale_ids.extend(chunk_id for _, chunk_id in manifest['files'].pop(name)['chunks'])
 
-DATA_PATH= "data/"
-DB_FAISS_PATH= "vectorstores/db_faiss"
+    progress = IngestProgress(len(changed))
+    appender = BatchAppender(db, embeddings, batch_size, progress)
+    for path, chunks, pages in iter_split_pdfs(changed, workers):
+        name = os.path.basename(path)
+        # Reuse unchanged chunks of a modified file so only new text is embedded
+        previous = {}
+        for key, chunk_id in manifest['files'].get(name, {}).get('chunks', []):
+            previous.setdefault(key, []).append(chunk_id)
+        entries = []
+        for text, metadata in chunks:
+            key = chunk_hash(text, metadata)
+            if previous.get(key):
+                chunk_id = previous[key].pop()
+            else:
+                chunk_id = str(uuid.uuid4())
+                appender.add(chunk_id, text, metadata)
+            entries.append([key, chunk_id])
+        for ids in previous.values():
+            stale_ids.extend(ids)
+        manifest['files'][name] = {'sha256': hashes[name], 'pages': pages, 'chunks': entries}
+        progress.file_done(path, pages, len(chunks))
+    appender.flush()
+    if changed:
+        progress.report(force=True)
 
-def create_vector_db():
-    loader= DirectoryLoader(DATA_PATH,glob="*.pdf", loader_cls=PyPDFLoader)
-    documents= loader.load()
-    text_splitter= RecursiveCharacterTextSplitter(chunk_size= 500, chunk_overlap=50)
-    texts=text_splitter.split_documents(documents)
+    db = appender.db
+    if db is not None and stale_ids:
+        db.delete(stale_ids)
+    if db is None:
+        logger.warning(f"No PDF content found in {data_path}")
+        return None
 
-    embeddings= HuggingFaceEmbeddings(model_name= "sentence-transformers/all-MiniLM-L6-v2", 
-                                      model_kwargs={"device":"cpu"})
-    
-    db=FAISS.from_documents(texts,embeddings)
-    db.save_local(DB_FAISS_PATH)
+    os.makedirs(db_path, exist_ok=True)
+    db.save_local(db_path)
+    save_manifest(db_path, manifest)
+    if EXPORT_CHUNK_STORE:
+        export_langchain_faiss(db, chunks_path, version=index_version(db_path))
+    export_sparse_index(db, chunks_path if EXPORT_CHUNK_STORE else db_path)
+    logger.info(f"Vector store saved to {db_path}: {len(changed)} changed, {len(removed)} removed, "
+                f"{appender.added} chunks embedded, {len(stale_ids)} chunks deleted")
+    return db
 
-if __name__=="__main__":
-    create_vector_db()
 
-    
\ No newline at end of file
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Incrementally build the FAISS vector store from PDFs")
+    parser.add_argument('--full', action='store_true', help="rebuild the whole index")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=EMBED_BATCH_SIZE)
+    args = parser.parse_args()
+    create_vector_db(full=args.full, workers=args.workers, batch_size=args.batch_size)
@@ -0,0 +1,141 @@
+import logging
+import os
+import re
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INTENT_THRESHOLD = float(os.getenv('INTENT_THRESHOLD', 0.8))
+
+GREETING = 'greeting'
+FAREWELL = 'farewell'
+THANKS = 'thanks'
+BOOKING = 'booking'
+AFFIRM = 'affirm'
+DENY = 'deny'
+OPEN = 'open'
+
+END = r'[\s!.,?]*$'
+NAME = r'(?:\s+ada)?'
+
+# Short, whole-message intents come first. Booking needs a booking verb with
+# an appointment-like object, or a message that starts with the verb, since
+# 'schedule' is also a policy document ("what does my policy schedule cover").
+# Everything is compiled into one alternation so a message is scanned once.
+PATTERNS = [
+    (GREETING, rf'^(?:hi|hello|hey|hiya|greetings|good\s+(?:morning|afternoon|evening))(?:\s+there)?{NAME}{END}'),
+    (THANKS, rf'^(?:thanks|thank\s+you|thx|cheers)(?:\s+(?:so|very)\s+much)?{NAME}{END}'),
+    (FAREWELL, rf'^(?:bye|goodbye|good\s+bye|see\s+you|see\s+ya|that\'?s\s+all|have\s+a\s+(?:good|nice|great)\s+day){NAME}{END}'),
+    (AFFIRM, rf'^(?:yes|yeah|yep|sure|ok|okay|proceed|go\s+ahead|let\'?s\s+do\s+it)(?:\s+please)?{END}'),
+    (DENY, rf'^(?:no|nope|nah|not\s+now|maybe\s+later|cancel|stop|never\s*mind)(?:\s+thanks|\s+thank\s+you)?{END}'),
+    (BOOKING, r'\b(?:(?:book|schedule|arrange)(?:\s+me)?(?:\s+(?:an?|another|the))?'
+              r'|(?:set\s+up|make|need|want|request)(?:\s+me)?\s+(?:an?|another|the))'
+              r'(?:\s+\w+)?\s+(?:appointment|consultation|meeting|call)s?\b'
+              rf'|^(?:please\s+)?(?:book|schedule)(?:\s+(?:me|it|one|that|in|now|please))*{END}'),
+]
+
+# A booking match after one of these in the same clause is a refusal:
+# "I don't want to book an appointment", "no, I don't need a consultation"
+NEGATION = re.compile(r"\b(?:don[’']?t|do\s+not|doesn[’']?t|won[’']?t|no|not|never)\b", re.IGNORECASE)
+CLAUSE_BREAK = re.compile(r'[.,;!?]|\bbut\b', re.IGNORECASE)
+
+TEMPLATES = {
+    GREETING: "Hello! I'm ADA, the insurance assistant at Wing Heights Ghana. How can I help you today?",
+    THANKS: "You're welcome! Is there anything else I can help you with?",
+    FAREWELL: "Thank you for chatting with Wing Heights Ghana. Have a great day!",
+}
+
+# Labelled phrasings for the nearest-centroid fallback; 'open' soaks up real questions
+EXAMPLES = {
+    GREETING: ["hi", "hello there", "good morning", "hey, how are you", "hello, anyone there?", "hi, nice to meet you"],
+    THANKS: ["thank you", "thanks a lot", "that was helpful, thanks", "I appreciate your help", "great, thank you so much"],
+    FAREWELL: ["bye", "goodbye", "see you later", "that's all for today", "I have to go now", "talk to you later"],
+    BOOKING: ["I want to book an appointment", "can I schedule a consultation", "I'd like to meet an agent",
+              "set up a meeting with a specialist", "how do I make an appointment", "reserve a slot with an advisor",
+              "book me in", "can we arrange a call with an agent"],
+    OPEN: ["what does health insurance cover", "how much does life insurance cost", "tell me about auto insurance",
+           "what is the difference between home and travel insurance", "do you offer business insurance",
+           "how do I make a claim", "what documents do I need", "which insurance is best for my family",
+           "what does my policy schedule cover", "can you send me my policy schedule",
+           "how do I proceed with a claim", "is my premium payment scheduled monthly"],
+}
+
+
+def negated(text, start):
+    clause = CLAUSE_BREAK.split(text[:start])[-1]
+    return NEGATION.search(clause) is not None
+
+
+class Intent:
+    __slots__ = ('name', 'source', 'score', 'vector')
+
+    def __init__(self, name, source, score=1.0, vector=None):
+        self.name = name
+        self.source = source
+        self.score = score
+        # The message embedding when the classifier ran, for retrieval to reuse
+        self.vector = vector
+
+
+class CentroidClassifier:
+    # Nearest centroid over sentence embeddings of the labelled examples
+    def __init__(self, embeddings, examples=EXAMPLES, threshold=INTENT_THRESHOLD, executor=None):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        # e.g. eventlet.tpool.execute, so embedding runs off the hub
+        self.execute = executor or (lambda fn, *args: fn(*args))
+        self.labels = list(examples)
+        centroids = []
+        for label in self.labels:
+            vectors = np.asarray(embeddings.embed_documents(examples[label]), dtype=np.float32)
+            centroid = vectors.mean(axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+        self.centroids = np.stack(centroids)
+
+    def classify(self, text):
+        # Returns the label, its score and the message embedding
+        vector = np.asarray(self.execute(self.embeddings.embed_query, text), dtype=np.float32)
+        scores = self.centroids @ (vector / np.linalg.norm(vector))
+        best = int(scores.argmax())
+        return self.labels[best], float(scores[best]), vector
+
+
+class IntentRouter:
+    def __init__(self, patterns=PATTERNS):
+        self.pattern = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in patterns), re.IGNORECASE)
+        self.counts = {}
+
+    def classify(self, text, classifier=None):
+        text = (text or '').strip()
+        match = self.pattern.search(text)
+        if match:
+            name = match.lastgroup
+            if name == BOOKING and negated(text, match.start()):
+                name = DENY
+            intent = Intent(name, 'pattern')
+        elif classifier is not None:
+            try:
+                name, score, vector = classifier.classify(text)
+            except Exception as e:
+                logger.error(f"Error classifying intent: {str(e)}")
+                name, score, vector = OPEN, 0.0, None
+            intent = Intent(name if score >= classifier.threshold else OPEN, 'classifier', score, vector)
+        else:
+            intent = Intent(OPEN, 'default', 0.0)
+        key = f"{intent.name}:{intent.source}"
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return intent
+
+    def stats(self):
+        total = sum(self.counts.values())
+        short_circuited = sum(count for key, count in self.counts.items() if not key.startswith(OPEN + ':'))
+        return {
+            'messages': total,
+            'short_circuited': short_circuited,
+            'short_circuit_rate': short_circuited / total if total else 0.0,
+            'intents': dict(self.counts),
+        }
+
+
+intent_router = IntentRouter()
@@ -0,0 +1,279 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import operator
+import os
+import queue
+import threading
+import time
+
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 100))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 30))
+
+# Lower runs first
+PRIORITY_APPOINTMENT = 0
+PRIORITY_CHAT = 1
+# Work nobody is waiting on, such as folding old turns into a summary
+PRIORITY_BACKGROUND = 2
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+# name -> dispatcher; the metrics below carry one series per dispatcher
+_dispatchers = {}
+
+
+def _register(dispatcher):
+    if dispatcher.name in _dispatchers:
+        raise ValueError(f"An LLM dispatcher named {dispatcher.name!r} already exists")
+    _dispatchers[dispatcher.name] = dispatcher
+
+
+def _per_dispatcher(read):
+    return lambda: {(name,): read(dispatcher) for name, dispatcher in list(_dispatchers.items())}
+
+
+wait_ms = Histogram([1, 5, 10, 50, 100, 500, 1000, 5000, 10000], name='llm_wait_ms',
+                    help="Time a call waited in the queue", labelnames=('dispatcher',))
+call_ms = Histogram([100, 250, 500, 1000, 2500, 5000, 10000, 30000], name='llm_call_ms',
+                    help="Upstream call duration", labelnames=('dispatcher',))
+Gauge('llm_in_flight', "Calls running upstream", labelnames=('dispatcher',),
+      fn=_per_dispatcher(lambda dispatcher: dispatcher.in_flight))
+Gauge('llm_queue_depth', "Calls waiting for a worker", labelnames=('dispatcher',),
+      fn=_per_dispatcher(lambda dispatcher: dispatcher.queue_depth))
+for _outcome in ('completed', 'rejected', 'timed_out', 'failed'):
+    Counter(f'llm_{_outcome}_total', f"Calls {_outcome.replace('_', ' ')}", labelnames=('dispatcher',),
+            fn=_per_dispatcher(operator.attrgetter(_outcome)))
+
+
+# The job a dispatcher worker thread is running
+_worker = threading.local()
+
+
+def job_abandoned():
+    # True inside a dispatcher call whose caller has given up on it; a
+    # streaming call checks this between chunks and stops forwarding output
+    job = getattr(_worker, 'job', None)
+    return job is not None and job.abandoned
+
+
+class _Job:
+    __slots__ = ('fn', 'deadline', 'enqueued', 'done', 'result', 'error', 'abandoned')
+
+    def __init__(self, fn, deadline):
+        self.fn = fn
+        self.deadline = deadline
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class LLMDispatcher:
+    # Bounded pool for upstream LLM calls: at most max_concurrency calls in
+    # flight, at most max_queue waiting (by priority, FIFO within a priority),
+    # and every call carries a deadline.
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 default_timeout=LLM_TIMEOUT, name='llm'):
+        self.max_concurrency = max_concurrency
+        self.default_timeout = default_timeout
+        self.name = name
+        self.queue = queue.PriorityQueue(maxsize=max_queue)
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self._sequence = itertools.count()
+        self._workers = []
+        self._lock = threading.Lock()
+        _register(self)
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _start(self):
+        with self._lock:
+            while len(self._workers) < self.max_concurrency:
+                worker = threading.Thread(target=self._run, name=f'{self.name}-{len(self._workers)}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def call(self, fn, priority=PRIORITY_CHAT, timeout=None):
+        # fn receives the seconds left before the deadline, to pass on as the
+        # HTTP timeout of the upstream request
+        self._start()
+        timeout = self.default_timeout if timeout is None else timeout
+        job = _Job(fn, time.monotonic() + timeout)
+        try:
+            self.queue.put_nowait((priority, next(self._sequence), job))
+        except queue.Full:
+            self.rejected += 1
+            raise QueueFullError(f"{self.name} queue is full ({self.queue.maxsize} waiting)")
+        try:
+            finished = job.done.wait(timeout)
+        except BaseException:
+            # The caller was cancelled (e.g. its greenlet killed)
+            job.abandoned = True
+            raise
+        if not finished:
+            job.abandoned = True
+            self.timed_out += 1
+            raise DeadlineExceededError(f"{self.name} call did not finish within {timeout}s")
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _run(self):
+        while True:
+            _, _, job = self.queue.get()
+            started = time.monotonic()
+            wait_ms.observe((started - job.enqueued) * 1000, dispatcher=self.name)
+            remaining = job.deadline - started
+            if job.abandoned or remaining <= 0:
+                # The caller has already given up, don't spend upstream capacity on it
+                job.done.set()
+                continue
+            self.in_flight += 1
+            _worker.job = job
+            try:
+                job.result = job.fn(remaining)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                job.error = e
+            finally:
+                _worker.job = None
+                self.in_flight -= 1
+                call_ms.observe((time.monotonic() - started) * 1000, dispatcher=self.name)
+                job.done.set()
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'queue_capacity': self.queue.maxsize,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'failed': self.failed,
+            'wait_ms': wait_ms.snapshot(dispatcher=self.name),
+            'call_ms': call_ms.snapshot(dispatcher=self.name),
+        }
+
+
+class AsyncLLMDispatcher:
+    # The same limits for asyncio callers. Instead of worker threads, callers
+    # run their own coroutine once they hold one of max_concurrency slots;
+    # waiters sit in a heap of futures and a finishing call hands its slot
+    # straight to the next one.
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, max_queue=LLM_MAX_QUEUE,
+                 default_timeout=LLM_TIMEOUT, name='llm_async'):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self.name = name
+        self.waiters = []
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.failed = 0
+        self._sequence = itertools.count()
+        _register(self)
+
+    @property
+    def queue_depth(self):
+        return len(self.waiters)
+
+    async def _acquire(self, priority, timeout):
+        if self.in_flight < self.max_concurrency and not self.waiters:
+            self.in_flight += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(f"{self.name} queue is full ({self.max_queue} waiting)")
+        entry = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self.waiters, entry)
+        try:
+            await asyncio.wait_for(entry[2], timeout)
+        except asyncio.TimeoutError:
+            self._forget(entry)
+            self.timed_out += 1
+            raise DeadlineExceededError(f"{self.name} call did not finish within {timeout}s")
+        except asyncio.CancelledError:
+            if entry[2].done() and not entry[2].cancelled():
+                # The slot was handed over just as the caller went away
+                self._release()
+            else:
+                self._forget(entry)
+            raise
+
+    def _forget(self, entry):
+        if entry in self.waiters:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+
+    def _release(self):
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # The slot passes to the next waiter, in_flight stays the same
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def call(self, fn, priority=PRIORITY_CHAT, timeout=None):
+        # fn is a coroutine function receiving the seconds left before the
+        # deadline, to pass on as the HTTP timeout of the upstream request
+        timeout = self.default_timeout if timeout is None else timeout
+        enqueued = time.monotonic()
+        deadline = enqueued + timeout
+        await self._acquire(priority, timeout)
+        started = time.monotonic()
+        wait_ms.observe((started - enqueued) * 1000, dispatcher=self.name)
+        try:
+            result = await asyncio.wait_for(fn(deadline - started), deadline - started)
+            self.completed += 1
+            return result
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise DeadlineExceededError(f"{self.name} call did not finish within {timeout}s")
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            call_ms.observe((time.monotonic() - started) * 1000, dispatcher=self.name)
+            self._release()
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'queue_capacity': self.max_queue,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'failed': self.failed,
+            'wait_ms': wait_ms.snapshot(dispatcher=self.name),
+            'call_ms': call_ms.snapshot(dispatcher=self.name),
+        }
+
+
+llm_dispatcher = LLMDispatcher()
@@ -0,0 +1,273 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import re
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = os.getenv('METRICS_PREFIX', 'chatbot')
+# Fraction of requests that record a per-stage trace
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.01))
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 100))
+
+STAGE_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+
+def metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', f'{METRICS_PREFIX}_{name}')
+
+
+def format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in self.metrics.values():
+            if metric.help:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help='', labelnames=(), fn=None, register=True):
+        self.name = metric_name(name)
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # fn reads the value at scrape time from a component's own counters;
+        # with labelnames it returns {label values tuple: value}
+        self.fn = fn
+        self.values = {}
+        if register:
+            registry.register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(label, '') for label in self.labelnames)
+
+    def _read(self):
+        if self.fn is None:
+            return self.values
+        if self.labelnames:
+            return self.fn()
+        return {(): self.fn()}
+
+    def value(self, **labels):
+        return self._read().get(self._key(labels), 0)
+
+    def samples(self):
+        try:
+            values = self._read()
+        except Exception as e:
+            logger.error(f"Error reading metric {self.name}: {str(e)}")
+            return []
+        return [f'{self.name}{format_labels(self.labelnames, key)} {float(value)}'
+                for key, value in list(values.items())]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class _Series:
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram:
+    # Fixed buckets, one series per label combination. Unnamed histograms
+    # stay out of /metrics and are only read through snapshot().
+    type = 'histogram'
+
+    def __init__(self, buckets, name=None, help='', labelnames=()):
+        self.buckets = list(buckets)
+        self.name = metric_name(name) if name else None
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        if name:
+            registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labelnames)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series.setdefault(key, _Series(len(self.buckets) + 1))
+        series.counts[bisect_left(self.buckets, value)] += 1
+        series.count += 1
+        series.sum += value
+
+    def snapshot(self, **labels):
+        key = tuple(labels.get(label, '') for label in self.labelnames)
+        series = self.series.get(key) or _Series(len(self.buckets) + 1)
+        bucket_labels = [str(bucket) for bucket in self.buckets] + ['+Inf']
+        return {
+            'buckets': dict(zip(bucket_labels, series.counts)),
+            'count': series.count,
+            'sum': series.sum,
+        }
+
+    @property
+    def count(self):
+        return sum(series.count for series in self.series.values())
+
+    def samples(self):
+        lines = []
+        for key, series in list(self.series.items()):
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ['+Inf'], series.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, key, [("le", bucket)])} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, key)} {series.sum}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, key)} {series.count}')
+        return lines
+
+
+stage_ms = Histogram(STAGE_BUCKETS_MS, name='stage_ms', help="Time spent in each request stage", labelnames=('stage',))
+tokens_total = Counter('tokens_total', "Tokens charged to sessions", labelnames=('kind',))
+messages_total = Counter('messages_total', "Handled socket events", labelnames=('event', 'outcome'))
+
+
+class Trace:
+    __slots__ = ('name', 'started', 'spans', 'attrs')
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.started = time.time()
+        self.spans = []
+        self.attrs = attrs
+
+    def to_dict(self, total_ms):
+        return {
+            'name': self.name,
+            'started': self.started,
+            'total_ms': total_ms,
+            'spans': [{'stage': stage, 'start_ms': start, 'ms': ms} for stage, start, ms in self.spans],
+            'attrs': self.attrs,
+        }
+
+
+# Per greenlet under eventlet, per task under asyncio
+_current = ContextVar('trace', default=None)
+recent_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    # Times one stage into stage_ms and, when this request is sampled, its trace
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        finished = time.perf_counter()
+        elapsed = (finished - started) * 1000
+        stage_ms.observe(elapsed, stage=name)
+        trace = current_trace()
+        if trace is not None:
+            trace.spans.append((name, round((started - trace.attrs['_t0']) * 1000, 3), round(elapsed, 3)))
+
+
+def _start_trace(name):
+    sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+    trace = Trace(name, {'_t0': time.perf_counter()}) if sampled else None
+    return trace, _current.set(trace)
+
+
+def _finish_trace(trace, token):
+    _current.reset(token)
+    if trace is not None:
+        started = trace.attrs.pop('_t0')
+        record = trace.to_dict(round((time.perf_counter() - started) * 1000, 3))
+        recent_traces.append(record)
+        logger.info(f"trace {json.dumps(record)}")
+
+
+def traced(name):
+    # Decorator for socket handlers, plain or async: times the whole handler
+    # as a stage and samples TRACE_SAMPLE_RATE of calls into a per-stage trace
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                trace, token = _start_trace(name)
+                try:
+                    with stage(name):
+                        return await fn(*args, **kwargs)
+                finally:
+                    _finish_trace(trace, token)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace, token = _start_trace(name)
+            try:
+                with stage(name):
+                    return fn(*args, **kwargs)
+            finally:
+                _finish_trace(trace, token)
+        return wrapper
+    return decorator
+
+
+def annotate(**attrs):
+    # Adds attributes to the current trace, if this request is sampled
+    trace = current_trace()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def render():
+    return registry.render()
@@ -1,20 +1,37 @@
 from datetime import datetime
 import eventlet
 eventlet.monkey_patch()
-from flask import Flask
+from flask import Flask, jsonify, request
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 import uuid
+import hmac
 from groq import Groq
 import os
 from dotenv import load_dotenv
-import csv
 import logging
-import tiktoken
+from token_accounting import token_accountant, TokenUsage
+from history_writer import history_writer
+from storage import storage
+from llm_dispatch import (
+    llm_dispatcher, job_abandoned, PRIORITY_APPOINTMENT, PRIORITY_BACKGROUND, PRIORITY_CHAT, QueueFullError,
+    DeadlineExceededError
+)
+from session_store import register_type, SOCKETIO_MESSAGE_QUEUE
+from session_manager import session_manager
+from conversation_memory import ConversationMemory
+from intent_router import intent_router, TEMPLATES, AFFIRM, BOOKING, DENY
+from prompts import (
+    CHAT_SYSTEM_PROMPT, FAREWELL_SYSTEM_PROMPT, SUMMARY_SYSTEM_PROMPT, APPOINTMENT_FORM_RESPONSE,
+    DECLINE_RESPONSE, OVER_BUDGET_RESPONSE, farewell_prompt, offers_appointment
+)
+from metrics import messages_total, recent_traces, render as render_metrics, stage, tokens_total, traced
+
+load_dotenv()
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler('chatbot.log'),
@@ -23,40 +40,205 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-
 app = Flask(__name__)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+# With a message queue, several workers can emit to clients connected to any of them
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet', message_queue=SOCKETIO_MESSAGE_QUEUE)
 
-chatbot_sessions = {}
+# Sessions live in the shared store so any worker can serve them and they survive restarts
+register_type('usage', TokenUsage, TokenUsage.to_list, TokenUsage.from_list)
+register_type('memory', ConversationMemory, ConversationMemory.to_list, ConversationMemory.from_list)
 groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+# Socket.IO sid -> session id handed out in session_created
+client_sessions = {}
+# Sessions with a summary being written in the background
+folding_sessions = set()
 
 CHATBOT_DATA_PATH = "chatbot_data.csv"
 APPOINTMENTS_CSV_PATH = "appointments.csv"
 USER_DATA_PATH = "user_data.csv"
 CHAT_HISTORY_PATH = "chat_history.csv"
 MAX_TOKENS = 1000
+# Share of MAX_TOKENS spent on conversation history in each prompt
+PROMPT_HISTORY_TOKENS = int(os.getenv('PROMPT_HISTORY_TOKENS', MAX_TOKENS // 2))
+SUMMARIZE_WITH_LLM = os.getenv('SUMMARIZE_WITH_LLM', 'true').lower() == 'true'
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
+# Bearer token for the ops query routes; they serve customer PII, so they
+# stay disabled (403) until a token is configured
+OPS_API_TOKEN = os.getenv('OPS_API_TOKEN')
+
+def generate_response(messages, max_tokens, on_chunk=None, priority=PRIORITY_CHAT):
+    def complete(timeout):
+        if on_chunk is None:
+            chat_completion = groq_client.chat.completions.create(
+                messages=messages,
+                model=os.getenv('LLAMA_MODEL'),
+                temperature=0.7,
+                max_tokens=max_tokens,
+                timeout=timeout
+            )
+            return chat_completion.choices[0].message.content
+
+        # Forward partial output as it arrives and hand back the assembled text
+        # so token accounting and history still see the full response
+        stream = groq_client.chat.completions.create(
+            messages=messages,
+            model=os.getenv('LLAMA_MODEL'),
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True,
+            timeout=timeout
+        )
+        parts = []
+        for chunk in stream:
+            if job_abandoned():
+                # The caller has timed out and sent its own reply
+                stream.close()
+                break
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                on_chunk(delta)
+        return ''.join(parts)
+
+    # Bounded concurrency, priority queueing and a deadline for every Groq call
+    with stage('llm'):
+        return llm_dispatcher.call(complete, priority=priority)
+
+def summarize(summary, turns):
+    transcript = "\n".join(f"{role}: {content}" for role, content, _ in turns)
+    return generate_response(
+        [
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{summary or 'None'}\n\nNew turns:\n{transcript}"}
+        ],
+        max_tokens=150,
+        priority=PRIORITY_BACKGROUND
+    )
+
+def compact_memory(session_id, session):
+    # Called once the reply is out. The summary is written in a background
+    # task from a snapshot, then merged into a freshly loaded session so turns
+    # and form state saved in the meantime are kept.
+    memory = session['context']['memory']
+    folding = memory.foldable()
+    if not folding or session_id in folding_sessions:
+        return
+    folding_sessions.add(session_id)
+    snapshot = ConversationMemory(None, memory.summary, memory.summary_tokens, memory.folded)
+    socketio.start_background_task(fold_memory, session_id, snapshot, folding)
+
+def fold_memory(session_id, snapshot, folding):
+    try:
+        with stage('summarize'):
+            summary, summary_tokens = snapshot.fold_summary(folding, summarize if SUMMARIZE_WITH_LLM else None)
+        session = session_manager.get(session_id)
+        if session and session['context']['memory'].apply_fold(folding, summary, summary_tokens, snapshot.folded):
+            session_manager.put(session_id, session)
+            logger.info(f"Folded older turns into the summary for session {session_id}")
+    except Exception as e:
+        logger.error(f"Error folding memory for session {session_id}: {str(e)}")
+    finally:
+        folding_sessions.discard(session_id)
+
+def chunk_emitter(sid):
+    # Chunks are produced on a dispatcher worker, outside the request context
+    return lambda chunk: socketio.emit('response_chunk', {'chunk': chunk}, to=sid)
 
-def count_tokens(text):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(text))
+def emit_response(response, show_form, usage, stream=False):
+    if stream:
+        emit('response_done', {
+            'response': response,
+            'showForm': show_form,
+            'token_count': usage.total_tokens,
+            'max_tokens': MAX_TOKENS
+        })
+        return
+    emit('response', {
+        'response': response,
+        'showForm': show_form
+    })
+
+@app.route('/history/stats')
+def history_stats():
+    return jsonify(history_writer.stats())
+
+@app.route('/llm/stats')
+def llm_stats():
+    return jsonify(llm_dispatcher.stats())
+
+@app.route('/metrics')
+def metrics():
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/traces')
+def traces():
+    return jsonify(list(recent_traces))
+
+@app.route('/sessions/stats')
+def session_stats():
+    return jsonify(session_manager.stats())
+
+@app.route('/intents/stats')
+def intent_stats():
+    return jsonify(intent_router.stats())
+
+def ops_denied():
+    # Error response for the ops routes, or None when the caller may proceed
+    if not OPS_API_TOKEN:
+        return jsonify({'error': 'Ops API disabled'}), 403
+    supplied = request.headers.get('Authorization', '').encode('utf-8')
+    if not hmac.compare_digest(supplied, f"Bearer {OPS_API_TOKEN}".encode('utf-8')):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+@app.route('/appointments')
+def list_appointments():
+    denied = ops_denied()
+    if denied:
+        return denied
+    date = request.args.get('date')
+    email = request.args.get('email')
+    if date:
+        return jsonify(storage.appointments_on(date))
+    if email:
+        return jsonify(storage.appointments_for_email(email))
+    return jsonify({'error': 'Pass a date or email'}), 400
+
+@app.route('/sessions/<session_id>/transcript')
+def session_transcript(session_id):
+    denied = ops_denied()
+    if denied:
+        return denied
+    return jsonify(storage.transcript(session_id))
 
 @socketio.on('connect')
 def handle_connect():
     session_id = str(uuid.uuid4())
-    chatbot_sessions[session_id] = {
+    session_manager.put(session_id, {
         'state': 'initial',
         'context': {
-            'messages': [],
+            'memory': ConversationMemory(),
             'appointment_details': None,
-            'total_tokens': 0
+            'usage': TokenUsage()
         }
-    }
+    })
+    client_sessions[request.sid] = session_id
     logger.info(f"New client connected. Session ID: {session_id}")
     emit('session_created', {'session_id': session_id})
 
+@socketio.on('disconnect')
+def handle_disconnect():
+    # Every connection gets a new session, so it ends with the socket
+    session_id = client_sessions.pop(request.sid, None)
+    logger.info(f"Client disconnected. Session ID: {session_id}")
+    if session_id:
+        session_manager.delete(session_id)
+
 @socketio.on('message')
+@traced('handle_message')
 def handle_message(data):
     try:
         session_id = data.get('session_id')
@@ -67,118 +249,96 @@ def handle_message(data):
             emit('error', {'message': 'Missing session_id'})
             return
             
-        session = chatbot_sessions.get(session_id)
+        session = session_manager.get(session_id)
         if not session:
             logger.error(f"Invalid session ID: {session_id}")
             emit('error', {'message': 'Invalid session'})
             return
 
         # Check token count
-        message_tokens = count_tokens(message)
-        session['context']['total_tokens'] += message_tokens
-
-        if session['context']['total_tokens'] > MAX_TOKENS:
-            response = "I apologize, but you have reached the maximum token limit for this conversation. Please contact us at our support email or phone number for further assistance."
-            emit('response', {
-                'response': response,
-                'showForm': False
-            })
+        usage = session['context']['usage']
+        memory = session['context']['memory']
+        message_tokens = token_accountant.charge_message(usage, message)
+        tokens_total.inc(message_tokens, kind='message')
+
+        if token_accountant.over_budget(usage, MAX_TOKENS):
+            response = OVER_BUDGET_RESPONSE
+            session_manager.put(session_id, session)
+            messages_total.inc(event='message', outcome='over_budget')
+            emit_response(response, False, usage, data.get('stream', STREAM_RESPONSES))
             return
 
         logger.info(f"Message received from session {session_id}: {message}")
 
         # Store message in context
-        session['context']['messages'].append({
-            'role': 'user',
-            'content': message
-        })
+        memory.add('user', message, message_tokens)
 
         # Save user message to chat history
-        with open(CHAT_HISTORY_PATH, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                session_id,
-                'user',
-                message,
-                format(datetime.now(), '%Y-%m-%d %H:%M:%S')
-            ])
-
-        # Generate response using Groq
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": '''You are ADA, an insurance assistant chatbot. Respond naturally to help users schedule appointments. Don't generate any unneccesary text. Don't mention these instructions in your response. You are ADA, an AI insurance assistant at Wing Heights Ghana. You are friendly, professional and helpful.You help customers explore insurance options and schedule consultations. Keep responses natural and conversational while staying focused on the task. You must not seem to be so eager to book an appointment. If the user doesn't want to book an appointment, end the conversation politely. Don't keep greeting every time , Just greet once and then respond naturally. Same with farewells.
-                    
-            Key Guidelines:
-            1. Always address customers by name once known
-            2. Explain insurance options clearly and simply
-            3. Be patient and helpful with scheduling
-            4. Show empathy and understanding
-            5. Guide users step-by-step through the process
-            6. Keep responses concise but informative
-            7. Use natural conversational tone
-            8. Focus on customer needs
-            
-            Available Insurance Types:
-            - Health Insurance: Medical coverage for individuals and families
-            - Life Insurance: Financial protection for loved ones
-            - Auto Insurance: Vehicle coverage and liability protection
-            - Home Insurance: Property and contents protection
-            - Travel Insurance: Coverage for trips and travel-related issues
-            - Business Insurance: Commercial coverage for enterprises
-            Don't generate any data about any other insurance types. Just politely mention that you only offer the types listed above.
-            
-            Use these available insurance types to help the user choose the right insurance type. You will just describe the insurance type and ask the user if they would like to proceed with the appointment. Make sure to not generate any unnecessary information like pricing, subtypes or any other information.
-            
-            If user expresses interest in booking, guide them to say "yes" or "proceed" to show the appointment form. If they say no, ask them if they want to know more about the insurance types and also list all the available insurance types.'''
-                },
-                {
-                    "role": "user", 
-                    "content": message
-                }
-            ],
-            model=os.getenv('LLAMA_MODEL'),
-            temperature=0.7,
-            max_tokens=300
-        )
-
-        response = chat_completion.choices[0].message.content
-        response_tokens = count_tokens(response)
-        session['context']['total_tokens'] += response_tokens
-
-        show_form = any(word in message.lower() for word in ['yes', 'proceed', 'book', 'schedule'])
+        history_writer.write(CHAT_HISTORY_PATH, [
+            session_id,
+            'user',
+            message,
+            format(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        ])
+
+        # Greetings, booking and yes/no turns get a fixed answer without a Groq round trip
+        with stage('intent'):
+            intent = intent_router.classify(message)
+        # A yes only books when the last reply offered an appointment
+        offer_pending = session.get('state') == 'offer_pending'
+        show_form = intent.name == BOOKING or (intent.name == AFFIRM and offer_pending)
+        stream = data.get('stream', STREAM_RESPONSES)
 
         if show_form:
-            response = "Great! I'll help you schedule an appointment. Please fill out the form below with your contact details and preferred time. I'll make sure to connect you with one of our insurance specialists."
+            response = APPOINTMENT_FORM_RESPONSE
             logger.info(f"Showing appointment form to session {session_id}")
+        elif intent.name == DENY and offer_pending:
+            response = DECLINE_RESPONSE
+        elif intent.name in TEMPLATES:
+            response = TEMPLATES[intent.name]
+        else:
+            with stage('prompt'):
+                messages = memory.build_messages(CHAT_SYSTEM_PROMPT, PROMPT_HISTORY_TOKENS)
+            response = generate_response(
+                messages,
+                max_tokens=300,
+                on_chunk=chunk_emitter(request.sid) if stream else None
+            )
+        session['state'] = 'offer_pending' if offers_appointment(response) else 'initial'
+        response_tokens = token_accountant.charge_response(usage, response)
+        tokens_total.inc(response_tokens, kind='response')
+        messages_total.inc(event='message', outcome=intent.name)
 
         # Store bot response in context
-        session['context']['messages'].append({
-            'role': 'bot',
-            'content': response
-        })
+        memory.add('assistant', response, response_tokens)
+        session_manager.put(session_id, session)
 
         # Save bot response to chat history
-        with open(CHAT_HISTORY_PATH, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                session_id,
-                'bot',
-                response,
-                format(datetime.now(), '%Y-%m-%d %H:%M:%S')
-            ])
-
-        emit('response', {
-            'response': response,
-            'showForm': show_form
-        })
+        history_writer.write(CHAT_HISTORY_PATH, [
+            session_id,
+            'bot',
+            response,
+            format(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        ])
+
+        emit_response(response, show_form, usage, stream)
+        compact_memory(session_id, session)
             
+    except QueueFullError:
+        logger.warning(f"LLM queue full, turning away message from session {data.get('session_id')}")
+        messages_total.inc(event='message', outcome='busy')
+        emit('error', {'message': "We're receiving a lot of messages right now. Please try again in a moment."})
+    except DeadlineExceededError:
+        logger.warning(f"LLM call timed out for session {data.get('session_id')}")
+        messages_total.inc(event='message', outcome='timeout')
+        emit('error', {'message': 'Sorry, that took too long. Please try again.'})
     except Exception as e:
         logger.error(f"Error handling message: {str(e)}", exc_info=True)
+        messages_total.inc(event='message', outcome='error')
         emit('error', {'message': 'Sorry, I encountered an error. Please try again.'})
 
 @socketio.on('submit_appointment')
+@traced('handle_appointment')
 def handle_appointment(data):
     try:
         session_id = data.get('session_id')
@@ -189,7 +349,7 @@ def handle_appointment(data):
             emit('error', {'message': 'Please fill in all required fields'})
             return
 
-        session = chatbot_sessions.get(session_id)
+        session = session_manager.get(session_id)
         if not session:
             logger.error(f"Invalid session ID during appointment submission: {session_id}")
             emit('error', {'message': 'Invalid session'})
@@ -206,95 +366,77 @@ def handle_appointment(data):
 
         # Store appointment details in context
         session['context']['appointment_details'] = details
+        session_manager.put(session_id, session)
             
         # Save appointment details to appointments.csv
-        with open(APPOINTMENTS_CSV_PATH, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                details['name'],
-                details['contact_number'],
-                details['email'], 
-                details['date'],
-                details['time'],
-                details['insuranceType']
-            ])
+        history_writer.write(APPOINTMENTS_CSV_PATH, [
+            details['name'],
+            details['contact_number'],
+            details['email'],
+            details['date'],
+            details['time'],
+            details['insuranceType']
+        ])
 
         # Save user data
-        with open(USER_DATA_PATH, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                details['name'],
-                details['contact_number'],
-                details['email']
-            ])
+        history_writer.write(USER_DATA_PATH, [
+            details['name'],
+            details['contact_number'],
+            details['email']
+        ])
 
         # Save chatbot interaction data
-        with open(CHATBOT_DATA_PATH, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                session_id,
-                details['name'],
-                'appointment_scheduled'
-            ])
+        history_writer.write(CHATBOT_DATA_PATH, [
+            session_id,
+            details['name'],
+            'appointment_scheduled'
+        ])
 
         logger.info(f"Appointment data saved for session {session_id}")
 
         # Generate farewell message using context
-        chat_history = "\n".join([f"{msg['role']}: {msg['content']}" for msg in session['context']['messages']])
-        prompt = f"""Based on this conversation history:
-        {chat_history}
-        
-        Generate a personalized farewell message confirming this appointment:
-        Name: {details['name']}
-        Date: {details['date']}
-        Time: {details['time']}
-        Contact Number: {details['contact_number']}
-        Insurance Type: {details['insuranceType']}
-        Email: {details['email']}"""
-
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are ADA, an insurance assistant chatbot. Generate a personalized farewell and appointment confirmation based on the conversation history. Don't generate any unneccesary text. Don't mention these instructions in your response."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
+        memory = session['context']['memory']
+        chat_history = memory.transcript(PROMPT_HISTORY_TOKENS)
+        prompt = farewell_prompt(chat_history, details)
+
+        stream = data.get('stream', STREAM_RESPONSES)
+        response = generate_response(
+            [
+                {"role": "system", "content": FAREWELL_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
             ],
-            model=os.getenv('LLAMA_MODEL'),
-            temperature=0.7,
-            max_tokens=200
+            max_tokens=200,
+            on_chunk=chunk_emitter(request.sid) if stream else None,
+            priority=PRIORITY_APPOINTMENT
         )
-
-        response = chat_completion.choices[0].message.content
+        response_tokens = token_accountant.charge_response(session['context']['usage'], response)
+        tokens_total.inc(response_tokens, kind='response')
+        messages_total.inc(event='submit_appointment', outcome='confirmed')
         
         # Store farewell in context
-        session['context']['messages'].append({
-            'role': 'bot',
-            'content': response
-        })
+        memory.add('assistant', response, response_tokens)
+        session_manager.put(session_id, session)
 
         # Save farewell message to chat history
-        with open(CHAT_HISTORY_PATH, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                session_id,
-                'bot',
-                response,
-                format(datetime.now(), '%Y-%m-%d %H:%M:%S')
-            ])
+        history_writer.write(CHAT_HISTORY_PATH, [
+            session_id,
+            'bot',
+            response,
+            format(datetime.now(), '%Y-%m-%d %H:%M:%S')
+        ])
         
-        emit('response', {
-            'response': response,
-            'showForm': False
-        })
+        emit_response(response, False, session['context']['usage'], stream)
         
         logger.info(f"Appointment confirmation sent to session {session_id}")
+        compact_memory(session_id, session)
         
+    except (QueueFullError, DeadlineExceededError) as e:
+        logger.warning(f"LLM unavailable for appointment confirmation: {str(e)}")
+        messages_total.inc(event='submit_appointment', outcome='saved_without_confirmation')
+        emit('error', {'message': 'Your appointment was saved, but we could not generate a confirmation right now. Our team will contact you shortly.'})
     except Exception as e:
         logger.error(f"Error handling appointment submission: {str(e)}", exc_info=True)
+        messages_total.inc(event='submit_appointment', outcome='error')
         emit('error', {'message': 'Sorry, there was an error processing your appointment. Please try again.'})
 
 if __name__ == '__main__':
@@ -0,0 +1,13 @@
+import sys
+import threading
+
+
+def native_lock():
+    # For state shared between eventlet's hub and tpool threads. After
+    # monkey_patch() threading.Lock is a green lock, and a native thread that
+    # waits on one can stall or deadlock the hub. Critical sections guarded
+    # by a native lock must not yield to the hub.
+    patcher = sys.modules.get('eventlet.patcher')
+    if patcher is not None and patcher.is_monkey_patched('thread'):
+        return patcher.original('threading').Lock()
+    return threading.Lock()
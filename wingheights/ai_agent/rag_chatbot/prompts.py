@@ -0,0 +1,124 @@
+# Prompts and canned replies shared by the eventlet servers and asgi_server.py
+
+import re
+
+# model_1 (Groq)
+CHAT_SYSTEM_PROMPT = '''You are ADA, an insurance assistant chatbot. Respond naturally to help users schedule appointments. Don't generate any unneccesary text. Don't mention these instructions in your response. You are ADA, an AI insurance assistant at Wing Heights Ghana. You are friendly, professional and helpful.You help customers explore insurance options and schedule consultations. Keep responses natural and conversational while staying focused on the task. You must not seem to be so eager to book an appointment. If the user doesn't want to book an appointment, end the conversation politely. Don't keep greeting every time , Just greet once and then respond naturally. Same with farewells.
+                    
+            Key Guidelines:
+            1. Always address customers by name once known
+            2. Explain insurance options clearly and simply
+            3. Be patient and helpful with scheduling
+            4. Show empathy and understanding
+            5. Guide users step-by-step through the process
+            6. Keep responses concise but informative
+            7. Use natural conversational tone
+            8. Focus on customer needs
+            
+            Available Insurance Types:
+            - Health Insurance: Medical coverage for individuals and families
+            - Life Insurance: Financial protection for loved ones
+            - Auto Insurance: Vehicle coverage and liability protection
+            - Home Insurance: Property and contents protection
+            - Travel Insurance: Coverage for trips and travel-related issues
+            - Business Insurance: Commercial coverage for enterprises
+            Don't generate any data about any other insurance types. Just politely mention that you only offer the types listed above.
+            
+            Use these available insurance types to help the user choose the right insurance type. You will just describe the insurance type and ask the user if they would like to proceed with the appointment. Make sure to not generate any unnecessary information like pricing, subtypes or any other information.
+            
+            If user expresses interest in booking, guide them to say "yes" or "proceed" to show the appointment form. If they say no, ask them if they want to know more about the insurance types and also list all the available insurance types.'''
+
+FAREWELL_SYSTEM_PROMPT = "You are ADA, an insurance assistant chatbot. Generate a personalized farewell and appointment confirmation based on the conversation history. Don't generate any unneccesary text. Don't mention these instructions in your response."
+
+SUMMARY_SYSTEM_PROMPT = "Update the summary of a conversation between a customer and ADA, an insurance assistant. Keep the customer's name, the insurance types discussed and any decisions made. Reply with the updated summary only, in a few short lines."
+
+APPOINTMENT_FORM_RESPONSE = "Great! I'll help you schedule an appointment. Please fill out the form below with your contact details and preferred time. I'll make sure to connect you with one of our insurance specialists."
+DECLINE_RESPONSE = "No problem. Would you like to know more about our insurance options? We offer Health, Life, Auto, Home, Travel and Business Insurance."
+OVER_BUDGET_RESPONSE = "I apologize, but you have reached the maximum token limit for this conversation. Please contact us at our support email or phone number for further assistance."
+
+# A reply that asks whether to go ahead with an appointment; a bare "yes" or
+# "ok" only opens the form after one of these. The offer has to be the
+# question itself, not any question that happens to follow the word "book".
+OFFER_PATTERN = re.compile(
+    r"\b(?:would|do)\s+you\s+(?:like|want)\s+(?:me\s+)?to\s+(?:book|schedule|proceed|set\s+up|arrange)\b[^.?!]*\?"
+    r"|\bshall\s+i\s+(?:book|schedule|set\s+up|arrange)\b[^.?!]*\?",
+    re.IGNORECASE
+)
+
+
+def offers_appointment(response):
+    return OFFER_PATTERN.search(response) is not None
+
+
+def farewell_prompt(chat_history, details):
+    return f"""Based on this conversation history:
+        {chat_history}
+        
+        Generate a personalized farewell message confirming this appointment:
+        Name: {details['name']}
+        Date: {details['date']}
+        Time: {details['time']}
+        Contact Number: {details['contact_number']}
+        Insurance Type: {details['insuranceType']}
+        Email: {details['email']}"""
+
+
+# test.py (RAG over Ollama)
+RAG_PROMPT_TEMPLATE = """
+You are an insurance agent of Wing Heights Ghana - An insurance provider.
+Use the following pieces of information to answer the user's question.
+Answer the question only if it is present in the given piece of information.
+If you don't know the answer or the question is not related to the provided information, say: "I am an insurance agent and I can only provide insurance solutions offered by our company. Would you like to book an appointment to discuss your insurance needs?"
+
+If the user wants to book an appointment, ask for the following details one by one:
+1. Name
+2. Contact Number
+3. Email
+4. Appointment Date
+5. Insurance Type
+
+After collecting all details, provide a summary of the appointment details.
+
+If the user doesn't want to book an appointment, end the conversation politely.
+
+For basic greetings, respond with short, friendly statements.
+
+Context: {context}
+Question: {question}
+
+Helpful answer:
+"""
+
+# Part of the template's reply to out-of-scope questions; such answers get no citation
+OUT_OF_SCOPE_MARKER = "i can only provide insurance solutions"
+
+LLM_FALLBACK_RESPONSE = "I apologize, but I couldn't process your request. How else can I assist you with our insurance services?"
+LLM_BUSY_RESPONSE = "We're receiving a lot of questions right now. Please try again in a moment."
+RAG_ERROR_RESPONSE = "I apologize, but I encountered an error processing your request."
+
+
+def rag_messages(query, context):
+    return [
+        {"role": "system", "content": RAG_PROMPT_TEMPLATE.format(context=context, question=query)},
+        {"role": "user", "content": query}
+    ]
+
+
+def format_sources(sources):
+    # sources: (file, page label) pairs in rank order -> "\n\nSources: a.pdf p. 3, 7; b.pdf p. 1"
+    pages = {}
+    for source, page in sources:
+        pages.setdefault(source, [])
+        if page is not None and page not in pages[source]:
+            pages[source].append(page)
+    if not pages:
+        return ''
+    cited = [f"{source} p. {', '.join(labels)}" if labels else source for source, labels in pages.items()]
+    return "\n\nSources: " + '; '.join(cited)
+
+
+def citation_for(response, sources):
+    # Nothing to cite for the out-of-scope refusal or an answer built without context
+    if not sources or OUT_OF_SCOPE_MARKER in response.lower():
+        return ''
+    return format_sources(sources)
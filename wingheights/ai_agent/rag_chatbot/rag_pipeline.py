@@ -0,0 +1,119 @@
+import logging
+import os
+
+import numpy as np
+
+from metrics import stage
+from semantic_cache import semantic_cache
+
+logger = logging.getLogger(__name__)
+
+# Loading, ingestion and batched retrieval for the RAG chain, shared by
+# test.py and the RAG mode of asgi_server.py
+DATA_PATH = os.getenv('DATA_PATH', 'data/')
+DB_FAISS_PATH = os.getenv('DB_FAISS_PATH', 'vectorstores/db_faiss')
+DB_CHUNKS_PATH = os.getenv('DB_CHUNKS_PATH', 'vectorstores/db_chunks')
+EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+VECTOR_STORE_FORMAT = os.getenv('VECTOR_STORE_FORMAT', 'compact')
+VECTOR_STORE_PATH = DB_CHUNKS_PATH if VECTOR_STORE_FORMAT == 'compact' else DB_FAISS_PATH
+
+
+# Heavy imports (torch, sentence_transformers, langchain, faiss) stay inside
+# the component factories so the server can accept connections right away
+def load_embeddings():
+    from embedding_backends import create_embeddings
+    from embedding_cache import cached_embeddings
+    return cached_embeddings(create_embeddings(model_name=EMBEDDINGS_MODEL))
+
+
+def create_vector_db(embeddings, workers=1):
+    import ingest
+
+    if not os.path.exists(DATA_PATH) or not os.listdir(DATA_PATH):
+        logger.warning(f"No PDF files found in {DATA_PATH}. Please add your PDF files and restart the application.")
+        return None
+
+    # Only new or changed PDFs are re-embedded; process-pool parsing stays in
+    # the standalone ingest.py run since it does not mix with eventlet
+    db = ingest.create_vector_db(DATA_PATH, DB_FAISS_PATH, embeddings=embeddings, workers=workers,
+                                 chunks_path=DB_CHUNKS_PATH)
+    if db is None:
+        return None
+    semantic_cache.bind(vector_store_version())
+    logger.info(f"Vector store updated and saved to {DB_FAISS_PATH}")
+    return db
+
+
+def vector_store_version():
+    index_path = os.path.join(VECTOR_STORE_PATH, 'index.faiss')
+    if not os.path.exists(index_path):
+        return None
+    stat = os.stat(index_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_vector_db(embeddings):
+    if not os.path.exists(DB_FAISS_PATH):
+        logger.info("Vector store not found. Creating new vector store...")
+        db = create_vector_db(embeddings)
+        if db is None or VECTOR_STORE_FORMAT != 'compact':
+            return db
+    if VECTOR_STORE_FORMAT == 'compact':
+        from chunk_store import ChunkStore, convert, source_matches
+
+        # Memory-mapped index and lazily read chunk text, no pickle at startup
+        if not source_matches(DB_FAISS_PATH, DB_CHUNKS_PATH):
+            logger.info(f"Converting {DB_FAISS_PATH} to compact chunk store at {DB_CHUNKS_PATH}")
+            convert(DB_FAISS_PATH, DB_CHUNKS_PATH)
+        return ChunkStore(DB_CHUNKS_PATH, embeddings)
+    from langchain_community.vectorstores import FAISS
+    return FAISS.load_local(DB_FAISS_PATH, embeddings, allow_dangerous_deserialization=True)
+
+
+def load_sparse_index(store):
+    from sparse_index import index_version, load_or_build
+
+    # Normally written by ingest; rebuilt here if it doesn't match the vector store
+    count = store.index.ntotal
+    return load_or_build(lambda: (store.get_document(row).page_content for row in range(count)),
+                         count, index_version(VECTOR_STORE_PATH))
+
+
+def retrieval_batch_handler(db):
+    from retrievers import RETRIEVAL_MODE, RETRIEVAL_MODES, LangChainStoreAdapter, Retriever, load_reranker
+
+    if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown RETRIEVAL_MODE {RETRIEVAL_MODE!r}, expected one of {RETRIEVAL_MODES}")
+    store = db if hasattr(db, 'get_document') else LangChainStoreAdapter(db)
+    sparse = load_sparse_index(store) if RETRIEVAL_MODE == 'hybrid' else None
+    retriever = Retriever(store, sparse=sparse, reranker=load_reranker() if sparse is not None else None)
+    embeddings = retriever.embeddings
+    embed_queries = getattr(embeddings, 'embed_queries', embeddings.embed_documents)
+
+    def retrieve_batch(items):
+        # items: (query, k, vector) that arrived together, vector being the
+        # message embedding when the intent classifier already computed it;
+        # one embedding pass for the rest and one FAISS search for every
+        # query the answer cache can't serve
+        queries = [query for query, _, _ in items]
+        missing = [i for i, (_, _, vector) in enumerate(items) if vector is None]
+        with stage('embed'):
+            embedded = embed_queries([queries[i] for i in missing]) if missing else []
+            embedded = dict(zip(missing, embedded))
+            vectors = np.asarray([embedded[i] if vector is None else vector
+                                  for i, (_, _, vector) in enumerate(items)], dtype=np.float32)
+        with stage('cache_lookup'):
+            semantic_cache.bind(vector_store_version())
+            results = [(vector, semantic_cache.lookup(vector), None) for vector in vectors]
+        misses = [i for i, (_, cached, _) in enumerate(results) if cached is None]
+        if misses:
+            k = max(items[i][1] or retriever.k for i in misses)
+            with stage('search'):
+                hit_lists = retriever.search_rows(vectors[misses], k, [queries[i] for i in misses])
+                for i, hits in zip(misses, hit_lists):
+                    query_k = items[i][1] or retriever.k
+                    docs = [retriever.store.get_document(row) for row, _ in hits[:query_k]]
+                    results[i] = (vectors[i], None, docs)
+        return results
+
+    return retrieve_batch
@@ -0,0 +1,232 @@
+import logging
+import math
+import os
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')
+FAISS_NLIST = int(os.getenv('FAISS_NLIST', 0))
+FAISS_NPROBE = int(os.getenv('FAISS_NPROBE', 8))
+FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', 32))
+FAISS_EF_CONSTRUCTION = int(os.getenv('FAISS_EF_CONSTRUCTION', 40))
+FAISS_EF_SEARCH = int(os.getenv('FAISS_EF_SEARCH', 64))
+FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', 16))
+FAISS_PQ_NBITS = int(os.getenv('FAISS_PQ_NBITS', 8))
+
+RETRIEVER_K = int(os.getenv('RETRIEVER_K', 2))
+RETRIEVER_SEARCH_TYPE = os.getenv('RETRIEVER_SEARCH_TYPE', 'similarity')
+RETRIEVER_FETCH_K = int(os.getenv('RETRIEVER_FETCH_K', 20))
+RETRIEVER_MMR_LAMBDA = float(os.getenv('RETRIEVER_MMR_LAMBDA', 0.5))
+RETRIEVER_SCORE_THRESHOLD = float(os.getenv('RETRIEVER_SCORE_THRESHOLD', 0.0))
+
+# 'hybrid' fuses FAISS with the BM25 index in sparse_index.py; opt-in, since
+# it ranks by fusion and replaces RETRIEVER_SEARCH_TYPE's mmr/threshold
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'dense')
+# Candidates taken from each of dense and sparse before fusion
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', 20))
+RRF_K = int(os.getenv('RRF_K', 60))
+# e.g. cross-encoder/ms-marco-MiniLM-L-6-v2; empty disables reranking
+RERANKER_MODEL = os.getenv('RERANKER_MODEL', '')
+RERANK_TOP_N = int(os.getenv('RERANK_TOP_N', 10))
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+SEARCH_TYPES = ('similarity', 'mmr', 'similarity_score_threshold')
+RETRIEVAL_MODES = ('dense', 'hybrid')
+
+
+def default_nlist(count):
+    # ~4*sqrt(n) lists, but keep at least 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(count)), count // 39))
+
+
+def build_index(vectors, index_type=FAISS_INDEX_TYPE, nlist=FAISS_NLIST, hnsw_m=FAISS_HNSW_M,
+                ef_construction=FAISS_EF_CONSTRUCTION, pq_m=FAISS_PQ_M, pq_nbits=FAISS_PQ_NBITS):
+    # L2 throughout, matching the flat index LangChain's FAISS store writes
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type in ('ivf', 'ivfpq'):
+        nlist = nlist or default_nlist(count)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == 'ivf':
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % pq_m:
+                raise ValueError(f"FAISS_PQ_M={pq_m} must divide the embedding dimension {dim}")
+            # PQ codebooks need ~39 training points per centroid as well
+            pq_nbits = max(1, min(pq_nbits, int(math.log2(max(count // 39, 2)))))
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Unknown FAISS_INDEX_TYPE {index_type!r}, expected one of {INDEX_TYPES}")
+    index.add(vectors)
+    return index
+
+
+def index_type_of(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    if isinstance(index, faiss.IndexIVFPQ):
+        return 'ivfpq'
+    if isinstance(index, faiss.IndexIVF):
+        return 'ivf'
+    return 'flat'
+
+
+def apply_search_params(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def relevance_score(distance):
+    # Same mapping LangChain uses for L2 distances on unit-length embeddings
+    return 1.0 - distance / math.sqrt(2)
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    # rankings: lists of rows, best first; returns (row, fused score), best first
+    scores = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class CrossEncoderReranker:
+    # Re-scores the fused head of each result list with a small cross-encoder
+    def __init__(self, model_name=RERANKER_MODEL, top_n=RERANK_TOP_N):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device='cpu')
+        self.top_n = top_n
+
+    def rerank(self, queries, hit_lists, text_of):
+        # One predict call for every (query, chunk) pair in the batch
+        pairs = [(query, text_of(row)) for query, hits in zip(queries, hit_lists) for row, _ in hits[:self.top_n]]
+        if not pairs:
+            return hit_lists
+        scores = iter(self.model.predict(pairs, show_progress_bar=False))
+        results = []
+        for hits in hit_lists:
+            head = [(row, float(next(scores))) for row, _ in hits[:self.top_n]]
+            results.append(sorted(head, key=lambda hit: hit[1], reverse=True) + hits[self.top_n:])
+        return results
+
+
+def load_reranker(model_name=RERANKER_MODEL):
+    return CrossEncoderReranker(model_name) if model_name else None
+
+
+class LangChainStoreAdapter:
+    # Lets the retriever run over a LangChain FAISS store (VECTOR_STORE_FORMAT=faiss)
+    def __init__(self, db):
+        self.db = db
+        self.index = db.index
+        self.embeddings = db.embeddings
+
+    def get_document(self, row):
+        return self.db.docstore.search(self.db.index_to_docstore_id[row])
+
+
+class Retriever:
+    def __init__(self, store, k=RETRIEVER_K, search_type=RETRIEVER_SEARCH_TYPE, fetch_k=RETRIEVER_FETCH_K,
+                 lambda_mult=RETRIEVER_MMR_LAMBDA, score_threshold=RETRIEVER_SCORE_THRESHOLD,
+                 nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH, sparse=None, reranker=None,
+                 candidates=HYBRID_CANDIDATES):
+        if search_type not in SEARCH_TYPES:
+            raise ValueError(f"Unknown RETRIEVER_SEARCH_TYPE {search_type!r}, expected one of {SEARCH_TYPES}")
+        if not hasattr(store, 'get_document'):
+            store = LangChainStoreAdapter(store)
+        self.store = store
+        self.index = apply_search_params(store.index, nprobe, ef_search)
+        self.k = k
+        self.search_type = search_type
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.score_threshold = score_threshold
+        self.sparse = sparse
+        self.reranker = reranker
+        self.candidates = candidates
+        if sparse is not None and search_type != 'similarity':
+            raise ValueError(f"Hybrid retrieval ranks by fusion and can't apply RETRIEVER_SEARCH_TYPE={search_type}; "
+                             f"use RETRIEVAL_MODE=dense or RETRIEVER_SEARCH_TYPE=similarity")
+        if search_type == 'mmr' and isinstance(self.index, faiss.IndexIVF):
+            # MMR re-scores candidates on their vectors, IVF needs a direct map for that
+            self.index.make_direct_map()
+        logger.info(f"Retriever ready: {index_type_of(self.index)} index, {self.index.ntotal} vectors, "
+                    f"search_type={search_type}, k={k}, hybrid={sparse is not None}, reranker={reranker is not None}")
+
+    @property
+    def embeddings(self):
+        return self.store.embeddings
+
+    def _candidates(self, vectors, k):
+        fetch = max(k, self.fetch_k) if self.search_type == 'mmr' else k
+        return self.index.search(vectors, fetch)
+
+    def search_rows(self, vectors, k=None, queries=None):
+        # Returns, per query, a list of (row, distance) after filtering/MMR, or
+        # (row, fused score) when a sparse index is attached and the query
+        # texts are given
+        k = k or self.k
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if self.sparse is not None and queries is not None:
+            return self._hybrid(vectors, queries, k)
+        distances, rows = self._candidates(vectors, k)
+        results = []
+        for query, query_rows, query_distances in zip(vectors, rows, distances):
+            hits = [(int(row), float(distance)) for row, distance in zip(query_rows, query_distances) if row != -1]
+            if self.search_type == 'similarity_score_threshold':
+                hits = [hit for hit in hits if relevance_score(hit[1]) >= self.score_threshold]
+            elif self.search_type == 'mmr':
+                hits = self._mmr(query, hits, k)
+            results.append(hits[:k])
+        return results
+
+    def _hybrid(self, vectors, queries, k):
+        fetch = max(k, self.candidates)
+        _, rows = self.index.search(vectors, fetch)
+        results = []
+        for query, dense_rows in zip(queries, rows):
+            sparse_rows = [row for row, _ in self.sparse.search(query, fetch)]
+            results.append(reciprocal_rank_fusion([[int(row) for row in dense_rows if row != -1], sparse_rows]))
+        if self.reranker is not None:
+            results = self.reranker.rerank(queries, results, lambda row: self.store.get_document(row).page_content)
+        return [hits[:k] for hits in results]
+
+    def _mmr(self, query, hits, k):
+        if not hits:
+            return hits
+        candidates = np.stack([self.index.reconstruct(row) for row, _ in hits])
+        query = query / (np.linalg.norm(query) or 1.0)
+        candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+        query_similarity = candidates @ query
+        selected = [int(np.argmax(query_similarity))]
+        while len(selected) < min(k, len(hits)):
+            redundancy = (candidates @ candidates[selected].T).max(axis=1)
+            scores = self.lambda_mult * query_similarity - (1 - self.lambda_mult) * redundancy
+            scores[selected] = -np.inf
+            selected.append(int(np.argmax(scores)))
+        return [hits[i] for i in selected]
+
+    def search(self, vector, k=None, query=None):
+        queries = None if query is None else [query]
+        return [self.store.get_document(row) for row, _ in self.search_rows(vector, k, queries)[0]]
+
+    def search_with_scores(self, vector, k=None, query=None):
+        queries = None if query is None else [query]
+        return [(self.store.get_document(row), score) for row, score in self.search_rows(vector, k, queries)[0]]
@@ -0,0 +1,145 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from metrics import Counter, Gauge
+from native_threading import native_lock
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 1024))
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', 3600))
+SEMANTIC_CACHE_MAX_BYTES = int(os.getenv('SEMANTIC_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+
+class SemanticCache:
+    # Answers keyed by normalized query embeddings. Vectors live in one
+    # preallocated matrix so a lookup is a single matrix-vector product.
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl=SEMANTIC_CACHE_TTL, max_bytes=SEMANTIC_CACHE_MAX_BYTES, enabled=SEMANTIC_CACHE_ENABLED):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Taken on the hub and in tpool threads (retrieval batches)
+        self._lock = native_lock()
+        self._reset()
+
+    def _reset(self, dim=None):
+        self._vectors = None if dim is None else np.zeros((self.max_entries, dim), dtype=np.float32)
+        self._active = np.zeros(self.max_entries, dtype=bool)
+        self._expires = np.zeros(self.max_entries, dtype=np.float64)
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        # slot -> (answer, sources, nbytes), oldest first; sources are the
+        # (file, page) pairs the answer came from, cited again on every hit
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _best_match(self, vector):
+        if self._vectors is None or not self._entries or vector.shape[0] != self._vectors.shape[1]:
+            return None, -1.0
+        scores = self._vectors @ vector
+        scores[~self._active] = -1.0
+        slot = int(np.argmax(scores))
+        return slot, float(scores[slot])
+
+    def _evict_expired(self, now):
+        # Expired rows must not win the argmax over a live match below them
+        for slot in np.flatnonzero(self._active & (self._expires < now)):
+            self._evict(int(slot))
+
+    def _evict(self, slot):
+        _, _, nbytes = self._entries.pop(slot)
+        self._active[slot] = False
+        self._free.append(slot)
+        self._bytes -= nbytes
+        self.evictions += 1
+
+    def lookup(self, vector):
+        # (answer, sources) or None
+        if not self.enabled:
+            return None
+        vector = self._normalize(vector)
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            slot, score = self._best_match(vector)
+            if slot is None or score < self.threshold:
+                self.misses += 1
+                return None
+            answer, sources, _ = self._entries[slot]
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return answer, sources
+
+    def store(self, vector, answer, sources=()):
+        if not self.enabled or not answer:
+            return
+        vector = self._normalize(vector)
+        sources = tuple(sources)
+        nbytes = len(answer.encode('utf-8')) + vector.nbytes + len(repr(sources))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if self._vectors is None or vector.shape[0] != self._vectors.shape[1]:
+                self._reset(vector.shape[0])
+            now = time.monotonic()
+            self._evict_expired(now)
+            slot, score = self._best_match(vector)
+            if slot is not None and score >= self.threshold:
+                self._evict(slot)
+                self.evictions -= 1
+            while self._entries and (not self._free or self._bytes + nbytes > self.max_bytes):
+                self._evict(next(iter(self._entries)))
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._active[slot] = True
+            self._expires[slot] = now + self.ttl
+            self._entries[slot] = (answer, sources, nbytes)
+            self._bytes += nbytes
+
+    def bind(self, version):
+        # Cached answers are only valid for the vector store they came from
+        if version != self.version:
+            if self.version is not None:
+                logger.info("Vector store changed, flushing semantic cache")
+            self.clear()
+            self.version = version
+
+    def clear(self):
+        with self._lock:
+            dim = None if self._vectors is None else self._vectors.shape[1]
+            self._reset(dim)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+semantic_cache = SemanticCache()
+Counter('semantic_cache_hits_total', "Answers served from the semantic cache", fn=lambda: semantic_cache.hits)
+Counter('semantic_cache_misses_total', "Lookups the semantic cache could not answer", fn=lambda: semantic_cache.misses)
+Gauge('semantic_cache_entries', "Cached answers", fn=lambda: len(semantic_cache._entries))
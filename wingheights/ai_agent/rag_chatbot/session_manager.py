@@ -0,0 +1,224 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter, Gauge
+from session_store import SESSION_BACKEND, dumps, loads, serialized_size, session_store
+from storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Sessions untouched this long are evicted; kept under SESSION_TTL so the
+# manager, not the store's expiry, decides when a session ends
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', 1800))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 30))
+# Caps on sessions held in this worker's memory; 0 disables a cap
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', 10000))
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', 256 * 1024 * 1024))
+# Archive evicted sessions in the storage database so a client that comes
+# back after an eviction carries on where it left off
+SESSION_SPILL = os.getenv('SESSION_SPILL', 'true').lower() == 'true'
+# Archived sessions (with contact details and transcript) older than this are deleted
+SESSION_ARCHIVE_TTL = float(os.getenv('SESSION_ARCHIVE_TTL', SESSION_IDLE_TIMEOUT))
+
+session_evictions = Counter('session_evictions_total', "Sessions removed by the session manager",
+                            labelnames=('reason',))
+
+
+class SessionManager:
+    # Front for the session store that tracks the sessions this worker has
+    # touched in least-recently-active order. The idle timeout is the same
+    # for every session, so that order is also expiry order: a sweep stops at
+    # the first session still within the timeout, and a touch is O(1).
+    #
+    # With the memory backend the sessions live in this process, so idle and
+    # over-cap sessions are spilled and removed from the store. With a shared
+    # backend (sqlite, redis) another worker may still be serving a session;
+    # only the local tracking is dropped and the store's TTL ends it.
+    def __init__(self, store=session_store, local=SESSION_BACKEND == 'memory', idle_timeout=SESSION_IDLE_TIMEOUT,
+                 sweep_interval=SESSION_SWEEP_INTERVAL, max_sessions=SESSION_MAX_COUNT,
+                 max_bytes=SESSION_MAX_BYTES, spill=SESSION_SPILL, archive=storage, archive_ttl=SESSION_ARCHIVE_TTL):
+        self.store = store
+        self.local = local
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.spill = spill and local
+        self.archive = archive
+        self.archive_ttl = archive_ttl
+        # Sessions this worker spilled and nobody has restored or ended since
+        self._archived = set()
+        # session_id -> [last_active, serialized bytes]
+        self._active = OrderedDict()
+        self.bytes = 0
+        self.peak_sessions = 0
+        self.evictions = {}
+        self.spilled = 0
+        self.restored = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        Gauge('sessions_active', "Sessions active in this worker", fn=lambda: len(self._active))
+        Gauge('session_bytes', "Approximate bytes held by this worker's sessions", fn=lambda: self.bytes)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='session-sweeper', daemon=True)
+                self._thread.start()
+
+    def get(self, session_id):
+        self.start()
+        session = self.store.get(session_id)
+        if session is None and self.spill:
+            session = self._restore(session_id)
+        if session is not None:
+            self._touch(session_id)
+        return session
+
+    def put(self, session_id, session):
+        self.start()
+        self.store.put(session_id, session)
+        self._touch(session_id, serialized_size(session))
+        if self.local:
+            self._enforce_caps()
+
+    def delete(self, session_id):
+        # The client is gone and a new connection always starts a new
+        # session, so there is nothing worth spilling, and an archived copy
+        # from an earlier eviction goes too
+        self.store.delete(session_id)
+        with self._lock:
+            self._forget(session_id)
+            archived = session_id in self._archived
+            self._archived.discard(session_id)
+        if archived:
+            try:
+                self.archive.delete_archived_session(session_id)
+            except Exception as e:
+                logger.error(f"Could not delete archived session {session_id}: {str(e)}")
+        self._count('disconnect')
+
+    def _touch(self, session_id, size=None):
+        with self._lock:
+            entry = self._active.pop(session_id, None)
+            if entry is None:
+                entry = [0.0, 0]
+            entry[0] = time.time()
+            if size is not None:
+                self.bytes += size - entry[1]
+                entry[1] = size
+            self._active[session_id] = entry
+            self.peak_sessions = max(self.peak_sessions, len(self._active))
+
+    def _forget(self, session_id):
+        # Caller holds the lock
+        entry = self._active.pop(session_id, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        return entry
+
+    def _count(self, reason, amount=1):
+        self.evictions[reason] = self.evictions.get(reason, 0) + amount
+        session_evictions.inc(amount, reason=reason)
+
+    def _evict(self, session_ids, reason):
+        for session_id in session_ids:
+            if self.local:
+                session = self.store.get(session_id) if self.spill else None
+                if session is not None:
+                    try:
+                        self.archive.archive_session(session_id, dumps(session), reason)
+                        self.spilled += 1
+                        with self._lock:
+                            self._archived.add(session_id)
+                    except Exception as e:
+                        logger.error(f"Could not spill session {session_id}: {str(e)}")
+                with self._lock:
+                    # A message may have touched the session while it was spilled
+                    if session_id in self._active:
+                        continue
+                    self.store.delete(session_id)
+            self._count(reason)
+        if session_ids:
+            logger.info(f"Evicted {len(session_ids)} sessions ({reason})")
+
+    def _restore(self, session_id):
+        with self._lock:
+            self._archived.discard(session_id)
+        try:
+            record = self.archive.restore_session(session_id)
+        except Exception as e:
+            logger.error(f"Could not restore session {session_id}: {str(e)}")
+            return None
+        if record is None:
+            return None
+        session = loads(record)
+        self.store.put(session_id, session)
+        self._touch(session_id, serialized_size(session))
+        self.restored += 1
+        logger.info(f"Restored archived session {session_id}")
+        self._enforce_caps()
+        return session
+
+    def _enforce_caps(self):
+        evicted = []
+        with self._lock:
+            while len(self._active) > 1 and (
+                (self.max_sessions and len(self._active) > self.max_sessions)
+                or (self.max_bytes and self.bytes > self.max_bytes)
+            ):
+                session_id = next(iter(self._active))
+                self._forget(session_id)
+                evicted.append(session_id)
+        self._evict(evicted, 'capacity')
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        evicted = []
+        with self._lock:
+            while self._active:
+                session_id, (last_active, _) = next(iter(self._active.items()))
+                if now - last_active < self.idle_timeout:
+                    break
+                self._forget(session_id)
+                evicted.append(session_id)
+        self._evict(evicted, 'idle')
+        self.store.purge_expired()
+        if self.spill:
+            # Also covers rows left by earlier runs of this worker
+            purged = self.archive.purge_session_archive(self.archive_ttl)
+            if purged:
+                logger.info(f"Deleted {purged} archived sessions older than {self.archive_ttl:.0f}s")
+        return len(evicted)
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Session sweep failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            oldest = next(iter(self._active.values()), None)
+            return {
+                'sessions': len(self._active),
+                'peak_sessions': self.peak_sessions,
+                'bytes': self.bytes,
+                'avg_bytes': self.bytes / len(self._active) if self._active else 0,
+                'max_sessions': self.max_sessions,
+                'max_bytes': self.max_bytes,
+                'idle_timeout': self.idle_timeout,
+                'oldest_idle_seconds': time.time() - oldest[0] if oldest else 0.0,
+                'local': self.local,
+                'evictions': dict(self.evictions),
+                'spilled': self.spilled,
+                'restored': self.restored,
+            }
+
+
+session_manager = SessionManager()
@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+SESSION_TTL = float(os.getenv('SESSION_TTL', 3600))
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.db')
+SESSION_REDIS_URL = os.getenv('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+SESSION_KEY_PREFIX = os.getenv('SESSION_KEY_PREFIX', 'wingheights:session:')
+# e.g. redis://localhost:6379/1 so several workers can emit to each other's sockets
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+
+COMPRESS_THRESHOLD = 1024
+
+# name -> (cls, to_json, from_json) for values that aren't plain JSON
+_types = {}
+
+
+def register_type(name, cls, to_json, from_json):
+    _types[name] = (cls, to_json, from_json)
+
+
+def _default(value):
+    for name, (cls, to_json, _) in _types.items():
+        if isinstance(value, cls):
+            return {'__t': name, 'v': to_json(value)}
+    raise TypeError(f"Cannot serialize {type(value).__name__} in a session")
+
+
+def _object_hook(value):
+    if '__t' in value and value['__t'] in _types:
+        return _types[value['__t']][2](value['v'])
+    return value
+
+
+def dumps(session):
+    # Compact JSON, zlib-compressed once transcripts get long
+    data = json.dumps(session, separators=(',', ':'), default=_default).encode('utf-8')
+    if len(data) > COMPRESS_THRESHOLD:
+        return b'z' + zlib.compress(data)
+    return b'j' + data
+
+
+def serialized_size(session):
+    # Uncompressed JSON bytes, a rough stand-in for the memory a session holds
+    return len(json.dumps(session, separators=(',', ':'), default=_default))
+
+
+def loads(record):
+    if record is None:
+        return None
+    record = bytes(record)
+    data = zlib.decompress(record[1:]) if record[:1] == b'z' else record[1:]
+    return json.loads(data, object_hook=_object_hook)
+
+
+class MemorySessionStore:
+    # In-process dict; sessions are kept as live objects. Only single dict
+    # operations are used so the session manager's sweeper thread can run
+    # alongside request handlers.
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._expires = {}
+
+    def get(self, session_id):
+        expires = self._expires.get(session_id)
+        if expires is None:
+            return None
+        if expires < time.time():
+            self.delete(session_id)
+            return None
+        return self._sessions.get(session_id)
+
+    def put(self, session_id, session):
+        self._sessions[session_id] = session
+        self._expires[session_id] = time.time() + self.ttl
+
+    def delete(self, session_id):
+        self._sessions.pop(session_id, None)
+        self._expires.pop(session_id, None)
+
+    def purge_expired(self):
+        now = time.time()
+        expired = [session_id for session_id, expires in list(self._expires.items()) if expires < now]
+        for session_id in expired:
+            self.delete(session_id)
+        return len(expired)
+
+    def count(self):
+        self.purge_expired()
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    # Shared between worker processes on one host through a WAL-mode database
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)')
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM sessions WHERE id = ? AND expires_at >= ?', (session_id, time.time())
+            ).fetchone()
+        return loads(row[0]) if row else None
+
+    def put(self, session_id, session):
+        record = dumps(session)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)',
+                (session_id, record, time.time() + self.ttl)
+            )
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def purge_expired(self):
+        with self._lock:
+            return self._conn.execute('DELETE FROM sessions WHERE expires_at < ?', (time.time(),)).rowcount
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM sessions WHERE expires_at >= ?', (time.time(),)).fetchone()[0]
+
+
+class RedisSessionStore:
+    # Any server speaking the Redis protocol works (Redis, Valkey, KeyDB, ...)
+    def __init__(self, url=SESSION_REDIS_URL, ttl=SESSION_TTL, prefix=SESSION_KEY_PREFIX):
+        import redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        # Sorted set of session id -> expiry, kept outside the session keyspace, so count() is a
+        # ZCARD instead of a SCAN
+        self._index = prefix.rstrip(':') + '-index'
+
+    def get(self, session_id):
+        return loads(self._client.get(self.prefix + session_id))
+
+    def put(self, session_id, session):
+        ttl = max(1, int(self.ttl))
+        pipe = self._client.pipeline(transaction=False)
+        pipe.set(self.prefix + session_id, dumps(session), ex=ttl)
+        pipe.zadd(self._index, {session_id: time.time() + ttl})
+        pipe.execute()
+
+    def delete(self, session_id):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.delete(self.prefix + session_id)
+        pipe.zrem(self._index, session_id)
+        pipe.execute()
+
+    def purge_expired(self):
+        # Redis expires the session keys itself; only the index needs trimming
+        return self._client.zremrangebyscore(self._index, '-inf', time.time())
+
+    def count(self):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zremrangebyscore(self._index, '-inf', time.time())
+        pipe.zcard(self._index)
+        return pipe.execute()[1]
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    if backend == 'redis':
+        return RedisSessionStore()
+    raise ValueError(f"Unknown SESSION_BACKEND {backend!r}, expected memory, sqlite or redis")
+
+
+session_store = create_session_store()
+Gauge('sessions', "Sessions within their TTL", fn=session_store.count)
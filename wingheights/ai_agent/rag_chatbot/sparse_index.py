@@ -0,0 +1,190 @@
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SPARSE_INDEX_PATH = os.getenv('SPARSE_INDEX_PATH', 'vectorstores/db_sparse')
+BM25_K1 = float(os.getenv('BM25_K1', 1.2))
+BM25_B = float(os.getenv('BM25_B', 0.75))
+SPARSE_INDEX_FORMAT = 1
+
+# On-disk layout, row i is row i of the FAISS index it was built next to:
+#   terms.json    - vocabulary, term id = position
+#   offsets.npy   - int64 offsets into rows/weights per term, terms + 1 entries
+#   rows.npy      - int32 chunk rows of each posting, sorted by term
+#   weights.npy   - float32 BM25 weight of each posting (idf and length norm included)
+#   store.json    - format, count, BM25 parameters and the vector store version
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between both but by
+can could did do does doing down during each few for from further had has have having he her here hers him his how
+i if in into is it its itself just me more most my no nor not of off on once only or other our ours out over own
+same she should so some such than that the their theirs them then there these they this those through to too under
+until up very was we were what when where which while who whom why will with would you your yours
+""".split())
+
+
+def stem(token):
+    # Plural folding only: "insurances" and "insurance" should share postings
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def index_version(path):
+    # Identifies the FAISS index a sparse index was built for
+    index_path = os.path.join(path, 'index.faiss')
+    if not os.path.exists(index_path):
+        return None
+    stat = os.stat(index_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class SparseIndex:
+    # BM25 over chunk texts as a term-sorted CSR posting list. Weights are
+    # final at build time, so a query is a handful of vectorised adds.
+    def __init__(self, terms, offsets, rows, weights, count, info=None):
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.weights = weights
+        self.count = count
+        self.info = info or {}
+
+    @classmethod
+    def build(cls, texts, k1=BM25_K1, b=BM25_B):
+        vocabulary = {}
+        postings = []
+        lengths = []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.append((vocabulary.setdefault(token, len(vocabulary)), row, tf))
+        count = len(lengths)
+        terms = [None] * len(vocabulary)
+        for term, term_id in vocabulary.items():
+            terms[term_id] = term
+        if not postings:
+            return cls(terms, np.zeros(len(terms) + 1, dtype=np.int64), np.zeros(0, dtype=np.int32),
+                       np.zeros(0, dtype=np.float32), count, {'k1': k1, 'b': b})
+
+        term_ids, rows, tfs = (np.asarray(column) for column in zip(*postings))
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, rows, tfs = term_ids[order], rows[order].astype(np.int32), tfs[order].astype(np.float32)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=offsets[1:])
+
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avgdl = float(lengths.mean()) or 1.0
+        document_frequency = np.diff(offsets).astype(np.float32)
+        idf = np.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+        norm = k1 * (1 - b + b * lengths[rows] / avgdl)
+        weights = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+        return cls(terms, offsets, rows, weights, count, {'k1': k1, 'b': b, 'avgdl': avgdl})
+
+    @classmethod
+    def load(cls, path=SPARSE_INDEX_PATH):
+        with open(os.path.join(path, 'store.json'), encoding='utf-8') as f:
+            info = json.load(f)
+        if info['format'] != SPARSE_INDEX_FORMAT:
+            raise ValueError(f"Unsupported sparse index format {info['format']} in {path}")
+        with open(os.path.join(path, 'terms.json'), encoding='utf-8') as f:
+            terms = json.load(f)
+        arrays = [np.load(os.path.join(path, name), mmap_mode='r') for name in ('offsets.npy', 'rows.npy', 'weights.npy')]
+        return cls(terms, *arrays, info['count'], info)
+
+    def save(self, path=SPARSE_INDEX_PATH, version=None):
+        tmp_path = path.rstrip('/') + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(tmp_path, 'terms.json'), 'w', encoding='utf-8') as f:
+            json.dump(terms, f, separators=(',', ':'))
+        np.save(os.path.join(tmp_path, 'offsets.npy'), np.asarray(self.offsets, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'rows.npy'), np.asarray(self.rows, dtype=np.int32))
+        np.save(os.path.join(tmp_path, 'weights.npy'), np.asarray(self.weights, dtype=np.float32))
+        self.info.update({'format': SPARSE_INDEX_FORMAT, 'count': self.count, 'terms': len(terms),
+                          'postings': int(len(self.rows)), 'vector_store': version})
+        with open(os.path.join(tmp_path, 'store.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.info, f)
+
+        old_path = path.rstrip('/') + '.old'
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        logger.info(f"Wrote sparse index with {len(terms)} terms over {self.count} chunks to {path}")
+
+    def scores(self, query):
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term_id in {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # A row appears once per term, so plain fancy-index addition is safe
+            scores[self.rows[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query, k):
+        # (row, score) pairs, best first; rows sharing no term with the query are left out
+        scores = self.scores(query)
+        k = min(k, self.count)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(row), float(scores[row])) for row in top if scores[row] > 0]
+
+    def search_batch(self, queries, k):
+        return [self.search(query, k) for query in queries]
+
+
+def sparse_index_matches(path, count, version):
+    info_path = os.path.join(path, 'store.json')
+    if not os.path.exists(info_path):
+        return False
+    with open(info_path, encoding='utf-8') as f:
+        info = json.load(f)
+    return (info.get('format') == SPARSE_INDEX_FORMAT and info.get('count') == count
+            and info.get('vector_store') == version)
+
+
+def load_or_build(texts, count, version, path=SPARSE_INDEX_PATH):
+    # texts: callable returning chunk texts in index row order, only read on a rebuild
+    if not sparse_index_matches(path, count, version):
+        logger.info(f"Sparse index at {path} is missing or stale, rebuilding over {count} chunks")
+        SparseIndex.build(texts()).save(path, version)
+    return SparseIndex.load(path)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build the BM25 index over a compact chunk store")
+    parser.add_argument('--source', default=os.getenv('DB_CHUNKS_PATH', 'vectorstores/db_chunks'))
+    parser.add_argument('--dest', default=SPARSE_INDEX_PATH)
+    parser.add_argument('--query', help="print the top chunks for a query instead of building")
+    args = parser.parse_args()
+    if args.query:
+        for row, score in SparseIndex.load(args.dest).search(args.query, 5):
+            print(f"{row:6d} {score:8.3f}")
+    else:
+        from chunk_store import ChunkStore
+
+        store = ChunkStore(args.source)
+        SparseIndex.build(store.chunks.get(i) for i in range(len(store))).save(args.dest, index_version(args.source))
@@ -0,0 +1,326 @@
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STORAGE_DB_PATH = os.getenv('STORAGE_DB_PATH', 'chatbot.db')
+# The servers wrote their CSVs in the platform's default encoding, which is
+# cp1252 on Windows; rows that aren't valid UTF-8 are read with this instead
+CSV_FALLBACK_ENCODING = os.getenv('CSV_FALLBACK_ENCODING', 'cp1252')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS appointments (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    contact_number TEXT,
+    email TEXT,
+    date TEXT,
+    time TEXT,
+    insurance_type TEXT,
+    source TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS appointments_date ON appointments (date);
+CREATE INDEX IF NOT EXISTS appointments_email ON appointments (email);
+
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    contact_number TEXT,
+    email TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+
+CREATE TABLE IF NOT EXISTS chat_history (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT,
+    role TEXT,
+    content TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS chat_history_session ON chat_history (session_id, id);
+
+CREATE TABLE IF NOT EXISTS interactions (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT,
+    name TEXT,
+    event TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS interactions_session ON interactions (session_id);
+
+CREATE TABLE IF NOT EXISTS session_archive (
+    session_id TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    reason TEXT,
+    archived_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY,
+    rows INTEGER,
+    skipped INTEGER,
+    imported_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+# CSV file the servers used to append to -> (table, columns of each row)
+TARGETS = {
+    'appointments.csv': ('appointments', ('name', 'contact_number', 'email', 'date', 'time', 'insurance_type')),
+    'appointment_details.csv': ('appointments', ('name', 'contact_number', 'email', 'date', 'insurance_type')),
+    'user_data.csv': ('users', ('name', 'contact_number', 'email')),
+    'chat_history.csv': ('chat_history', ('session_id', 'role', 'content', 'created_at')),
+    'chatbot_data.csv': ('interactions', ('session_id', 'name', 'event')),
+}
+
+
+def target_for(path):
+    try:
+        return TARGETS[os.path.basename(path)]
+    except KeyError:
+        raise ValueError(f"No table for {path}, expected one of {', '.join(TARGETS)}")
+
+
+def insert_statement(table, columns):
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+def rows_as_dicts(cursor):
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def decode_lines(f, encodings, undecodable):
+    # f is a binary file; line numbers that no encoding can decode are
+    # appended to undecodable and the lines dropped
+    for number, line in enumerate(f, 1):
+        for encoding in encodings:
+            try:
+                yield line.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            undecodable.append(number)
+
+
+class Storage:
+    # One write connection (the history writer thread) and one read
+    # connection (request handlers); WAL lets reads run alongside writes.
+    def __init__(self, path=STORAGE_DB_PATH):
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = None
+        self._reader = None
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def writer(self):
+        # Caller holds _write_lock
+        if self._writer is None:
+            self._writer = self._connect()
+            self._writer.executescript(SCHEMA)
+        return self._writer
+
+    def reader(self):
+        # Caller holds _read_lock; the schema comes from the writer, which is
+        # opened under the same lock as every other writer() call
+        if self._reader is None:
+            with self._write_lock:
+                self.writer()
+            self._reader = self._connect()
+        return self._reader
+
+    def insert_rows(self, table, columns, rows):
+        # One transaction per batch; executemany reuses the prepared statement
+        statement = insert_statement(table, columns)
+        with self._write_lock:
+            conn = self.writer()
+            with conn:
+                conn.executemany(statement, rows)
+
+    def write_rows(self, path, rows):
+        table, columns = target_for(path)
+        if table == 'appointments':
+            # Tag rows with where they came from: the model_1 form or the test.py chat flow
+            columns = columns + ('source',)
+            source = 'chat' if os.path.basename(path) == 'appointment_details.csv' else 'form'
+            rows = [list(row) + [source] for row in rows]
+        self.insert_rows(table, columns, rows)
+
+    def query(self, sql, params=()):
+        with self._read_lock:
+            return rows_as_dicts(self.reader().execute(sql, params))
+
+    def appointments_on(self, date):
+        return self.query(
+            'SELECT id, name, contact_number, email, date, time, insurance_type, source, created_at '
+            'FROM appointments WHERE date = ? ORDER BY time, id', (date,)
+        )
+
+    def appointments_for_email(self, email):
+        return self.query(
+            'SELECT id, name, contact_number, email, date, time, insurance_type, source, created_at '
+            'FROM appointments WHERE email = ? ORDER BY date, time, id', (email,)
+        )
+
+    def transcript(self, session_id):
+        return self.query(
+            'SELECT role, content, created_at FROM chat_history WHERE session_id = ? ORDER BY id', (session_id,)
+        )
+
+    def archive_session(self, session_id, record, reason):
+        # record is a session_store.dumps() blob
+        with self._write_lock:
+            with self.writer() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO session_archive (session_id, data, reason) VALUES (?, ?, ?)',
+                    (session_id, record, reason)
+                )
+
+    def restore_session(self, session_id):
+        # Removes and returns the archived record, or None
+        with self._write_lock:
+            with self.writer() as conn:
+                row = conn.execute('SELECT data FROM session_archive WHERE session_id = ?', (session_id,)).fetchone()
+                if row is None:
+                    return None
+                conn.execute('DELETE FROM session_archive WHERE session_id = ?', (session_id,))
+        return row[0]
+
+    def delete_archived_session(self, session_id):
+        with self._write_lock:
+            with self.writer() as conn:
+                conn.execute('DELETE FROM session_archive WHERE session_id = ?', (session_id,))
+
+    def purge_session_archive(self, max_age):
+        # archived_at is UTC text from CURRENT_TIMESTAMP
+        with self._write_lock:
+            with self.writer() as conn:
+                return conn.execute(
+                    "DELETE FROM session_archive WHERE archived_at < datetime('now', ?)", (f'-{int(max_age)} seconds',)
+                ).rowcount
+
+    def user(self, email):
+        users = self.query(
+            'SELECT name, contact_number, email, created_at FROM users WHERE email = ? ORDER BY id DESC LIMIT 1', (email,)
+        )
+        return users[0] if users else None
+
+    def import_csv(self, path, force=False, batch_size=1000, encoding='utf-8', fallback_encoding=CSV_FALLBACK_ENCODING):
+        # One-shot import of a CSV the servers used to append to; files
+        # already imported are skipped unless force is set. Each line is
+        # decoded on its own, so a file with a few cp1252 rows still imports
+        # and lines neither encoding can read are skipped and reported.
+        table, columns = target_for(path)
+        key = os.path.abspath(path)
+        if not force and self.query('SELECT 1 FROM imported_files WHERE path = ?', (key,)):
+            logger.info(f"{path} already imported, skipping")
+            return 0, 0
+        imported = 0
+        skipped = 0
+        batch = []
+        undecodable = []
+        encodings = [encoding] + ([fallback_encoding] if fallback_encoding and fallback_encoding != encoding else [])
+        with open(path, 'rb') as f:
+            for row in csv.reader(decode_lines(f, encodings, undecodable)):
+                # chatbot_data.csv also holds the old question/answer dataset,
+                # which doesn't fit the interactions table
+                if len(row) != len(columns):
+                    skipped += 1
+                    continue
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self.write_rows(path, batch)
+                    imported += len(batch)
+                    batch = []
+        if batch:
+            self.write_rows(path, batch)
+            imported += len(batch)
+        if undecodable:
+            skipped += len(undecodable)
+            shown = ', '.join(str(number) for number in undecodable[:20])
+            logger.warning(f"{path}: skipped {len(undecodable)} lines not readable as {' or '.join(encodings)} "
+                           f"(lines {shown}{', ...' if len(undecodable) > 20 else ''})")
+        with self._write_lock:
+            with self.writer() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO imported_files (path, rows, skipped) VALUES (?, ?, ?)',
+                    (key, imported, skipped)
+                )
+        logger.info(f"Imported {imported} rows from {path} into {table} ({skipped} skipped)")
+        return imported, skipped
+
+    def close(self):
+        for conn in (self._reader, self._writer):
+            if conn is not None:
+                conn.close()
+        self._reader = None
+        self._writer = None
+
+
+storage = Storage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat history and appointment storage")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importer = subparsers.add_parser('import', help="import the CSV files the servers used to write")
+    importer.add_argument('paths', nargs='*', help="CSV files to import (default: every known CSV in --dir)")
+    importer.add_argument('--dir', default='.', help="directory holding the CSV files")
+    importer.add_argument('--force', action='store_true', help="import files again even if already imported")
+    importer.add_argument('--encoding', default='utf-8', help="encoding of the CSV files (default: utf-8)")
+    importer.add_argument('--fallback-encoding', default=CSV_FALLBACK_ENCODING,
+                          help=f"encoding for lines that fail to decode (default: {CSV_FALLBACK_ENCODING})")
+
+    appointments = subparsers.add_parser('appointments', help="list appointments for a date or email")
+    appointments.add_argument('--date')
+    appointments.add_argument('--email')
+
+    transcript = subparsers.add_parser('transcript', help="print a session's chat history")
+    transcript.add_argument('session_id')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'import':
+        paths = args.paths or [os.path.join(args.dir, name) for name in TARGETS]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            start = time.perf_counter()
+            imported, skipped = storage.import_csv(
+                path, force=args.force, encoding=args.encoding, fallback_encoding=args.fallback_encoding
+            )
+            print(f"{path}: {imported} rows imported, {skipped} skipped in {time.perf_counter() - start:.2f}s")
+    elif args.command == 'appointments':
+        if args.date:
+            rows = storage.appointments_on(args.date)
+        elif args.email:
+            rows = storage.appointments_for_email(args.email)
+        else:
+            parser.error("appointments needs --date or --email")
+        for row in rows:
+            print(row)
+    elif args.command == 'transcript':
+        for row in storage.transcript(args.session_id):
+            print(f"[{row['created_at']}] {row['role']}: {row['content']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,35 @@
 import eventlet
 eventlet.monkey_patch()
-from flask import Flask, request
+from flask import Flask, request, jsonify
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import os
-import csv
-import ollama
 import logging
 from datetime import datetime
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.document_loaders import PyPDFLoader, DirectoryLoader
+from eventlet import patcher, tpool
 from dotenv import load_dotenv
+from history_writer import history_writer
+from semantic_cache import semantic_cache
+from components import ComponentRegistry
+from batcher import MicroBatcher
+from llm_dispatch import llm_dispatcher, job_abandoned, PRIORITY_CHAT, QueueFullError
+from session_store import SOCKETIO_MESSAGE_QUEUE
+from session_manager import session_manager
+from intent_router import intent_router, CentroidClassifier
+from appointment_flow import booking_turn, in_booking_flow, new_session, offer_booking, requires_input
+from context_builder import context_builder
+from prompts import LLM_BUSY_RESPONSE, LLM_FALLBACK_RESPONSE, RAG_ERROR_RESPONSE, citation_for, rag_messages
+from rag_pipeline import (
+    DB_FAISS_PATH, create_vector_db, load_embeddings, load_vector_db, retrieval_batch_handler, vector_store_version
+)
+from metrics import Gauge, messages_total, recent_traces, render as render_metrics, stage, tokens_total, traced
+
+load_dotenv()
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
 
 # Configure logging
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=LOG_LEVEL,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler('chat_server.log'),
@@ -25,135 +38,177 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",
-    logger=True,
-    engineio_logger=True,
+    # Per-packet Socket.IO/Engine.IO logging only when debugging
+    logger=LOG_LEVEL == 'DEBUG',
+    engineio_logger=LOG_LEVEL == 'DEBUG',
     ping_timeout=300,
     ping_interval=60,
-    async_mode='eventlet'
+    async_mode='eventlet',
+    message_queue=SOCKETIO_MESSAGE_QUEUE
 )
 
 # Constants
-DATA_PATH = os.getenv('DATA_PATH', 'data/')
-DB_FAISS_PATH = os.getenv('DB_FAISS_PATH', 'vectorstores/db_faiss')
-EMBEDDINGS_MODEL = os.getenv('EMBEDDINGS_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
 LLAMA_MODEL = os.getenv('LLAMA_MODEL', 'llama3.2:1b')
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'false').lower() == 'true'
+APPOINTMENT_DETAILS_PATH = 'appointment_details.csv'
+WARM_UP_ON_START = os.getenv('WARM_UP_ON_START', 'true').lower() == 'true'
 
 required_env_vars = ['FLASK_ENV', 'FLASK_APP', 'PORT', 'DATA_PATH', 'DB_FAISS_PATH', 'EMBEDDINGS_MODEL', 'LLAMA_MODEL']
 for var in required_env_vars:
     if os.getenv(var) is None:
         raise EnvironmentError(f"Required environment variable {var} is not set")
 
-custom_prompt_template = """
-You are an insurance agent of Wing Heights Ghana - An insurance provider.
-Use the following pieces of information to answer the user's question.
-Answer the question only if it is present in the given piece of information.
-If you don't know the answer or the question is not related to the provided information, say: "I am an insurance agent and I can only provide insurance solutions offered by our company. Would you like to book an appointment to discuss your insurance needs?"
-
-If the user wants to book an appointment, ask for the following details one by one:
-1. Name
-2. Contact Number
-3. Email
-4. Appointment Date
-5. Insurance Type
-
-After collecting all details, provide a summary of the appointment details.
-
-If the user doesn't want to book an appointment, end the conversation politely.
-
-For basic greetings, respond with short, friendly statements.
-
-Context: {context}
-Question: {question}
-
-Helpful answer:
-"""
-
-def create_vector_db():
-    if not os.path.exists(DATA_PATH) or not os.listdir(DATA_PATH):
-        logger.warning(f"No PDF files found in {DATA_PATH}. Please add your PDF files and restart the application.")
-        return None
-
-    loader = DirectoryLoader(DATA_PATH, glob="*.pdf", loader_cls=PyPDFLoader)
-    documents = loader.load()
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    texts = text_splitter.split_documents(documents)
-
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDINGS_MODEL, model_kwargs={"device": "cpu"})
-    
-    db = FAISS.from_documents(texts, embeddings)
-    os.makedirs(os.path.dirname(DB_FAISS_PATH), exist_ok=True)
-    db.save_local(DB_FAISS_PATH)
-    logger.info(f"Vector store created and saved to {DB_FAISS_PATH}")
-    return db
-
-def load_vector_db():
-    if not os.path.exists(DB_FAISS_PATH):
-        logger.info("Vector store not found. Creating new vector store...")
-        return create_vector_db()
-    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDINGS_MODEL, model_kwargs={"device": "cpu"})
-    return FAISS.load_local(DB_FAISS_PATH, embeddings, allow_dangerous_deserialization=True)
-
 def load_llm():
-    def ollama_chat(query, context=""):
-        try:
-            response = ollama.chat(
+    import ollama
+
+    def complete(messages, on_chunk, timeout):
+        # The chat API takes no per-request timeout, so the client carries the
+        # time left before the dispatcher's deadline
+        client = ollama.Client(timeout=timeout)
+        if on_chunk is not None:
+            parts = []
+            for chunk in client.chat(model=LLAMA_MODEL, messages=messages, stream=True):
+                if job_abandoned():
+                    # The caller has timed out and sent the fallback
+                    break
+                content = chunk.get('message', {}).get('content')
+                if content:
+                    parts.append(content)
+                    on_chunk(content)
+            if parts:
+                return ''.join(parts)
+        else:
+            response = client.chat(
                 model=LLAMA_MODEL, 
-                messages=[
-                    {"role": "system", "content": custom_prompt_template.format(context=context, question=query)},
-                    {"role": "user", "content": query}
-                ]
+                messages=messages
             )
             if response and 'message' in response and 'content' in response['message']:
                 return response['message']['content']
+        return LLM_FALLBACK_RESPONSE
+
+    def ollama_chat(query, context="", on_chunk=None):
+        messages = rag_messages(query, context)
+        try:
+            return llm_dispatcher.call(lambda timeout: complete(messages, on_chunk, timeout), priority=PRIORITY_CHAT)
+        except QueueFullError:
+            logger.warning("LLM queue full, turning away request")
+            return LLM_BUSY_RESPONSE
         except Exception as e:
             logger.error(f"Error in ollama_chat: {str(e)}")
-        return "I apologize, but I couldn't process your request. How else can I assist you with our insurance services?"
+        return LLM_FALLBACK_RESPONSE
 
     return ollama_chat
 
-def retrieval_qa_chain(llm, db):
-    retriever = db.as_retriever(search_kwargs={'k': 2})
+def retrieval_qa_chain(llm, batcher):
+    semantic_cache.bind(vector_store_version())
 
-    def qa_chain(query):
+    def qa_chain(query, on_chunk=None, k=None, query_vector=None):
         try:
-            docs = retriever.get_relevant_documents(query)
-            context = "\n".join([doc.page_content for doc in docs])
-            response = llm(query, context)
+            # The query is embedded once (or not at all when the intent
+            # classifier already did) and the vector shared between the answer
+            # cache and the FAISS search, batched with concurrent queries
+            with stage('retrieve'):
+                query_vector, cached, docs = batcher.submit((query, k, query_vector))
+            if cached is not None:
+                answer, sources = cached
+                response = answer + citation_for(answer, sources)
+                if on_chunk is not None:
+                    on_chunk(response)
+                return response
+
+            with stage('prompt'):
+                context, sources = context_builder.build_with_sources(docs)
+            with stage('llm'):
+                response = llm(query, context, on_chunk=on_chunk)
+            if response not in (LLM_FALLBACK_RESPONSE, LLM_BUSY_RESPONSE):
+                # Cached with its sources; the citation is added per reply
+                semantic_cache.store(query_vector, response, sources)
+                citation = citation_for(response, sources)
+                if citation:
+                    if on_chunk is not None:
+                        on_chunk(citation)
+                    response += citation
             return response
         except Exception as e:
             logger.error(f"Error in qa_chain: {str(e)}")
-            return "I apologize, but I encountered an error processing your request."
+            return RAG_ERROR_RESPONSE
 
     return qa_chain
 
-# Initialize the components
-try:
-    db = load_vector_db()
-    llm = load_llm()
-    qa_chain = retrieval_qa_chain(llm, db)
-    chat_sessions = {}
-except Exception as e:
-    logger.error(f"Error initializing components: {str(e)}")
-    raise
+# Components are built on first use or by the background warm-up
+# Builds run in native threads, so a request that needs a component before
+# the warm-up has finished waits without blocking the hub
+registry = ComponentRegistry(executor=tpool.execute, event=patcher.original('threading').Event)
+registry.register('embeddings', load_embeddings)
+registry.register('vector_store', lambda: load_vector_db(registry.get('embeddings')))
+registry.register('llm', load_llm)
+registry.register('retrieval_batcher', lambda: MicroBatcher(
+    retrieval_batch_handler(registry.get('vector_store')), executor=tpool.execute, name='retrieval-batcher'
+))
+registry.register('qa_chain', lambda: retrieval_qa_chain(registry.get('llm'), registry.get('retrieval_batcher')))
+registry.register('intent_classifier', lambda: CentroidClassifier(registry.get('embeddings'), executor=tpool.execute))
+
+connected_clients = Gauge('connected_clients', "Open Socket.IO connections")
+
+def warm_up():
+    # Runs in a native thread so model loading doesn't stall the eventlet hub
+    tpool.execute(registry.warm_up)
+
+if WARM_UP_ON_START:
+    socketio.start_background_task(warm_up)
+
+@app.route('/health')
+def health():
+    ready = registry.ready()
+    return jsonify({'ready': ready, 'components': registry.status()}), 200 if ready else 503
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(semantic_cache.stats())
+
+@app.route('/llm/stats')
+def llm_stats():
+    return jsonify(llm_dispatcher.stats())
+
+@app.route('/retrieval/stats')
+def retrieval_stats():
+    batcher = registry.peek('retrieval_batcher')
+    return jsonify(batcher.stats() if batcher else {})
+
+@app.route('/intents/stats')
+def intent_stats():
+    return jsonify(intent_router.stats())
+
+@app.route('/sessions/stats')
+def session_stats():
+    return jsonify(session_manager.stats())
+
+@app.route('/metrics')
+def metrics():
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/traces')
+def traces():
+    return jsonify(list(recent_traces))
+
+@socketio.on('health')
+def handle_health():
+    emit('health', {'ready': registry.ready(), 'components': registry.status()})
 
 @socketio.on('connect')
 def handle_connect():
     session_id = request.sid
     logger.info(f"Client connected: {session_id}")
-    logger.debug(f"Connection headers: {request.headers}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Connection headers: {request.headers}")
+    connected_clients.inc()
     
-    chat_sessions[session_id] = {
-        'appointment_details': {},
-        'booking_confirmed': False,
-        'awaiting_confirmation': False
-    }
+    session_manager.put(session_id, new_session())
     join_room(session_id)
     emit('message', {'response': "Hello! I'm an AI assistant for Wing Heights Ghana Insurance. How can I help you today?"})
 
@@ -161,8 +216,8 @@ def handle_connect():
 def handle_disconnect():
     session_id = request.sid
     logger.info(f"Client disconnected: {session_id}")
-    if session_id in chat_sessions:
-        del chat_sessions[session_id]
+    connected_clients.dec()
+    session_manager.delete(session_id)
     leave_room(session_id)
 
 @socketio.on_error()
@@ -171,6 +226,7 @@ def error_handler(e):
     emit('message', {'error': 'An internal error occurred'})
 
 @socketio.on('message')
+@traced('handle_message')
 def handle_message(data):
     session_id = request.sid
     logger.info(f"Received message from {session_id}: {data}")
@@ -182,72 +238,58 @@ def handle_message(data):
         emit('message', {'error': "No message provided"})
         return
 
-    try:
-        session = chat_sessions[session_id]
-
-        if session['appointment_details'] and session['booking_confirmed']:
-            appointment_fields = ["Name", "Contact Number", "Email", "Appointment Date", "Insurance Type"]
-            current_field = appointment_fields[len(session['appointment_details'])]
-            
-            session['appointment_details'][current_field] = user_input
-
-            if len(session['appointment_details']) < len(appointment_fields):
-                next_field = appointment_fields[len(session['appointment_details'])]
-                response = f"Thank you. Now, please provide your {next_field}:"
-            else:
-                summary = "Appointment Details:\n"
-                for field in appointment_fields:
-                    summary += f"{field}: {session['appointment_details'].get(field, 'Not provided')}\n"
-                response = f"Thank you for providing all the details. Here's a summary of your appointment:\n\n{summary}\nWe look forward to assisting you!"
-                
-                try:
-                    with open('appointment_details.csv', mode='a', newline='', encoding='utf-8') as file:
-                        writer = csv.writer(file)
-                        writer.writerow([session['appointment_details'].get(field, 'Not provided') for field in appointment_fields])
-                except Exception as e:
-                    logger.error(f"Error writing to CSV: {str(e)}")
-                
-                session['appointment_details'] = {}
-                session['booking_confirmed'] = False
-        elif session['awaiting_confirmation']:
-            if user_input.lower() == 'yes':
-                session['booking_confirmed'] = True
-                session['appointment_details'] = {}
-                response = "Great! Let's book an appointment. Please provide your Name:"
-            elif user_input.lower() == 'no':
-                response = "No problem. How else can I assist you with our insurance services?"
-                session['appointment_details'] = {}
-                session['booking_confirmed'] = False
-            else:
-                response = "I'm sorry, I didn't understand your response. Please answer with 'Yes' or 'No'. Would you like to book an appointment?"
-            session['awaiting_confirmation'] = user_input.lower() not in ['yes', 'no']
-        else:
-            response = qa_chain(user_input)
-            
-            if "book an appointment" in response.lower():
-                response += "\n\nWould you like to book an appointment? Please respond with 'Yes' or 'No'."
-                session['awaiting_confirmation'] = True
+    stream = data.get('stream', STREAM_RESPONSES)
 
-        requires_input = session['awaiting_confirmation'] or (session['appointment_details'] and session['booking_confirmed'])
+    try:
+        # Expired, or connected before a restart
+        session = session_manager.get(session_id) or new_session()
+
+        intent = None
+        if not in_booking_flow(session):
+            # Greetings, thanks, farewells and booking requests skip FAISS and
+            # Ollama; the embedding classifier joins in once it has warmed up
+            with stage('intent'):
+                intent = intent_router.classify(user_input, registry.peek('intent_classifier'))
+
+        response, completed = booking_turn(session, user_input, intent)
+        if completed is not None:
+            history_writer.write(APPOINTMENT_DETAILS_PATH, completed)
+        if response is None:
+            # Chunks are produced on a dispatcher worker, outside the request context
+            on_chunk = (lambda chunk: socketio.emit('response_chunk', {'chunk': chunk}, to=session_id)) if stream else None
+            response = registry.get('qa_chain')(user_input, on_chunk=on_chunk,
+                                                query_vector=intent.vector if intent else None)
+
+            booking_prompt = offer_booking(session, response)
+            if booking_prompt:
+                response += booking_prompt
+                if stream:
+                    emit('response_chunk', {'chunk': booking_prompt})
+
+        session_manager.put(session_id, session)
+        awaiting_input = requires_input(session)
         token_count = len(response.split())
         max_tokens = 2000
+        tokens_total.inc(token_count, kind='response')
+        messages_total.inc(event='message', outcome=intent.name if intent else 'booking_flow')
 
         logger.info(f"Sending response to {session_id}: {response[:100]}...")
-        emit('message', {
+        emit('response_done' if stream else 'message', {
             "response": response,
-            "requires_input": requires_input,
+            "requires_input": awaiting_input,
             "token_count": token_count,
             "max_tokens": max_tokens
         })
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}", exc_info=True)
+        messages_total.inc(event='message', outcome='error')
         emit('message', {"error": str(e)})
 
 if __name__ == "__main__":
     try:
         if not os.path.exists(DB_FAISS_PATH):
             logger.info("Vector store not found. Creating new vector store...")
-            db = create_vector_db()
+            db = create_vector_db(registry.get('embeddings'))
             if db is None:
                 logger.error("Failed to create vector store.")
                 exit(1)
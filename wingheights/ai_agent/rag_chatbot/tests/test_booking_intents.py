@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from appointment_flow import BOOKING_CANCELLED_RESPONSE, BOOKING_START_RESPONSE, booking_turn, new_session  # noqa: E402
+from intent_router import AFFIRM, BOOKING, DENY, OPEN, IntentRouter  # noqa: E402
+from prompts import offers_appointment  # noqa: E402
+
+router = IntentRouter()
+
+
+@pytest.mark.parametrize('text', [
+    "I want to book an appointment",
+    "can I schedule a consultation",
+    "book me in please",
+    "no, I want to book an appointment",
+])
+def test_booking(text):
+    assert router.classify(text).name == BOOKING
+
+
+@pytest.mark.parametrize('text', [
+    "I don't want to book an appointment",
+    "i don't need an appointment right now",
+    "I do not want to schedule a consultation",
+    "no need to set up a meeting",
+])
+def test_negated_booking_is_a_refusal(text):
+    assert router.classify(text).name == DENY
+
+
+@pytest.mark.parametrize('text', [
+    "what does my policy schedule cover",
+    "how do I proceed with a claim",
+])
+def test_policy_nouns_are_not_booking(text):
+    assert router.classify(text).name == OPEN
+
+
+def test_proceed_alone_is_affirm():
+    assert router.classify("proceed").name == AFFIRM
+
+
+def test_negated_booking_does_not_start_the_form():
+    session = new_session()
+    response, _ = booking_turn(session, "i don't need an appointment right now",
+                               router.classify("i don't need an appointment right now"))
+    assert response != BOOKING_START_RESPONSE
+    assert not session['booking_confirmed']
+
+
+@pytest.mark.parametrize('text', ["cancel", "no", "I don't want to book an appointment"])
+def test_cancel_while_collecting_fields(text):
+    session = new_session()
+    response, _ = booking_turn(session, "book an appointment", router.classify("book an appointment"))
+    assert response == BOOKING_START_RESPONSE
+    booking_turn(session, "Ama Mensah")
+    response, completed = booking_turn(session, text)
+    assert response == BOOKING_CANCELLED_RESPONSE
+    assert completed is None
+    assert not session['booking_confirmed'] and session['appointment_details'] == {}
+
+
+@pytest.mark.parametrize('response', [
+    "Would you like to proceed with the appointment?",
+    "Health insurance covers hospital stays. Would you like to book a consultation with a specialist?",
+    "Shall I book an appointment for you?",
+    "Do you want me to schedule a call?",
+])
+def test_appointment_offer(response):
+    assert offers_appointment(response)
+
+
+@pytest.mark.parametrize('response', [
+    "If you want to book, just say yes. Anything else I can help with?",
+    "You can book an appointment any time. What else would you like to know?",
+    "Great! I'll help you schedule an appointment. Please fill out the form below.",
+    "Would you like to know more about our insurance options?",
+])
+def test_not_an_appointment_offer(response):
+    assert not offers_appointment(response)
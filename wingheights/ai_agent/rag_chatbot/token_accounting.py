@@ -0,0 +1,68 @@
+import os
+import tiktoken
+
+TOKEN_ENCODING = os.getenv('TOKEN_ENCODING', 'cl100k_base')
+TOKEN_COUNT_THREADS = int(os.getenv('TOKEN_COUNT_THREADS', 1))
+
+
+class TokenUsage:
+    # Running totals for one session; kept as plain ints so stored
+    # messages never have to be re-tokenized.
+    __slots__ = ('message_tokens', 'response_tokens', 'turns')
+
+    def __init__(self, message_tokens=0, response_tokens=0, turns=0):
+        self.message_tokens = message_tokens
+        self.response_tokens = response_tokens
+        self.turns = turns
+
+    @property
+    def total_tokens(self):
+        return self.message_tokens + self.response_tokens
+
+    def to_list(self):
+        return [self.message_tokens, self.response_tokens, self.turns]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(*values)
+
+
+class TokenAccountant:
+    def __init__(self, encoding_name=TOKEN_ENCODING, num_threads=TOKEN_COUNT_THREADS):
+        # Loaded once at startup instead of on every count
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.num_threads = num_threads
+
+    def count(self, text):
+        if not text:
+            return 0
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_batch(self, texts):
+        texts = [text or '' for text in texts]
+        if not texts:
+            return []
+        encoded = self.encoding.encode_ordinary_batch(texts, num_threads=self.num_threads)
+        return [len(tokens) for tokens in encoded]
+
+    def charge_message(self, usage, message):
+        tokens = self.count(message)
+        usage.message_tokens += tokens
+        usage.turns += 1
+        return tokens
+
+    def charge_response(self, usage, *responses):
+        counts = self.count_batch(responses)
+        tokens = sum(counts)
+        usage.response_tokens += tokens
+        return tokens
+
+    def over_budget(self, usage, max_tokens):
+        return usage.total_tokens > max_tokens
+
+
+token_accountant = TokenAccountant()
+
+
+def count_tokens(text):
+    return token_accountant.count(text)